@@ -0,0 +1,2 @@
+from .generator import generate
+from .suite import BENCHMARKS, run, compare
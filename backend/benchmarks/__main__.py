@@ -0,0 +1,28 @@
+import argparse
+import json
+import sys
+from benchmarks.suite import BENCHMARKS, run, compare
+
+parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Inventory4Parts element-layer benchmarks')
+parser.add_argument('names', nargs='*', help=f"benchmarks to run, out of: {', '.join(BENCHMARKS.keys())}")
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--scale', type=float, default=1.0)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument('--engine', choices=['memory', 'mongomock', 'mongod'], default='mongomock')
+parser.add_argument('--output', help='write the JSON results to this file')
+parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+args = parser.parse_args()
+
+result = run(names=args.names or None, seed=args.seed, scale=args.scale, repeat=args.repeat, engine=args.engine)
+if args.output is None:
+    json.dump(result, sys.stdout, indent=2)
+    print()
+else:
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+for name, values in result['results'].items():
+    print(f"{name:<28} median {values['median'] * 1000:10.2f} ms  db calls {values['db_calls']}", file=sys.stderr)
+if args.compare is not None:
+    with open(args.compare, 'r') as f:
+        for name, ratio in compare(json.load(f), result).items():
+            print(f'{name:<28} {ratio:6.2f}x of previous median', file=sys.stderr)
@@ -0,0 +1,97 @@
+import random
+from elements import MountingStyle, Footprint, Category, Unit, Part, Distributor, PartDistributor, StorageGroup, StorageLocation
+from elements import Order, PartLocation, StockChange
+
+SIZES = dict(
+    categories=30,
+    storage_groups=4,
+    storage_locations=60,
+    distributors=5,
+    parts=300,
+    locations_per_part=(1, 3),
+    changes_per_location=(5, 40),
+    orders_per_part=(0, 3)
+)
+EPOCH = 1600000000
+
+
+def _created(result, elements):
+    errors = [r['errors'] for r in result if 'errors' in r]
+    if len(errors) > 0:
+        raise ValueError(f'generating {elements[0].__class__.__name__} failed: {errors[0]}')
+    return [r['created'] for r in result]
+
+
+def _save_many(cls, elements):
+    return _created(cls.save_many(elements), elements) if len(elements) > 0 else list()
+
+
+def _tree(cls, parent_attr, count, rng, **attr):
+    ids = list()
+    for i in range(count):
+        parent = rng.choice(ids) if len(ids) > 0 and rng.random() < 0.7 else None
+        el = cls({'name': f'{cls.__name__.lower()}{i}', parent_attr: parent, **dict((k, rng.choice(v)) for k, v in attr.items())})
+        ids += _created([el.save()], [el])
+    return ids
+
+
+def generate(seed=0, scale=1.0):
+    rng = random.Random(seed)
+    sizes = dict((k, v if isinstance(v, tuple) else max(1, int(v * scale))) for k, v in SIZES.items())
+    data = dict()
+    data['MountingStyle'] = _save_many(MountingStyle, [MountingStyle({'name': n}) for n in ['SMD', 'THT', 'Chassis']])
+    data['Footprint'] = _save_many(Footprint, [Footprint({'name': f'fp{i}', 'mounting_style_id': rng.choice(data['MountingStyle'])}) for i in range(20)])
+    data['Unit'] = _save_many(Unit, [Unit({'name': n}) for n in ['pcs', 'm', 'g']])
+    data['Distributor'] = _save_many(Distributor, [Distributor({'name': f'distributor{i}'}) for i in range(sizes['distributors'])])
+    data['StorageGroup'] = _save_many(StorageGroup, [StorageGroup({'name': f'group{i}'}) for i in range(sizes['storage_groups'])])
+    data['Category'] = _tree(Category, 'parent_category_id', sizes['categories'], rng)
+    data['StorageLocation'] = _tree(StorageLocation, 'parent_storage_location_id', sizes['storage_locations'], rng, storage_group_id=data['StorageGroup'])
+
+    parts = list()
+    for i in range(sizes['parts']):
+        fp = rng.choice(data['Footprint']) if rng.random() < 0.8 else None
+        parts.append(Part({'name': f'part{i}', 'unit_id': rng.choice(data['Unit']), 'category_id': rng.choice(data['Category']),
+                           'footprint_id': fp, 'stock_min': rng.randint(0, 50), 'external_number': f'{rng.randrange(10 ** 8):08d}'}))
+    data['Part'] = _save_many(Part, parts)
+    data['PartDistributor'] = _save_many(PartDistributor, [
+        PartDistributor({'part_id': p, 'distributor_id': d, 'pkg_price': round(rng.uniform(0.01, 20), 2), 'pkg_units': rng.choice([1, 10, 100])})
+        for p in data['Part'] for d in rng.sample(data['Distributor'], rng.randint(0, min(2, len(data['Distributor']))))])
+
+    orders = list()
+    for p in data['Part']:
+        for i in range(rng.randint(*sizes['orders_per_part'])):
+            orders.append(Order({'part_id': p, 'distributor_id': rng.choice(data['Distributor']), 'amount': rng.randint(10, 200),
+                                 'price': round(rng.uniform(0.01, 2), 3), 'created_at': EPOCH + rng.randrange(10 ** 7)}))
+    data['Order'] = _save_many(Order, orders)
+    open_orders = dict()
+    for o in Order.all():
+        open_orders.setdefault(o['part_id'], list()).append([o['_id'], o['amount']])
+
+    locations = list()
+    for p in data['Part']:
+        for sl in rng.sample(data['StorageLocation'], min(len(data['StorageLocation']), rng.randint(*sizes['locations_per_part']))):
+            locations.append(PartLocation({'part_id': p, 'storage_location_id': sl}))
+    data['PartLocation'] = _save_many(PartLocation, locations)
+
+    changes = list()
+    for pl in locations:
+        level = 0
+        created_at = EPOCH + rng.randrange(10 ** 6)
+        orders = open_orders.get(pl['part_id'], list())
+        for i in range(rng.randint(*sizes['changes_per_location'])):
+            created_at += rng.randrange(1, 10 ** 5)
+            change = {'part_location_id': pl['_id'], 'created_at': created_at}
+            if level > 0 and rng.random() < 0.4:
+                change['amount'] = -rng.randint(1, level)
+            elif len(orders) > 0 and rng.random() < 0.2:
+                order = rng.choice(orders)
+                change.update({'order_id': order[0], 'amount': rng.randint(1, order[1])})
+                order[1] -= change['amount']
+                if order[1] == 0:
+                    orders.remove(order)
+            else:
+                change.update({'amount': rng.randint(1, 100), 'price': round(rng.uniform(0.01, 2), 3)})
+            level += change['amount']
+            changes.append(StockChange(change))
+    data['StockChange'] = _save_many(StockChange, changes)
+    return data
@@ -0,0 +1,151 @@
+import platform
+import random
+import statistics
+import time
+from helpers.docdb import docDB
+from helpers.config import get_config
+from elements import Part, StorageLocation, PartLocation, StockChange
+from elements._elementBase import ElementBase
+from benchmarks.generator import generate
+
+BENCHMARKS = dict()
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def connect(engine='mongomock'):
+    config = get_config('mongodb')
+    database = f"{config['database']}_benchmark"
+    if engine == 'memory':
+        if not get_config('storage')['engine'] == 'memory':
+            raise RuntimeError('the memory engine needs storage.engine set to memory in config.json')
+        docDB.clear()
+        return None
+    elif engine in ['mongomock', 'mongod'] and get_config('storage')['engine'] == 'memory':
+        raise RuntimeError(f'the {engine} engine needs storage.engine set to mongodb in config.json')
+    elif engine == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError('the mongomock engine needs the mongomock package installed')
+        client = mongomock.MongoClient()
+    elif engine == 'mongod':
+        from pymongo import MongoClient
+        client = MongoClient(host=config['host'], port=int(config['port']), serverSelectionTimeoutMS=2000)
+    else:
+        raise ValueError(f'unknown engine {engine}')
+    client.drop_database(database)
+    docDB.attach(client, database)
+    return database
+
+
+@benchmark('ElementBase.all')
+def all_parts(data, rng):
+    return lambda: Part.all()
+
+
+@benchmark('Part.json')
+def part_json(data, rng):
+    ids = rng.sample(data['Part'], min(50, len(data['Part'])))
+    return lambda: [Part.get(i).json() for i in ids]
+
+
+@benchmark('Part.json_many')
+def part_json_many(data, rng):
+    return lambda: Part.json_many(Part.all())
+
+
+@benchmark('Part.json_encoded')
+def part_json_encoded(data, rng):
+    return lambda: Part.json_encoded(Part.all())
+
+
+@benchmark('Part.search')
+def part_search(data, rng):
+    queries = [f'part{rng.randrange(len(data["Part"]))}'[:rng.randint(3, 6)] for i in range(20)]
+    return lambda: [Part.search(q, facets=True) for q in queries]
+
+
+@benchmark('PartLocation.stock_price')
+def partlocation_stock_price(data, rng):
+    ids = rng.sample(data['PartLocation'], min(50, len(data['PartLocation'])))
+    return lambda: [PartLocation.get(i).stock_price() for i in ids]
+
+
+@benchmark('StockChange.save')
+def stockchange_save(data, rng):
+    pl = rng.choice(data['PartLocation'])
+    changes = [StockChange({'part_location_id': pl, 'amount': rng.randint(1, 100), 'price': 0.5}) for i in range(20)]
+
+    def save():
+        for sc in changes:
+            sc.save()
+    return save
+
+
+@benchmark('StorageLocation.delete')
+def storagelocation_delete(data, rng):
+    sl = StorageLocation({'name': 'benchmark'})
+    sl.save()
+    parts = rng.sample(data['Part'], min(20, len(data['Part'])))
+    locations = [PartLocation({'part_id': p, 'storage_location_id': sl['_id']}) for p in parts]
+    PartLocation.save_many(locations)
+    StockChange.save_many([StockChange({'part_location_id': pl['_id'], 'amount': rng.randint(1, 10)}) for pl in locations for i in range(10)])
+    return lambda: sl.delete()
+
+
+def measure(setup, data, rng, repeat):
+    durations = list()
+    calls = list()
+    for i in range(repeat):
+        func = setup(data, rng)
+        with docDB.call_log(threshold=float('inf')) as log:
+            started = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started)
+        calls.append(log.calls)
+    return {
+        'runs': repeat,
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'mean': statistics.mean(durations),
+        'max': max(durations),
+        'db_calls': min(calls)
+    }
+
+
+def run(names=None, seed=0, scale=1.0, repeat=5, engine='mongomock'):
+    database = connect(engine)
+    ElementBase.ensure_indexes()
+    started = time.perf_counter()
+    data = generate(seed=seed, scale=scale)
+    meta = {
+        'seed': seed,
+        'scale': scale,
+        'repeat': repeat,
+        'engine': engine,
+        'database': database,
+        'python': platform.python_version(),
+        'started_at': int(time.time()),
+        'generate_seconds': time.perf_counter() - started,
+        'documents': dict((k, len(v)) for k, v in data.items())
+    }
+    rng = random.Random(seed)
+    results = dict()
+    for name, setup in BENCHMARKS.items():
+        if names is None or name in names:
+            results[name] = measure(setup, data, rng, repeat)
+    return {'meta': meta, 'results': results}
+
+
+def compare(before, after, key='median'):
+    result = dict()
+    for name, values in after['results'].items():
+        if name in before['results'] and before['results'][name][key] > 0:
+            result[name] = values[key] / before['results'][name][key]
+    return result
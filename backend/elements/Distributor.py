@@ -1,4 +1,4 @@
-from elements._elementBase import ElementBase, docDB
+from elements._elementBase import ElementBase
 
 
 class Distributor(ElementBase):
@@ -7,10 +7,3 @@ class Distributor(ElementBase):
         desc=ElementBase.addAttr(default='', notnone=True),
         url=ElementBase.addAttr(default='', notnone=True)
     )
-
-    def delete_pre(self):
-        from elements import PartDistributor
-        for pd in docDB.search_many('PartDistributor', {'distributor_id': self['_id']}):
-            pd = PartDistributor(pd)
-            pd.delete()
-        docDB.update_many('Order', {'distributor_id': self['_id']}, {'$set': {'distributor_id': None}})
@@ -1,17 +1,8 @@
-from elements._elementBase import ElementBase, docDB
+from elements._elementBase import ElementBase
 
 
 class Footprint(ElementBase):
     _attrdef = dict(
         name=ElementBase.addAttr(unique=True, notnone=True),
-        mounting_style_id=ElementBase.addAttr()
+        mounting_style_id=ElementBase.addAttr(fk='MountingStyle', ondelete='setnull')
     )
-
-    def validate(self):
-        errors = dict()
-        if self['mounting_style_id'] is not None and not docDB.exists('MountingStyle', self['mounting_style_id']):
-            errors['mounting_style_id'] = f"There is no MountingStyle with id '{self['mounting_style_id']}'"
-        return errors
-
-    def delete_pre(self):
-        docDB.update_many('Part', {'footprint_id': self['_id']}, {'$set': {'footprint_id': None}})
@@ -1,4 +1,4 @@
-from elements._elementBase import ElementBase, docDB
+from elements._elementBase import ElementBase
 
 
 class MountingStyle(ElementBase):
@@ -6,7 +6,3 @@ class MountingStyle(ElementBase):
         name=ElementBase.addAttr(unique=True, notnone=True),
         desc=ElementBase.addAttr(default='', notnone=True)
     )
-
-    def delete_pre(self):
-        docDB.update_many('Footprint', {'mounting_style_id': self['_id']}, {'$set': {'mounting_style_id': None}})
-        docDB.update_many('Part', {'mounting_style_id': self['_id']}, {'$set': {'mounting_style_id': None}})
@@ -4,19 +4,17 @@ import time
 
 class Order(ElementBase):
     _attrdef = dict(
-        part_id=ElementBase.addAttr(notnone=True),
-        distributor_id=ElementBase.addAttr(),
+        part_id=ElementBase.addAttr(notnone=True, fk='Part', ondelete='cascade'),
+        distributor_id=ElementBase.addAttr(fk='Distributor', ondelete='setnull'),
         created_at=ElementBase.addAttr(type=int),
         amount=ElementBase.addAttr(type=int, default=1, notnone=True),
         price=ElementBase.addAttr(type=float, default=0.0, notnone=True)
     )
+    _derivedattr = ('completed',)
+    _depends = ('StockChange',)
 
     def validate(self):
         errors = dict()
-        if not docDB.exists('Part', self['part_id']):
-            errors['part_id'] = f"There is no Part with id '{self['part_id']}'"
-        if self['distributor_id'] is not None and not docDB.exists('Distributor', self['distributor_id']):
-            errors['distributor_id'] = f"There is no Distributor with id '{self['distributor_id']}'"
         if self['amount'] < 1:
             errors['amount'] = 'Needs to be one or more'
         if self['price'] < 0:
@@ -29,13 +27,22 @@ class Order(ElementBase):
         if self['created_at'] is None:
             self['created_at'] = int(time.time())
 
-    def delete_pre(self):
-        docDB.update_many('StockChange', {'order_id': self['_id']}, {'$set': {'order_id': None}})
-
     def completed(self):
+        if 'completed' in self._cache:
+            return self._cache['completed']
         completed = docDB.sum('StockChange', 'amount', {'order_id': self['_id']})
         return completed == self['amount']
 
+    @classmethod
+    def completed_many(cls, elements):
+        completed = docDB.sum_grouped('StockChange', 'amount', 'order_id', {'order_id': {'$in': [o['_id'] for o in elements]}})
+        for order in elements:
+            order._cache['completed'] = completed.get(order['_id'], 0) == order['amount']
+
+    @classmethod
+    def derived_queries(cls, elements):
+        return [lambda: cls.completed_many(elements)]
+
     def json(self):
         result = super().json()
         result['completed'] = self.completed()
@@ -1,29 +1,29 @@
 from elements._elementBase import ElementBase, docDB
-from elements import Footprint
+from elements import Footprint, Category
+from helpers import search
 
 
 class Part(ElementBase):
     _attrdef = dict(
         name=ElementBase.addAttr(notnone=True),
         desc=ElementBase.addAttr(default='', notnone=True),
-        unit_id=ElementBase.addAttr(notnone=True),
-        footprint_id=ElementBase.addAttr(),
-        mounting_style_id=ElementBase.addAttr(),
-        category_id=ElementBase.addAttr(notnone=True),
+        unit_id=ElementBase.addAttr(notnone=True, fk='Unit'),
+        footprint_id=ElementBase.addAttr(fk='Footprint', ondelete='setnull'),
+        mounting_style_id=ElementBase.addAttr(fk='MountingStyle', ondelete='setnull'),
+        category_id=ElementBase.addAttr(notnone=True, fk='Category'),
         stock_min=ElementBase.addAttr(notnone=True, type=int, default=0),
         external_number=ElementBase.addAttr(default='', notnone=True)
     )
+    _derivedattr = ('stock_level', 'stock_price', 'stock_low', 'open_orders')
+    _aux_indexes = {'PartSearch': (('term', 'part_id'), ('part_id',))}
+    _search_weights = dict(name=10.0, external_number=8.0, desc=2.0)
+    _search_prefixes = ('name', 'external_number')
+    _search_candidates = 1000
+    _filters = {'category_subtree': 'category_subtree_filter'}
+    _depends = ('PartLocation', 'PartLocationStock', 'StockChange', 'Order', 'PartSearch', 'CategoryTree')
 
     def validate(self):
         errors = dict()
-        if not docDB.exists('Unit', self['unit_id']):
-            errors['unit_id'] = f"There is no Unit with id '{self['unit_id']}'"
-        if not docDB.exists('Category', self['category_id']):
-            errors['category_id'] = f"There is no Category with id '{self['category_id']}'"
-        if self['mounting_style_id'] is not None and not docDB.exists('MountingStyle', self['mounting_style_id']):
-            errors['mounting_style_id'] = f"There is no MountingStyle with id '{self['mounting_style_id']}'"
-        if self['footprint_id'] is not None and not docDB.exists('Footprint', self['footprint_id']):
-            errors['footprint_id'] = f"There is no Footprint with id '{self['footprint_id']}'"
         if self['stock_min'] < 0:
             errors['stock_min'] = "Can't be negative"
         return errors
@@ -33,56 +33,120 @@ class Part(ElementBase):
             fp = Footprint.get(self['footprint_id'])
             self['mounting_style_id'] = fp['mounting_style_id']
 
-    def delete_pre(self):
-        from elements import PartDistributor, Order, PartLocation
-        for pd in docDB.search_many('PartDistributor', {'part_id': self['_id']}):
-            pd = PartDistributor(pd)
-            pd.delete()
-        for order in docDB.search_many('Order', {'part_id': self['_id']}):
-            order = Order(order)
-            order.delete()
-        for pl in docDB.search_many('PartLocation', {'part_id': self['_id']}):
-            pl = PartLocation(pl)
-            pl.delete()
+    @classmethod
+    def category_subtree_filter(cls, category_id):
+        return {'category_id': {'$in': Category.subtree(category_id)}}
 
-    def stock_level(self):
-        if 'stock_level' in self._cache:
-            return self._cache['stock_level']
-        from elements import PartLocation
-        result = 0
-        for pl in docDB.search_many('PartLocation', {'part_id': self['_id']}):
-            pl = PartLocation(pl)
-            result += pl.stock_level()
-        self._cache['stock_level'] = result
+    @classmethod
+    def save_many_post(cls, elements):
+        super().save_many_post(elements)
+        cls.search_update(elements)
+
+    @classmethod
+    def delete_many_post(cls, deleted):
+        docDB.delete_many('PartSearch', {'part_id': {'$in': [d['_id'] for d in deleted]}})
+        super().delete_many_post(deleted)
+
+    @classmethod
+    def search_update(cls, elements):
+        docDB.delete_many('PartSearch', {'part_id': {'$in': [el['_id'] for el in elements]}})
+        rows = list()
+        for el in elements:
+            for term, weight in search.index_terms(el._attr, cls._search_weights, cls._search_prefixes).items():
+                rows.append({'_id': f"{el['_id']}:{term}", 'part_id': el['_id'], 'term': term, 'weight': weight})
+        docDB.write_many('PartSearch', rows)
+
+    @classmethod
+    def search_rebuild(cls, chunk=1000):
+        docDB.delete_many('PartSearch', dict())
+        elements = list()
+        for el in cls.iterate():
+            elements.append(el)
+            if len(elements) == chunk:
+                cls.search_update(elements)
+                elements = list()
+        cls.search_update(elements)
+
+    @classmethod
+    def search(cls, q, what=None, limit=20, offset=0, facets=False):
+        terms = search.query_terms(q)
+        if len(terms) == 0:
+            return None
+        scores = None
+        if len(terms) > 1:
+            terms = sorted(terms, key=lambda term: docDB.count('PartSearch', {'term': term}))
+        for term in terms:
+            what_term = {'term': term} if scores is None else {'term': term, 'part_id': {'$in': list(scores)}}
+            found = dict((row['part_id'], row['weight']) for row in docDB.search_many('PartSearch', what_term, fields=['part_id', 'weight']))
+            scores = found if scores is None else dict((part_id, score + found[part_id]) for part_id, score in scores.items() if part_id in found)
+            if len(scores) == 0:
+                break
+        what = what or dict()
+        ranked = sorted(scores, key=lambda part_id: (-scores[part_id], part_id))
+        found = list()
+        checked = 0
+        while checked < len(ranked) and len(found) < cls._search_candidates:
+            restrict = {'_id': {'$in': ranked[checked:checked + cls._search_candidates]}}
+            query = {'$and': [what, restrict]} if '_id' in what else {**what, **restrict}
+            found.extend(docDB.search_many(cls.__name__, query, fields=['name', 'category_id', 'footprint_id']))
+            checked += cls._search_candidates
+        found.sort(key=lambda d: (-scores[d['_id']], d['name']))
+        found_page = found[offset:offset + limit]
+        page = cls.get_many([d['_id'] for d in found_page])
+        result = {'total': len(found), 'capped': checked < len(ranked), 'results': [(page[d['_id']], scores[d['_id']]) for d in found_page if d['_id'] in page]}
+        if facets:
+            result['facets'] = dict((attr, dict()) for attr in ['category_id', 'footprint_id'])
+            for d in found:
+                for attr, counts in result['facets'].items():
+                    counts[d.get(attr, None)] = counts.get(d.get(attr, None), 0) + 1
         return result
 
+    def stock_level(self):
+        if 'stock_level' not in self._cache:
+            self.__class__.stock_many([self])
+        return self._cache['stock_level']
+
     def stock_price(self):
-        if 'stock_price' in self._cache:
-            return self._cache['stock_price']
-        from decimal import Decimal
-        from elements import PartLocation
-        result = Decimal('0.0')
-        for pl in docDB.search_many('PartLocation', {'part_id': self['_id']}):
-            pl = PartLocation(pl)
-            result += Decimal(str(pl.stock_price()))
-        self._cache['stock_price'] = float(result)
-        return float(result)
+        if 'stock_price' not in self._cache:
+            self.__class__.stock_many([self])
+        return self._cache['stock_price']
 
     def stock_low(self):
         return self.stock_level() < self['stock_min']
 
     def open_orders(self):
-        if 'open_orders' in self._cache:
-            return self._cache['open_orders']
+        if 'open_orders' not in self._cache:
+            self.__class__.open_orders_many([self])
+        return self._cache['open_orders']
+
+    @classmethod
+    def derived_queries(cls, elements):
+        return [lambda: cls.stock_many(elements), lambda: cls.open_orders_many(elements)]
+
+    @classmethod
+    def stock_many(cls, elements):
+        from decimal import Decimal
+        from elements import PartLocation
+        ids = [p['_id'] for p in elements]
+        pls = [PartLocation(pl) for pl in docDB.search_many('PartLocation', {'part_id': {'$in': ids}})]
+        PartLocation.stock_many(pls)
+        stock_level = dict((i, 0) for i in ids)
+        stock_price = dict((i, Decimal('0.0')) for i in ids)
+        for pl in pls:
+            stock_level[pl['part_id']] += pl.stock_level()
+            stock_price[pl['part_id']] += Decimal(str(pl.stock_price()))
+        for p in elements:
+            p._cache['stock_level'] = stock_level[p['_id']]
+            p._cache['stock_price'] = float(stock_price[p['_id']])
+
+    @classmethod
+    def open_orders_many(cls, elements):
         from elements import Order
-        result = False
-        for order in docDB.search_many('Order', {'part_id': self['_id']}):
-            order = Order(order)
-            if not order.completed():
-                result = True
-                break
-        self._cache['open_orders'] = result
-        return result
+        orders = [Order(o) for o in docDB.search_many('Order', {'part_id': {'$in': [p['_id'] for p in elements]}})]
+        Order.completed_many(orders)
+        open_orders = set(order['part_id'] for order in orders if not order.completed())
+        for p in elements:
+            p._cache['open_orders'] = p['_id'] in open_orders
 
     def json(self):
         result = super().json()
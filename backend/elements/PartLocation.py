@@ -3,54 +3,167 @@ from elements._elementBase import ElementBase, docDB
 
 class PartLocation(ElementBase):
     _attrdef = dict(
-        part_id=ElementBase.addAttr(notnone=True),
-        storage_location_id=ElementBase.addAttr(notnone=True),
+        part_id=ElementBase.addAttr(notnone=True, fk='Part', ondelete='cascade'),
+        storage_location_id=ElementBase.addAttr(notnone=True, fk='StorageLocation', ondelete='cascade'),
         desc=ElementBase.addAttr(default='', notnone=True),
-        default=ElementBase.addAttr(type=bool, default=False, notnone=True)
+        default=ElementBase.addAttr(type=bool, default=False, notnone=True, singleton=True)
     )
+    _derivedattr = ('stock_level', 'stock_price')
+    _bulk_sequential = True
+    _depends = ('PartLocationStock', 'StockChange')
 
-    def validate(self):
-        errors = dict()
-        if not docDB.exists('Part', self['part_id']):
-            errors['part_id'] = f"There is no Part with id '{self['part_id']}'"
-        if not docDB.exists('StorageLocation', self['storage_location_id']):
-            errors['storage_location_id'] = f"There is no StorageLocation with id '{self['storage_location_id']}'"
-        return errors
-
-    def save_pre(self):
-        if len(self.__class__.all()) == 0:
-            self['default'] = True
-        if self['default']:
-            docDB.update_many(self.__class__.__name__, {'default': True}, {'$set': {'default': False}})
-
-    def delete_pre(self):
-        from elements import StockChange
-        for sc in docDB.search_many('StockChange', {'part_location_id': self['_id']}):
-            sc = StockChange(sc)
-            sc.delete()
-
-    def delete_post(self):
-        if docDB.search_one(self.__class__.__name__, {'default': True}) is None:
-            somepl = docDB.search_one(self.__class__.__name__, {})
-            if somepl is not None:
-                somepl = PartLocation(somepl)
-                somepl['default'] = True
-                somepl.save()
+    def save_post(self):
+        if not docDB.exists('PartLocationStock', self['_id']):
+            self.__class__.stock_rebuild(self['_id'])
+
+    @classmethod
+    def delete_many_post(cls, deleted):
+        docDB.delete_many('PartLocationStock', {'_id': {'$in': [d['_id'] for d in deleted]}})
+        super().delete_many_post(deleted)
+
+    @classmethod
+    def stock_state(cls, pl_id, stock_level, removed, positives):
+        stock = {'_id': pl_id, 'stock_level': stock_level, 'removed': removed, 'layers': list()}
+        for sc in positives:
+            stock['layers'].append({'_id': sc['_id'], 'amount': sc['amount'], 'price': sc['price']})
+        consumed, amount = cls.stock_consumed(stock)
+        stock['layers'] = stock['layers'][len(consumed):]
+        stock['removed'] -= amount
+        return stock
+
+    @staticmethod
+    def stock_consumed(stock):
+        consumed = list()
+        removed = stock['removed']
+        for layer in stock['layers']:
+            if removed < layer['amount']:
+                break
+            consumed.append(layer['_id'])
+            removed -= layer['amount']
+        return consumed, stock['removed'] - removed
+
+    @classmethod
+    def stock_rebuild(cls, pl_id):
+        stock = cls.stock_state(
+            pl_id,
+            docDB.sum('StockChange', 'amount', {'part_location_id': pl_id}),
+            docDB.sum('StockChange', 'amount', {'part_location_id': pl_id, 'amount': {'$lt': 0}}) * -1,
+            docDB.search_many('StockChange', {'part_location_id': pl_id, 'amount': {'$gt': 0}}))
+        docDB.replace('PartLocationStock', stock)
+        return stock
+
+    @classmethod
+    def stock_counter(cls, pl_id):
+        stock = docDB.get('PartLocationStock', pl_id)
+        if stock is None or 'layers' not in stock:
+            stock = cls.stock_rebuild(pl_id)
+        return stock
+
+    @classmethod
+    def stock_book_many(cls, scs):
+        groups = dict()
+        for sc in scs:
+            group = groups.setdefault(sc['part_location_id'], {'stock_level': 0, 'removed': 0, 'layers': list()})
+            group['stock_level'] += sc['amount']
+            if sc['amount'] > 0:
+                group['layers'].append({'_id': sc['_id'], 'amount': sc['amount'], 'price': sc['price']})
+            else:
+                group['removed'] -= sc['amount']
+        for pl_id, group in groups.items():
+            book = {'$inc': {'stock_level': group['stock_level'], 'removed': group['removed']}}
+            if len(group['layers']) > 0:
+                book['$push'] = {'layers': {'$each': group['layers']}}
+            docDB.update_one('PartLocationStock', {'_id': pl_id}, book)
+        consuming = [pl_id for pl_id, group in groups.items() if group['removed'] > 0]
+        if len(consuming) == 0:
+            return
+        for stock in docDB.search_many('PartLocationStock', {'_id': {'$in': consuming}}):
+            if 'layers' not in stock:
+                continue
+            consumed, amount = cls.stock_consumed(stock)
+            if len(consumed) > 0:
+                compact = {'$pull': {'layers': {'_id': {'$in': consumed}}}, '$inc': {'removed': amount * -1}}
+                docDB.update_one('PartLocationStock', {'_id': stock['_id'], 'layers._id': {'$all': consumed}}, compact)
+
+    @classmethod
+    def stock_unbook_many(cls, scs):
+        groups = dict()
+        for sc in scs:
+            group = groups.setdefault(sc['part_location_id'], {'stock_level': 0, 'removed': 0, 'layers': dict()})
+            group['stock_level'] -= sc['amount']
+            if sc['amount'] > 0:
+                group['layers'][sc['_id']] = sc['amount']
+            else:
+                group['removed'] += sc['amount']
+        rebuild = list()
+        for stock in docDB.search_many('PartLocationStock', {'_id': {'$in': list(groups)}}):
+            group = groups[stock['_id']]
+            if 'layers' not in stock:
+                continue
+            removed = stock['removed'] + group['removed']
+            before = 0
+            present = 0
+            for layer in stock['layers']:
+                if layer['_id'] in group['layers']:
+                    present += 1
+                    if before < removed:
+                        break
+                before += layer['amount']
+            if removed < 0 or not present == len(group['layers']) or before < removed:
+                rebuild.append(stock['_id'])
+                continue
+            what = {'_id': stock['_id'], 'removed': {'$gte': group['removed'] * -1}}
+            unbook = {'$inc': {'stock_level': group['stock_level'], 'removed': group['removed']}}
+            if len(group['layers']) > 0:
+                what['layers._id'] = {'$all': list(group['layers'])}
+                unbook['$pull'] = {'layers': {'_id': {'$in': list(group['layers'])}}}
+            if not docDB.update_one('PartLocationStock', what, unbook):
+                rebuild.append(stock['_id'])
+        if len(rebuild) > 0:
+            for pl in docDB.search_many(cls.__name__, {'_id': {'$in': rebuild}}, fields=['_id']):
+                cls.stock_rebuild(pl['_id'])
+
+    @classmethod
+    def stock_check(cls, rebuild=False):
+        levels = docDB.sum_grouped('StockChange', 'amount', 'part_location_id')
+        removed = docDB.sum_grouped('StockChange', 'amount', 'part_location_id', {'amount': {'$lt': 0}})
+        positives = dict()
+        for sc in docDB.search_many('StockChange', {'amount': {'$gt': 0}}):
+            positives.setdefault(sc['part_location_id'], list()).append(sc)
+        stored = dict((s['_id'], s) for s in docDB.search_many('PartLocationStock', {}))
+        result = list()
+        for pl in docDB.search_many(cls.__name__, {}, fields=['_id']):
+            stock = cls.stock_state(pl['_id'], levels.get(pl['_id'], 0), removed.get(pl['_id'], 0) * -1, positives.get(pl['_id'], list()))
+            if not stored.pop(pl['_id'], None) == stock:
+                result.append(pl['_id'])
+                if rebuild:
+                    docDB.replace('PartLocationStock', stock)
+        for orphan in stored.keys():
+            result.append(orphan)
+            if rebuild:
+                docDB.delete('PartLocationStock', orphan)
+        return result
 
     def stock_level(self):
         if 'stock_level' in self._cache:
             return self._cache['stock_level']
-        result = docDB.sum('StockChange', 'amount', {'part_location_id': self['_id']})
+        result = self.__class__.stock_counter(self['_id'])['stock_level']
         self._cache['stock_level'] = result
         return result
 
     def stock_price(self):
         if 'stock_price' in self._cache:
             return self._cache['stock_price']
+        stock = self.__class__.stock_counter(self['_id'])
+        result = self.__class__.fifo_price(stock['removed'], stock['layers'])
+        self._cache['stock_price'] = result
+        return result
+
+    @staticmethod
+    def fifo_price(removed, positives):
         from decimal import Decimal
         result = Decimal('0.0')
-        removed = docDB.sum('StockChange', 'amount', {'part_location_id': self['_id'], 'amount': {'$lt': 0}}) * -1
-        for sc in docDB.search_many('StockChange', {'part_location_id': self['_id'], 'amount': {'$gt': 0}}):
+        for sc in positives:
             if removed == 0:
                 result += Decimal(str(sc['price']))
             elif removed >= sc['amount']:
@@ -58,9 +171,44 @@ class PartLocation(ElementBase):
             else:
                 result += Decimal(str(sc['price'])) / sc['amount'] * (sc['amount'] - removed)
                 removed = 0
-        self._cache['stock_price'] = float(result)
         return float(result)
 
+    @classmethod
+    def stock_many(cls, elements):
+        stocks = dict((s['_id'], s) for s in docDB.search_many('PartLocationStock', {'_id': {'$in': [pl['_id'] for pl in elements]}}))
+        for pl in elements:
+            stock = stocks.get(pl['_id'])
+            if stock is None or 'layers' not in stock:
+                stock = cls.stock_rebuild(pl['_id'])
+            pl._cache['stock_level'] = stock['stock_level']
+            pl._cache['stock_price'] = cls.fifo_price(stock['removed'], stock['layers'])
+
+    @classmethod
+    def stock_rollup(cls, storage_location_ids):
+        from decimal import Decimal
+        storage_location_ids = list(storage_location_ids)
+        elements = list()
+        if len(storage_location_ids) > 0:
+            elements = list(cls.iterate({'storage_location_id': {'$in': storage_location_ids}}, fields=['part_id']))
+            cls.stock_many(elements)
+        parts = dict()
+        for pl in elements:
+            part = parts.setdefault(pl['part_id'], {'part_id': pl['part_id'], 'stock_level': 0, 'stock_price': Decimal('0.0')})
+            part['stock_level'] += pl.stock_level()
+            part['stock_price'] += Decimal(str(pl.stock_price()))
+        parts = [{**p, 'stock_price': float(p['stock_price'])} for part_id, p in sorted(parts.items())]
+        return {
+            'storage_locations': len(storage_location_ids),
+            'part_locations': len(elements),
+            'stock_level': sum(p['stock_level'] for p in parts),
+            'stock_price': float(sum(Decimal(str(p['stock_price'])) for p in parts)),
+            'parts': parts
+        }
+
+    @classmethod
+    def derived_queries(cls, elements):
+        return [lambda: cls.stock_many(elements)]
+
     def json(self):
         result = super().json()
         result['stock_level'] = self.stock_level()
@@ -5,23 +5,29 @@ from decimal import Decimal
 
 class StockChange(ElementBase):
     _attrdef = dict(
-        part_location_id=ElementBase.addAttr(notnone=True),
-        order_id=ElementBase.addAttr(),
+        part_location_id=ElementBase.addAttr(notnone=True, fk='PartLocation', ondelete='cascade'),
+        order_id=ElementBase.addAttr(fk='Order', ondelete='setnull'),
         desc=ElementBase.addAttr(default='', notnone=True),
         created_at=ElementBase.addAttr(type=int),
         amount=ElementBase.addAttr(type=int, default=1, notnone=True),
         price=ElementBase.addAttr(type=float, default=0.0, notnone=True)
     )
+    _indexes = (('part_location_id', 'amount'),)
+
+    @classmethod
+    def prefetch_queries(cls, elements):
+        pls = set(el['part_location_id'] for el in elements if isinstance(el['part_location_id'], str) and isinstance(el['amount'], int) and el['amount'] < 0)
+        return super().prefetch_queries(elements) + [lambda: docDB.prefetch('PartLocationStock', pls)]
 
     def validate(self):
+        return self.validate_batch(dict())
+
+    def validate_batch(self, batch):
         errors = dict()
-        if not docDB.exists('PartLocation', self['part_location_id']):
-            errors['part_location_id'] = f"There is no PartLocation with id '{self['part_location_id']}'"
-        if self['order_id'] is not None and not docDB.exists('Order', self['order_id']):
-            errors['order_id'] = f"There is no Order with id '{self['order_id']}'"
-        elif (self['order_id'] is not None and
-                'part_location_id' not in errors and
-                not docDB.get('Order', self['order_id'])['part_id'] == docDB.get('PartLocation', self['part_location_id'])['part_id']):
+        order = None if self['order_id'] is None else docDB.get('Order', self['order_id'])
+        pl = docDB.get('PartLocation', self['part_location_id'])
+        stored = self.stored()
+        if order is not None and pl is not None and not order['part_id'] == pl['part_id']:
             errors['order_id'] = "Part of Order doesn't match Part of PartLocation"
         if self['amount'] == 0:
             errors['amount'] = "Can't be zero"
@@ -31,19 +37,70 @@ class StockChange(ElementBase):
             errors['price'] = "Can't be negative"
         if self['created_at'] is not None and self['created_at'] < 0:
             errors['created_at'] = "Can't be negative"
-        if self['order_id'] is not None and 'order_id' not in errors:
-            saved_amount = docDB.sum(self.__class__.__name__, 'amount', {'order_id': self['order_id'], '_id': {'$ne': self['_id']}})
-            if docDB.get('Order', self['order_id'])['amount'] < saved_amount + self['amount']:
+        if order is not None and 'order_id' not in errors:
+            sums = batch.setdefault('order_sums', dict())
+            if self['order_id'] not in sums:
+                sums[self['order_id']] = docDB.sum(self.__class__.__name__, 'amount', {'order_id': self['order_id']})
+            saved_amount = sums[self['order_id']] + batch.get('ordered', dict()).get(self['order_id'], 0)
+            if stored is not None and stored['order_id'] == self['order_id']:
+                saved_amount -= stored['amount']
+            if order['amount'] < saved_amount + self['amount']:
                 errors['amount'] = 'Would exceed amount of Order'
-        if (self['amount'] < 0 and
-                docDB.sum(self.__class__.__name__, 'amount', {'part_location_id': self['part_location_id'], '_id': {'$ne': self['_id']}}) + self['amount'] < 0):
-            errors['amount'] = 'Results in negative PartLocation stock_level'
+        if self['amount'] < 0 and pl is not None:
+            from elements import PartLocation
+            stock_level = PartLocation.stock_counter(self['part_location_id'])['stock_level']
+            stock_level += batch.get('stock_level', dict()).get(self['part_location_id'], 0)
+            if stored is not None and stored['part_location_id'] == self['part_location_id']:
+                stock_level -= stored['amount']
+            if stock_level + self['amount'] < 0:
+                errors['amount'] = 'Results in negative PartLocation stock_level'
         return errors
 
+    def batch_add(self, batch):
+        stored = self.stored()
+        for counter, attr in [('ordered', 'order_id'), ('stock_level', 'part_location_id')]:
+            pending = batch.setdefault(counter, dict())
+            if stored is not None and stored[attr] is not None:
+                pending[stored[attr]] = pending.get(stored[attr], 0) - stored['amount']
+            if self[attr] is not None:
+                pending[self[attr]] = pending.get(self[attr], 0) + self['amount']
+
+    def stored(self):
+        if 'stored' not in self._cache:
+            self._cache['stored'] = None if self['_id'] is None else docDB.get(self.__class__.__name__, self['_id'])
+        return self._cache['stored']
+
     def save_pre(self):
+        self.stored()
         if self['created_at'] is None:
             self['created_at'] = int(time.time())
         if self['order_id'] is not None:
             from elements import Order
             o = Order.get(self['order_id'])
             self['price'] = float(Decimal(o['price']) / o['amount'] * self['amount'])
+
+    @classmethod
+    def save_many_post(cls, elements):
+        from elements import PartLocation
+        created = list()
+        rebuild = set()
+        for el in elements:
+            stored = el.stored()
+            if stored is None:
+                created.append(el)
+            elif not all(stored[k] == el[k] for k in ['part_location_id', 'amount', 'price']):
+                rebuild.update([stored['part_location_id'], el['part_location_id']])
+            el._cache.pop('stored', None)
+        PartLocation.stock_book_many([el for el in created if el['part_location_id'] not in rebuild])
+        for pl_id in sorted(rebuild):
+            PartLocation.stock_rebuild(pl_id)
+
+    @classmethod
+    def delete_fields(cls):
+        return super().delete_fields() + ['part_location_id', 'amount']
+
+    @classmethod
+    def delete_many_post(cls, deleted):
+        from elements import PartLocation
+        PartLocation.stock_unbook_many(deleted)
+        super().delete_many_post(deleted)
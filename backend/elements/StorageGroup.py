@@ -1,4 +1,4 @@
-from elements._elementBase import ElementBase, docDB
+from elements._elementBase import ElementBase
 
 
 class StorageGroup(ElementBase):
@@ -6,6 +6,12 @@ class StorageGroup(ElementBase):
         name=ElementBase.addAttr(unique=True, notnone=True),
         desc=ElementBase.addAttr(default='', notnone=True)
     )
+    _depends = ('StorageLocation', 'StorageLocationTree', 'PartLocation', 'PartLocationStock', 'StockChange')
 
-    def delete_pre(self):
-        docDB.update_many('StorageLocation', {'storage_group_id': self['_id']}, {'$set': {'storage_group_id': None}})
+    def stock(self):
+        from elements.StorageLocation import StorageLocation
+        from elements.PartLocation import PartLocation
+        locations = list()
+        if self['_id'] is not None:
+            locations = [el['_id'] for el in StorageLocation.iterate({'storage_group_id': self['_id']}, fields=['_id'])]
+        return PartLocation.stock_rollup(StorageLocation.subtree(locations) if len(locations) > 0 else list())
@@ -1,8 +1,25 @@
+import json
 from helpers.docdb import docDB
+from helpers.storage import match
+from helpers import fastjson
+
+TREE_INDEXES = (('ancestor', 'descendant'), ('descendant', 'ancestor'))
+FILTER_OPERATORS = {'eq': None, 'ne': '$ne', 'lt': '$lt', 'lte': '$lte', 'gt': '$gt', 'gte': '$gte', 'in': '$in', 'nin': '$nin'}
 
 
 class ElementBase(object):
     _attrdef = dict()
+    _derivedattr = tuple()
+    _indexes = tuple()
+    _aux_indexes = dict()
+    _filters = dict()
+    _depends = tuple()
+    _bulk_sequential = False
+    _registry = dict()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        ElementBase._registry[cls.__name__] = cls
 
     def __init__(self, attr=None):
         self._cache = dict()
@@ -31,8 +48,102 @@ class ElementBase(object):
     def __repr__(self):
         return f"<{self.__class__.__name__}: {self['_id']}>"
 
-    def addAttr(type=str, default=None, unique=False, notnone=False):
-        return {'type': type, 'default': default, 'unique': unique, 'notnone': notnone}
+    def addAttr(type=str, default=None, unique=False, notnone=False, fk=None, ondelete='restrict', singleton=False, tree=False):
+        return {'type': type, 'default': default, 'unique': unique, 'notnone': notnone, 'fk': fk, 'ondelete': ondelete, 'singleton': singleton, 'tree': tree}
+
+    @classmethod
+    def singletons(cls):
+        return dict((attr, None if opt['singleton'] is True else opt['singleton']) for attr, opt in cls._attrdef.items() if opt['singleton'])
+
+    def singleton_scope(self, scope):
+        return dict() if scope is None else {scope: self[scope]}
+
+    def singleton_pre(self):
+        for attr, scope in self.__class__.singletons().items():
+            where = self.singleton_scope(scope)
+            if docDB.search_one(self.__class__.__name__, where) is None:
+                self[attr] = True
+            if self[attr]:
+                docDB.update_one(self.__class__.__name__, {**where, attr: True, '_id': {'$ne': self['_id']}}, {'$set': {attr: False}})
+
+    @classmethod
+    def singleton_post_delete(cls, deleted):
+        for attr, scope in cls.singletons().items():
+            for where in set(() if scope is None else ((scope, d.get(scope, None)),) for d in deleted):
+                where = dict(where)
+                if docDB.search_one(cls.__name__, {**where, attr: True}) is None:
+                    docDB.update_one(cls.__name__, where, {'$set': {attr: True}})
+
+    @classmethod
+    def dependencies(cls):
+        return (cls.__name__,) + tuple(cls._depends)
+
+    @classmethod
+    def tree_parent(cls):
+        for attr, opt in cls._attrdef.items():
+            if opt['tree']:
+                return attr
+        return None
+
+    @classmethod
+    def tree_name(cls):
+        return f'{cls.__name__}Tree'
+
+    @classmethod
+    def is_ancestor(cls, ancestor_id, descendant_id):
+        return docDB.count(cls.tree_name(), {'ancestor': ancestor_id, 'descendant': descendant_id}) > 0
+
+    @classmethod
+    def subtree(cls, element_ids):
+        element_ids = [element_ids] if isinstance(element_ids, str) else list(element_ids)
+        rows = docDB.search_many(cls.tree_name(), {'ancestor': {'$in': element_ids}}, fields=['descendant'], sort=[('depth', 1)])
+        return list(dict.fromkeys(r['descendant'] for r in rows))
+
+    @classmethod
+    def ancestors(cls, element_id):
+        rows = docDB.search_many(cls.tree_name(), {'descendant': element_id, 'depth': {'$gt': 0}}, fields=['ancestor'], sort=[('depth', -1)])
+        return [r['ancestor'] for r in rows]
+
+    @classmethod
+    def tree_update(cls, el):
+        ancestors = dict()
+        if el[cls.tree_parent()] is not None:
+            for r in docDB.search_many(cls.tree_name(), {'descendant': el[cls.tree_parent()]}, fields=['ancestor', 'depth']):
+                ancestors[r['ancestor']] = r['depth'] + 1
+        current = dict((r['ancestor'], r['depth']) for r in docDB.search_many(cls.tree_name(), {'descendant': el['_id']}, fields=['ancestor', 'depth']))
+        if current == {**ancestors, el['_id']: 0}:
+            return
+        subtree = dict((r['descendant'], r['depth']) for r in docDB.search_many(cls.tree_name(), {'ancestor': el['_id']}, fields=['descendant', 'depth']))
+        subtree[el['_id']] = 0
+        stale = [a for a in current if not a == el['_id']]
+        if len(stale) > 0:
+            docDB.delete_many(cls.tree_name(), {'descendant': {'$in': list(subtree)}, 'ancestor': {'$in': stale}})
+        rows = [{'_id': f'{el["_id"]}:{el["_id"]}', 'ancestor': el['_id'], 'descendant': el['_id'], 'depth': 0}]
+        for a, a_depth in ancestors.items():
+            for d, d_depth in subtree.items():
+                rows.append({'_id': f'{a}:{d}', 'ancestor': a, 'descendant': d, 'depth': a_depth + d_depth})
+        docDB.write_many(cls.tree_name(), rows)
+
+    @classmethod
+    def tree_post_delete(cls, deleted):
+        deleted_ids = [d['_id'] for d in deleted]
+        orphans = [r['descendant'] for r in docDB.search_many(cls.tree_name(), {'ancestor': {'$in': deleted_ids}, 'depth': {'$gt': 0}}, fields=['descendant'])]
+        orphans = [i for i in dict.fromkeys(orphans) if i not in deleted_ids]
+        docDB.delete_many(cls.tree_name(), {'descendant': {'$in': orphans}, 'ancestor': {'$nin': orphans}})
+        docDB.delete_many(cls.tree_name(), {'descendant': {'$in': deleted_ids}})
+
+    @classmethod
+    def tree_rebuild(cls):
+        docDB.delete_many(cls.tree_name(), dict())
+        parents = dict((el['_id'], el[cls.tree_parent()]) for el in cls.iterate(fields=[cls.tree_parent()]))
+        rows = list()
+        for element_id in parents:
+            depth, current, seen = 0, element_id, set()
+            while current is not None and current in parents and current not in seen:
+                seen.add(current)
+                rows.append({'_id': f'{current}:{element_id}', 'ancestor': current, 'descendant': element_id, 'depth': depth})
+                depth, current = depth + 1, parents[current]
+        docDB.write_many(cls.tree_name(), rows)
 
     @classmethod
     def get(cls, id):
@@ -43,13 +154,178 @@ class ElementBase(object):
         return result
 
     @classmethod
-    def all(cls):
-        result = list()
-        for element in docDB.search_many(cls.__name__, {}):
-            result.append(cls(element))
+    def get_many(cls, ids):
+        result = dict()
+        for fromdb in docDB.search_many(cls.__name__, {'_id': {'$in': list(ids)}}):
+            result[fromdb['_id']] = cls()
+            result[fromdb['_id']]._attr = fromdb
+        return result
+
+    @classmethod
+    def all(cls, limit=None, after=None, fields=None):
+        return list(cls.iterate(limit=limit, after=after, fields=fields))
+
+    @classmethod
+    def iterate(cls, what=None, limit=None, after=None, fields=None, sort=None):
+        what, sort = cls.iterate_query(what, limit, after, sort)
+        for element in docDB.search_many(cls.__name__, what, fields=fields, sort=sort, limit=limit):
+            yield cls(element)
+
+    @classmethod
+    def iterate_query(cls, what=None, limit=None, after=None, sort=None):
+        what = dict() if what is None else dict(what)
+        if sort is not None and not sort[-1][0] == '_id':
+            sort = list(sort) + [('_id', 1)]
+        elif limit is not None or after is not None:
+            sort = [('_id', 1)] if sort is None else sort
+        if after is not None:
+            if '_id' not in what:
+                what['_id'] = {'$gt': after}
+            elif isinstance(what['_id'], dict):
+                what['_id'] = {**what['_id'], '$gt': after}
+            else:
+                what['_id'] = {'$in': [what['_id']], '$gt': after}
+        return what, sort
+
+    @classmethod
+    def select(cls, what=None, derived=None, limit=None, after=None, fields=None, sort=None):
+        if not derived:
+            return cls.iterate(what, limit=limit, after=after, fields=fields, sort=sort)
+        elements = cls.filter_derived(list(cls.iterate(what, after=after, sort=sort or [('_id', 1)])), derived)
+        return iter(elements if limit is None else elements[:limit])
+
+    @classmethod
+    def count(cls, what=None, derived=None):
+        if derived:
+            return len(cls.filter_derived(list(cls.iterate(what)), derived))
+        if not what:
+            return docDB.estimated_count(cls.__name__)
+        return docDB.count(cls.__name__, what)
+
+    @classmethod
+    def filter_derived(cls, elements, derived):
+        for query in cls.derived_queries(elements):
+            query()
+        return [el for el in elements if match(dict((attr, getattr(el, attr)()) for attr in derived), derived)]
+
+    @classmethod
+    def parse_value(cls, raw, type=None):
+        if raw == 'null':
+            return None
+        if type is None:
+            try:
+                return json.loads(raw)
+            except ValueError:
+                return raw
+        if type is bool:
+            if raw.lower() not in ['true', 'false', '1', '0']:
+                raise ValueError(raw)
+            return raw.lower() in ['true', '1']
+        return type(raw)
+
+    @classmethod
+    def parse_filters(cls, params):
+        what = dict()
+        derived = dict()
+        errors = dict()
+        special = dict()
+        for key, raw in params.items():
+            if key in cls._filters:
+                special[key] = raw
+                continue
+            attr, op = key, 'eq'
+            if key.endswith(']') and '[' in key:
+                attr, op = key[:-1].split('[', 1)
+            attr = '_id' if attr == 'id' else attr
+            if attr in cls._attrdef:
+                target, type = what, cls._attrdef[attr]['type']
+            elif attr in cls._derivedattr:
+                target, type = derived, None
+            else:
+                errors[key] = 'unknown filter'
+                continue
+            if op not in FILTER_OPERATORS:
+                errors[key] = f"unknown operator, needs to be one of {', '.join(FILTER_OPERATORS)}"
+                continue
+            if not isinstance(raw, str):
+                errors[key] = 'given more than once'
+                continue
+            try:
+                values = [cls.parse_value(v, type) for v in (raw.split(',') if op == 'in' else [raw])]
+            except ValueError:
+                errors[key] = f'needs to be of type {type.__name__}'
+                continue
+            if attr in target and (op == 'eq' or not isinstance(target[attr], dict)):
+                errors[key] = 'equality can not be combined with other filters'
+                continue
+            if op == 'eq':
+                target[attr] = values[0]
+            else:
+                target.setdefault(attr, dict())[FILTER_OPERATORS[op]] = values if op == 'in' else values[0]
+        for key, raw in special.items():
+            if not isinstance(raw, str):
+                errors[key] = 'given more than once'
+                continue
+            for attr, cond in getattr(cls, cls._filters[key])(raw).items():
+                if attr in what:
+                    errors[key] = f'can not be combined with a filter on {attr}'
+                    break
+                what[attr] = cond
+        return what, derived, errors
+
+    @classmethod
+    def parse_sort(cls, raw):
+        if not isinstance(raw, str):
+            return None, {'error': 'sort given more than once'}
+        sort = list()
+        for field in [f for f in raw.split(',') if not f == '']:
+            direction = -1 if field.startswith('-') else 1
+            field = field.lstrip('+-')
+            field = '_id' if field == 'id' else field
+            if field not in cls._attrdef:
+                return None, {'error': f'unknown sort field {field}'}
+            sort.append((field, direction))
+        return (sort if len(sort) > 0 else None), None
+
+    @classmethod
+    def projection(cls, fields):
+        if fields is None or cls.wants_derived(fields):
+            return None
+        return ['_id'] + [f for f in fields if f in cls._attrdef and not f == '_id']
+
+    @classmethod
+    def wants_derived(cls, fields):
+        return fields is None or any(f in cls._derivedattr for f in fields)
+
+    @classmethod
+    def derived_queries(cls, elements):
+        return list()
+
+    @classmethod
+    def json_many(cls, elements, fields=None, derived=True):
+        if cls.wants_derived(fields):
+            if derived:
+                for query in cls.derived_queries(elements):
+                    query()
+            result = [el.json() for el in elements]
+        else:
+            result = [ElementBase.json(el) for el in elements]
+        if fields is not None:
+            result = [dict((k, v) for k, v in r.items() if k == 'id' or k in fields) for r in result]
         return result
 
-    def validate_base(self):
+    @classmethod
+    def json_encoded(cls, elements, fields=None, derived=True):
+        if len(cls._derivedattr) == 0 or not cls.wants_derived(fields):
+            if fields is None:
+                encoded = fastjson.documents(el._attr for el in elements)
+            else:
+                encoded = fastjson.documents(dict((k, v) for k, v in el._attr.items() if k == '_id' or k in fields) for el in elements)
+            if encoded is not None:
+                return encoded
+        return fastjson.dumps(cls.json_many(elements, fields, derived))
+
+    def validate_base(self, batch=None):
         errors = dict()
         for attr, opt in self.__class__._attrdef.items():
             if attr == '_id':
@@ -65,18 +341,108 @@ class ElementBase(object):
                     continue
             if not isinstance(self[attr], opt['type']) and self[attr] is not None:
                 errors[attr] = f"needs to be of type {opt['type']}{' or None' if not opt['notnone'] else ''}"
-        if len(errors) == 0:
-            errors = self.validate()
+        if not len(errors) == 0:
+            return errors
+        for attr, opt in self.__class__._attrdef.items():
+            if opt['fk'] is not None and self[attr] is not None and not docDB.exists(opt['fk'], self[attr]):
+                errors[attr] = f"There is no {opt['fk']} with id '{self[attr]}'"
+        parent = self.__class__.tree_parent()
+        if parent is not None and parent not in errors and self[parent] not in [None, self['_id']] and self['_id'] is not None:
+            if self.__class__.is_ancestor(self['_id'], self[parent]):
+                errors[parent] = f"Can't be a descendant of this {self.__class__.__name__}"
+        return {**(self.validate() if batch is None else self.validate_batch(batch)), **errors}
+
+    @classmethod
+    def indexes(cls):
+        result = [{'keys': tuple(keys), 'unique': False} for keys in cls._indexes]
+        for attr, opt in cls._attrdef.items():
+            if attr == '_id':
+                continue
+            if opt['unique']:
+                result.append({'keys': (attr,), 'unique': True})
+            elif opt['fk'] is not None and not any(i['keys'][0] == attr for i in result):
+                result.append({'keys': (attr,), 'unique': False})
+        for attr, scope in cls.singletons().items():
+            result.append({'keys': (attr,) if scope is None else (scope, attr), 'unique': False})
+        return result
+
+    @classmethod
+    def ensure_indexes(cls):
+        errors = dict()
+        for name, indexes in cls.declared_indexes().items():
+            for index in indexes:
+                try:
+                    docDB.ensure_index(name, index['keys'], unique=index['unique'])
+                except Exception as e:
+                    errors[(name, index['keys'])] = str(e)
         return errors
 
+    @classmethod
+    def declared_indexes(cls):
+        result = dict()
+        for name, element in ElementBase._registry.items():
+            result[name] = element.indexes()
+            for where, keys in element._aux_indexes.items():
+                result.setdefault(where, list()).extend({'keys': tuple(k), 'unique': False} for k in keys)
+            if element.tree_parent() is not None:
+                result.setdefault(element.tree_name(), list()).extend({'keys': keys, 'unique': False} for keys in TREE_INDEXES)
+        return result
+
+    @classmethod
+    def index_report(cls):
+        report = dict()
+        for name, indexes in cls.declared_indexes().items():
+            present = docDB.indexes(name)
+            usage = docDB.index_usage(name)
+            required = dict((index['keys'], index) for index in indexes)
+            found = dict((info['keys'], info) for info in present.values())
+            report[name] = {
+                'missing': [keys for keys, index in required.items() if keys not in found or found[keys]['unique'] != index['unique']],
+                'unused': [] if usage is None else [idx for idx, ops in usage.items() if ops == 0 and not idx == '_id_'],
+                'undeclared': [idx for idx, info in present.items() if info['keys'] not in required and not idx == '_id_']
+            }
+        return report
+
+    @classmethod
+    def prefetch_queries(cls, elements):
+        queries = list()
+        references = dict()
+        for attr, opt in cls._attrdef.items():
+            if opt['fk'] is not None:
+                references.setdefault(opt['fk'], set()).update(el[attr] for el in elements if isinstance(el[attr], str))
+            if opt['unique'] and not attr == '_id':
+                values = [el[attr] for el in elements if isinstance(el[attr], (str, int, float))]
+                queries.append(lambda attr=attr, values=values: docDB.prefetch_by(cls.__name__, attr, values))
+        for where, ids in references.items():
+            queries.append(lambda where=where, ids=ids: docDB.prefetch(where, ids))
+        return queries
+
+    @classmethod
+    def prefetch(cls, elements):
+        for query in cls.prefetch_queries(elements):
+            query()
+
     def validate(self):
         return dict()
 
+    def validate_batch(self, batch):
+        errors = dict()
+        for attr, opt in self.__class__._attrdef.items():
+            if opt['unique'] and not attr == '_id' and self[attr] in batch.get(attr, dict()):
+                errors[attr] = f'marked as unique, but element with value "{self[attr]}" allready present'
+        return {**self.validate(), **errors}
+
+    def batch_add(self, batch):
+        for attr, opt in self.__class__._attrdef.items():
+            if opt['unique'] and not attr == '_id':
+                batch.setdefault(attr, dict())[self[attr]] = self
+
     def save(self):
         errors = self.validate_base()
         if not len(errors) == 0:
             return {'errors': errors}
 
+        self.singleton_pre()
         self.save_pre()
         if self['_id'] is None:
             docDB.create(self.__class__.__name__, self._attr)
@@ -84,27 +450,130 @@ class ElementBase(object):
         else:
             docDB.replace(self.__class__.__name__, self._attr)
             result = 'updated'
-        self.save_post()
+        self.__class__.save_many_post([self])
 
         return {result: self['_id']}
 
+    @classmethod
+    def save_many(cls, elements):
+        with docDB.identity_map():
+            cls.prefetch(elements)
+            if cls._bulk_sequential or len(cls.singletons()) > 0 or cls.tree_parent() is not None:
+                return [el.save() for el in elements]
+            results = [None] * len(elements)
+            valid = list()
+            batch = dict()
+            for i, el in enumerate(elements):
+                errors = el.validate_base(batch)
+                if not len(errors) == 0:
+                    results[i] = {'errors': errors}
+                    continue
+                el.batch_add(batch)
+                valid.append((i, 'created' if el['_id'] is None else 'updated', el))
+            for i, result, el in valid:
+                el.save_pre()
+            failed = docDB.write_many(cls.__name__, [el._attr for i, result, el in valid])
+            for n, key_value in failed.items():
+                i, result, el = valid[n]
+                errors = dict((attr, f'marked as unique, but element with value "{value}" allready present') for attr, value in key_value.items())
+                results[i] = {'errors': errors if len(errors) > 0 else {'_id': 'could not be written'}}
+            valid = [v for n, v in enumerate(valid) if n not in failed]
+            cls.save_many_post([el for i, result, el in valid])
+            for i, result, el in valid:
+                results[i] = {result: el['_id']}
+            return results
+
     def save_pre(self):
         pass
 
+    @classmethod
+    def save_many_post(cls, elements):
+        for el in elements:
+            if cls.tree_parent() is not None:
+                cls.tree_update(el)
+            el.save_post()
+
     def save_post(self):
         pass
 
-    def delete(self):
+    def delete(self, dry_run=False):
         saved_id = self['_id']
         if self['_id'] is not None and docDB.exists(self.__class__.__name__, self['_id']):
+            if dry_run:
+                return self.__class__.delete_many([self['_id']], dry_run=True)
             pre_delete_result = self.delete_pre()
             if pre_delete_result is not None and 'error' in pre_delete_result:
                 return pre_delete_result
-            docDB.delete(self.__class__.__name__, self['_id'])
+            delete_result = self.__class__.delete_many([self['_id']])
+            if 'error' in delete_result:
+                return delete_result
             self.delete_post()
         self.__init_attr()
         return {'deleted': saved_id}
 
+    @classmethod
+    def references(cls):
+        return [(element, attr, opt['ondelete']) for element in ElementBase._registry.values()
+                for attr, opt in element._attrdef.items() if opt['fk'] == cls.__name__]
+
+    @classmethod
+    def delete_fields(cls):
+        return ['_id'] + [scope for scope in cls.singletons().values() if scope is not None]
+
+    @classmethod
+    def delete_plan(cls, ids):
+        def fetch(element, what):
+            return docDB.search_many(element.__name__, what, fields=element.delete_fields())
+
+        plan = {'delete': {cls.__name__: dict((d['_id'], d) for d in fetch(cls, {'_id': {'$in': list(ids)}}))}, 'setnull': dict(), 'restrict': dict()}
+        queue = [(cls, list(plan['delete'][cls.__name__]))]
+        while len(queue) > 0:
+            target, target_ids = queue.pop(0)
+            for element, attr, ondelete in target.references():
+                name = element.__name__
+                if not ondelete == 'cascade':
+                    plan[ondelete].setdefault((name, attr), set()).update(target_ids)
+                    continue
+                deleted = plan['delete'].setdefault(name, dict())
+                found = [d for d in fetch(element, {attr: {'$in': target_ids}}) if d['_id'] not in deleted]
+                for d in found:
+                    deleted[d['_id']] = d
+                if len(found) > 0:
+                    queue.append((element, [d['_id'] for d in found]))
+        return plan
+
+    @classmethod
+    def delete_many(cls, ids, dry_run=False):
+        with docDB.transaction():
+            plan = cls.delete_plan(ids)
+
+            def remaining(name, attr, target_ids):
+                return {attr: {'$in': list(target_ids)}, '_id': {'$nin': list(plan['delete'].get(name, dict()))}}
+
+            for (name, attr), target_ids in plan['restrict'].items():
+                if docDB.count(name, remaining(name, attr, target_ids)) > 0:
+                    return {'error': f"<{cls.__name__}: {', '.join(ids)}> can't be deleted as at least one {name} is associated"}
+            if dry_run:
+                setnull = dict()
+                for (name, attr), target_ids in plan['setnull'].items():
+                    setnull[f'{name}.{attr}'] = docDB.count(name, remaining(name, attr, target_ids))
+                return {'dry_run': {'delete': dict((name, len(deleted)) for name, deleted in plan['delete'].items() if len(deleted) > 0), 'setnull': setnull}}
+            for (name, attr), target_ids in plan['setnull'].items():
+                docDB.update_many(name, remaining(name, attr, target_ids), {'$set': {attr: None}})
+            for name, deleted in plan['delete'].items():
+                if len(deleted) > 0:
+                    docDB.delete_many(name, {'_id': {'$in': list(deleted)}})
+            for name, deleted in plan['delete'].items():
+                if len(deleted) > 0:
+                    ElementBase._registry[name].delete_many_post(list(deleted.values()))
+        return {'deleted': list(plan['delete'][cls.__name__])}
+
+    @classmethod
+    def delete_many_post(cls, deleted):
+        cls.singleton_post_delete(deleted)
+        if cls.tree_parent() is not None:
+            cls.tree_post_delete(deleted)
+
     def delete_pre(self):
         pass
 
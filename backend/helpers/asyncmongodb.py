@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from helpers.config import get_config
+
+_identity = contextvars.ContextVar('identity', default=None)
+_calls = contextvars.ContextVar('calls', default=None)
+
+
+class asyncMongoDB(object):
+    def __init__(self, db):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=get_config('server').get('async_workers', 64), thread_name_prefix='asyncdb')
+
+    @contextmanager
+    def identity_map(self):
+        if _identity.get() is not None:
+            yield
+            return
+        token = _identity.set(dict())
+        try:
+            yield
+        finally:
+            _identity.reset(token)
+
+    @contextmanager
+    def call_log(self, threshold=None, budget=None):
+        with self._db.call_log(threshold, budget) as log:
+            token = _calls.set(log)
+            try:
+                yield log
+            finally:
+                _calls.reset(token)
+
+    def _call(self, identity, calls, func, *args, **kwargs):
+        if calls is not None:
+            with self._db.call_log(log=calls):
+                return self._call(identity, None, func, *args, **kwargs)
+        if identity is None:
+            return func(*args, **kwargs)
+        with self._db.identity_map(identity):
+            return func(*args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        call = partial(self._call, _identity.get(), _calls.get(), func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def gather(self, funcs):
+        return await asyncio.gather(*(self.run(func) for func in funcs))
+
+    async def get(self, where, what_id):
+        return await self.run(self._db.get, where, what_id)
+
+    async def exists(self, where, what_id):
+        return await self.run(self._db.exists, where, what_id)
+
+    async def search_one(self, where, what):
+        return await self.run(self._db.search_one, where, what)
+
+    async def search_many(self, where, what, fields=None, sort=None, limit=None):
+        return await self.run(lambda: list(self._db.search_many(where, what, fields=fields, sort=sort, limit=limit)))
+
+    async def count(self, where, what):
+        return await self.run(self._db.count, where, what)
+
+    async def estimated_count(self, where):
+        return await self.run(self._db.estimated_count, where)
+
+    async def versions(self, wheres):
+        return await self.run(self._db.versions, wheres)
+
+    async def sum(self, where, what_field, what_filter=None):
+        return await self.run(self._db.sum, where, what_field, what_filter)
+
+    async def sum_grouped(self, where, what_field, group_field, what_filter=None):
+        return await self.run(self._db.sum_grouped, where, what_field, group_field, what_filter)
+
+    async def create(self, where, what_data):
+        return await self.run(self._db.create, where, what_data)
+
+    async def update(self, where, what_id, with_data):
+        return await self.run(self._db.update, where, what_id, with_data)
+
+    async def update_one(self, where, what_data, with_data):
+        return await self.run(self._db.update_one, where, what_data, with_data)
+
+    async def update_many(self, where, what_data, with_data):
+        return await self.run(self._db.update_many, where, what_data, with_data)
+
+    async def replace(self, where, what_data):
+        return await self.run(self._db.replace, where, what_data)
+
+    async def write_many(self, where, what_datas):
+        return await self.run(self._db.write_many, where, what_datas)
+
+    async def delete(self, where, what_id):
+        return await self.run(self._db.delete, where, what_id)
+
+    async def delete_many(self, where, what_data):
+        return await self.run(self._db.delete_many, where, what_data)
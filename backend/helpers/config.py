@@ -6,16 +6,46 @@ config = {
     'mongodb': {
         'host': 'localhost',
         'port': 27017,
-        'database': 'I4P'
+        'database': 'I4P',
+        'cache': {
+            'collections': ['Unit', 'Category', 'MountingStyle', 'Footprint', 'Distributor', 'StorageGroup'],
+            'size': 4096,
+            'ttl': 60,
+            'change_stream': False
+        },
+        'pool': {
+            'max_pool_size': 100,
+            'min_pool_size': 0,
+            'wait_queue_timeout_ms': 2000,
+            'server_selection_timeout_ms': 2000,
+            'connect_timeout_ms': 2000,
+            'socket_timeout_ms': None,
+            'compressors': []
+        },
+        'calls': {
+            'repeat_threshold': 10,
+            'budget': None
+        }
+    },
+    'storage': {
+        'engine': 'mongodb'
+    },
+    'response_cache': {
+        'max_bytes': 33554432
     },
     'server': {
-        'port': 8000
+        'port': 8000,
+        'async_workers': 64
     }
 }
 
 if os.path.isfile('config.json'):
     with open('config.json', 'r') as f:
-        config.update(json.loads(f.read()))
+        for portion, values in json.loads(f.read()).items():
+            if isinstance(values, dict) and isinstance(config.get(portion), dict):
+                config[portion].update(values)
+            else:
+                config[portion] = values
 else:
     with open('config.json', 'w') as f:
         f.write(json.dumps(config, indent=4))
@@ -1,3 +1,10 @@
-from helpers.mongodb import mongoDB
+from helpers.config import get_config
+from helpers.asyncmongodb import asyncMongoDB
 
-docDB = mongoDB()
+if get_config('storage')['engine'] == 'memory':
+    from helpers.memorydb import memoryDB as engine
+else:
+    from helpers.mongodb import mongoDB as engine
+
+docDB = engine()
+asyncDB = asyncMongoDB(docDB)
@@ -1,13 +1,278 @@
 import cherrypy
 import cherrypy_cors
+import hashlib
+import json
+import threading
+import types
+from collections import OrderedDict
+from itertools import islice
+from cherrypy._json import encode
+from helpers.docdb import docDB
+from helpers.config import get_config
+from helpers import metrics
 
 
-@cherrypy.popargs('element_id')
+class ResponseCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._data.get(key, None)
+            if body is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= len(self._data.pop(key))
+            self._data[key] = body
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self.bytes -= len(self._data.popitem(last=False)[1])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+
+response_cache = ResponseCache(get_config('response_cache').get('max_bytes', 0))
+metrics.Callback('i4p_response_cache_requests_total', 'Response cache lookups by result', 'counter', ['result'],
+                 lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses})
+metrics.Callback('i4p_response_cache_evictions_total', 'Response cache entries evicted to stay within the byte budget', 'counter', [],
+                 lambda: {(): response_cache.evictions})
+metrics.Callback('i4p_response_cache_bytes', 'Bytes of serialized responses held by the response cache', 'gauge', [], lambda: {(): response_cache.bytes})
+
+
+def json_handler(*args, **kwargs):
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, types.GeneratorType):
+        cherrypy.serving.response.stream = True
+        return value
+    if isinstance(value, bytes):
+        return value
+    return encode(value)
+
+
+def versions_etag(versions):
+    return 'W/"' + hashlib.sha1(json.dumps(versions).encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def etag_matches(etag, header):
+    if header is None:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag.replace('W/', '', 1) in [t.replace('W/', '', 1) for t in tags]
+
+
+@cherrypy.popargs('element_id', 'resource')
 class ElementEndpointBase():
+    _stream = False
+    _stream_chunk = 500
+    _actions = dict()
+    _resources = dict()
+    _cached = False
+
+    def _stream_json(self, elements, fields, derived=True):
+        separator = b''
+        yield b'['
+        while True:
+            chunk = list(islice(elements, self._stream_chunk))
+            if len(chunk) == 0:
+                break
+            yield separator + self._element.json_encoded(chunk, fields, derived=derived)[1:-1]
+            separator = b', '
+        yield b']'
+
     @cherrypy.expose()
     @cherrypy.tools.json_in()
-    @cherrypy.tools.json_out()
-    def index(self, element_id=None):
+    @cherrypy.tools.json_out(handler=json_handler)
+    def index(self, element_id=None, resource=None, limit=None, after=None, fields=None, dry_run=None, sort=None, count=None, **filters):
+        with docDB.identity_map(), docDB.call_log() as calls:
+            versions = self._versions() if cherrypy.request.method == 'GET' and not element_id == '_bulk' else None
+            etag = None if versions is None else versions_etag(versions)
+            key = None
+            if self._cached and versions is not None:
+                key = (cherrypy.request.path_info, tuple(sorted((k, repr(v)) for k, v in cherrypy.request.params.items())), versions)
+            not_modified = etag is not None and etag_matches(etag, cherrypy.request.headers.get('If-None-Match', None)) and self._exists(element_id, resource)
+            cached = None if key is None or not_modified else response_cache.get(key)
+            if not_modified:
+                cherrypy.response.status = 304
+                result = None
+            elif cached is not None:
+                cherrypy.response.headers['X-Cache'] = 'HIT'
+                result = cached
+            else:
+                if resource is None:
+                    result = self._index(element_id, limit, after, fields, dry_run, sort, count, filters)
+                else:
+                    result = self._index_resource(element_id, resource)
+                if key is not None and isinstance(result, (bytes, dict, list)) and str(cherrypy.response.status or 200)[:3] == '200':
+                    cherrypy.response.headers['X-Cache'] = 'MISS'
+                    result = result if isinstance(result, bytes) else b''.join(encode(result))
+                    response_cache.set(key, result)
+        if etag is not None and str(cherrypy.response.status or 200)[:3] in ['200', '304']:
+            cherrypy.response.headers['ETag'] = etag
+        cherrypy.response.headers['X-DB-Calls'] = str(calls.calls)
+        for line in calls.report():
+            cherrypy.log(f'{self.__class__.__name__} {cherrypy.request.method}: {line}', context='DB')
+        return result
+
+    def _versions(self):
+        return tuple(sorted(docDB.versions(self._element.dependencies()).items()))
+
+    def _exists(self, element_id, resource=None):
+        if element_id is None or element_id in self._actions:
+            return True
+        if resource is not None and resource not in self._resources:
+            return False
+        return self._element.get(element_id)['_id'] is not None
+
+    def _index_bulk(self):
+        if cherrypy.request.method == 'OPTIONS':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, POST'
+            cherrypy_cors.preflight(allowed_methods=['POST'])
+            return
+        elif not cherrypy.request.method == 'POST':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, POST'
+            cherrypy.response.status = 405
+            return {'error': 'method not allowed'}
+        operations = cherrypy.request.json
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            cherrypy.response.status = 400
+            return {'error': 'Submitted data need to be of type list of dict'}
+        return self._bulk_operations(operations)
+
+    def _index_action(self, action, params):
+        if cherrypy.request.method == 'OPTIONS':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, GET'
+            cherrypy_cors.preflight(allowed_methods=['GET'])
+            return
+        elif not cherrypy.request.method == 'GET':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, GET'
+            cherrypy.response.status = 405
+            return {'error': 'method not allowed'}
+        status, result = getattr(self, self._actions[action])(dict((k, v) for k, v in params.items() if v is not None))
+        cherrypy.response.status = status
+        return result
+
+    def _index_resource(self, element_id, resource):
+        if resource not in self._resources:
+            cherrypy.response.status = 404
+            return {'error': f'resource {resource} not found'}
+        if cherrypy.request.method == 'OPTIONS':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, GET'
+            cherrypy_cors.preflight(allowed_methods=['GET'])
+            return
+        elif not cherrypy.request.method == 'GET':
+            cherrypy.response.headers['Allow'] = 'OPTIONS, GET'
+            cherrypy.response.status = 405
+            return {'error': 'method not allowed'}
+        el = self._element.get(element_id)
+        if el['_id'] is None:
+            cherrypy.response.status = 404
+            return {'error': f'id {element_id} not found'}
+        return getattr(el, self._resources[resource])()
+
+    def _bulk_operations(self, operations):
+        results = [None] * len(operations)
+        found = self._element.get_many([op['id'] for op in operations if isinstance(op.get('id', None), str)])
+        used = set()
+        saves = list()
+        deletes = list()
+        for i, op in enumerate(operations):
+            attr = op.get('data', dict())
+            if op.get('op', None) not in ['create', 'patch', 'delete']:
+                results[i] = {'error': 'op needs to be one of create, patch or delete'}
+            elif not op['op'] == 'delete' and not isinstance(attr, dict):
+                results[i] = {'error': 'Submitted data need to be of type dict'}
+            elif op['op'] == 'create':
+                attr.pop('_id', None)
+                saves.append((i, self._element(attr)))
+            elif not isinstance(op.get('id', None), str) or op['id'] not in found:
+                results[i] = {'error': f"id {op.get('id', None)} not found"}
+            elif op['id'] in used:
+                results[i] = {'error': f"id {op['id']} used in more than one operation"}
+            else:
+                used.add(op['id'])
+                el = found[op['id']]
+                if op['op'] == 'delete':
+                    deletes.append((i, el))
+                    continue
+                attr.pop('_id', None)
+                for k, v in attr.items():
+                    el[k] = v
+                saves.append((i, el))
+        for (i, el), result in zip(saves, self._element.save_many([el for i, el in saves])):
+            results[i] = result
+        if len(deletes) > 0:
+            with docDB.transaction():
+                deleted = self._element.delete_many([el['_id'] for i, el in deletes])
+                for i, el in deletes:
+                    if 'error' in deleted:
+                        results[i] = self._element.delete_many([el['_id']])
+                    if results[i] is None or 'error' not in results[i]:
+                        results[i] = {'deleted': el['_id']}
+        return results
+
+    def _listing_args(self, limit, fields):
+        for name, value in [('limit', limit), ('fields', fields)]:
+            if value is not None and not isinstance(value, str):
+                return limit, fields, {'error': f'{name} given more than once'}
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return limit, fields, {'error': 'limit needs to be a positive integer'}
+        if fields is not None:
+            fields = [f for f in fields.split(',') if not f == '']
+            for f in fields:
+                if f not in self._element._attrdef and f not in self._element._derivedattr and not f == 'id':
+                    return limit, fields, {'error': f'unknown field {f}'}
+        return limit, fields, None
+
+    def _query_args(self, after, sort, count, filters):
+        for name, value in [('after', after), ('count', count)]:
+            if value is not None and not isinstance(value, str):
+                return None, {'error': f'{name} given more than once'}
+        what, derived, errors = self._element.parse_filters(filters)
+        if len(errors) > 0:
+            return None, {'error': 'invalid filters', 'errors': errors}
+        if sort is not None:
+            sort, error = self._element.parse_sort(sort)
+            if error is not None:
+                return None, error
+            if after is not None and sort is not None and not sort == [('_id', 1)]:
+                return None, {'error': 'after can only be used with the default sort'}
+        count = count is not None and count.lower() not in ['0', 'false']
+        return {'what': what, 'derived': derived, 'sort': sort, 'count': count}, None
+
+    def _delete_args(self, dry_run):
+        if dry_run is not None and not isinstance(dry_run, str):
+            return None, {'error': 'dry_run given more than once'}
+        return dry_run is not None and dry_run.lower() not in ['0', 'false'], None
+
+    def _index(self, element_id, limit, after, fields, dry_run=None, sort=None, count=None, filters=None):
+        if element_id == '_bulk':
+            return self._index_bulk()
+        if element_id in self._actions:
+            return self._index_action(element_id, {'limit': limit, 'fields': fields, **(filters or dict())})
         if cherrypy.request.method == 'OPTIONS':
             if element_id is None:
                 cherrypy.response.headers['Allow'] = 'OPTIONS, GET, POST'
@@ -27,12 +292,21 @@ class ElementEndpointBase():
                 if el['_id'] is None:
                     cherrypy.response.status = 404
                     return {'error': f'id {element_id} not found'}
-                return el.json()
+                return self._element.json_encoded([el])[1:-1]
             else:
-                result = list()
-                for el in self._element.all():
-                    result.append(el.json())
-                return result
+                limit, fields, error = self._listing_args(limit, fields)
+                if error is None:
+                    query, error = self._query_args(after, sort, count, filters or dict())
+                if error is not None:
+                    cherrypy.response.status = 400
+                    return error
+                if query['count']:
+                    return {'count': self._element.count(query['what'], query['derived'])}
+                projection = None if query['derived'] else self._element.projection(fields)
+                elements = self._element.select(query['what'], query['derived'], limit=limit, after=after, fields=projection, sort=query['sort'])
+                if self._stream:
+                    return self._stream_json(elements, fields, derived=not query['derived'])
+                return self._element.json_encoded(list(elements), fields, derived=not query['derived'])
         elif cherrypy.request.method == 'POST':
             if element_id is None:
                 attr = cherrypy.request.json
@@ -84,8 +358,12 @@ class ElementEndpointBase():
                 if el['_id'] is None:
                     cherrypy.response.status = 404
                     return {'error': f'id {element_id} not found'}
-                result = el.delete()
-                if not'deleted' in result:
+                dry_run, error = self._delete_args(dry_run)
+                if error is not None:
+                    cherrypy.response.status = 400
+                    return error
+                result = el.delete(dry_run=dry_run)
+                if 'error' in result:
                     cherrypy.response.status = 400
                 return result
         else:
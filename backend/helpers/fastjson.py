@@ -0,0 +1,21 @@
+from cherrypy._json import json
+
+_encoder = json.JSONEncoder()
+ID_KEY = '"_id": '
+
+
+def dumps(value):
+    return _encoder.encode(value).encode('utf-8')
+
+
+def documents(docs):
+    docs = list(docs)
+    if len(docs) == 0:
+        return b'[]'
+    encoded = _encoder.encode(docs)
+    if not encoded.startswith('[{' + ID_KEY):
+        return None
+    pieces = encoded[2 + len(ID_KEY):-2].split('}, {' + ID_KEY)
+    if not len(pieces) == len(docs):
+        return None
+    return ('[{"id": ' + '}, {"id": '.join(pieces) + '}]').encode('utf-8')
@@ -0,0 +1,360 @@
+from bson.objectid import ObjectId
+from helpers import metrics
+from helpers.storage import StorageBackend, is_operator, match
+from itertools import product
+import copy
+import threading
+import time
+
+
+class DuplicateKeyError(Exception):
+    def __init__(self, message, key_value=None):
+        super().__init__(message)
+        self.key_value = dict() if key_value is None else key_value
+
+
+def apply_update(doc, with_data):
+    for op, fields in with_data.items():
+        for field, arg in fields.items():
+            if op == '$set':
+                doc[field] = copy.deepcopy(arg)
+            elif op == '$unset':
+                doc.pop(field, None)
+            elif op == '$inc':
+                doc[field] = doc.get(field, 0) + arg
+            elif op == '$push':
+                values = arg['$each'] if isinstance(arg, dict) and '$each' in arg else [arg]
+                doc[field] = doc.get(field, list()) + copy.deepcopy(values)
+            elif op == '$pull':
+                doc[field] = [v for v in doc.get(field, list()) if not (match(v, arg) if isinstance(arg, dict) else v == arg)]
+            else:
+                raise ValueError(f'unsupported update operator {op}')
+    return doc
+
+
+def project(doc, fields):
+    if fields is None:
+        return copy.deepcopy(doc)
+    if isinstance(fields, dict):
+        excluded = [f for f, v in fields.items() if not v]
+        if len(excluded) == len(fields):
+            return dict((k, copy.deepcopy(v)) for k, v in doc.items() if k not in excluded)
+        fields = [f for f, v in fields.items() if v and f not in excluded]
+    return dict((k, copy.deepcopy(doc[k])) for k in ['_id'] + list(fields) if k in doc)
+
+
+class HashIndex(object):
+    def __init__(self, keys, unique=False):
+        self.keys = tuple(keys)
+        self.unique = unique
+        self.ops = 0
+        self.entries = [dict() for k in self.keys]
+
+    def values(self, doc):
+        return tuple(doc.get(k, None) for k in self.keys)
+
+    def check(self, doc):
+        if self.unique:
+            others = self.entries[-1].get(self.values(doc), dict()).keys() - {doc['_id']}
+            if len(others) > 0:
+                key_value = dict(zip(self.keys, self.values(doc)))
+                raise DuplicateKeyError(f'duplicate key {key_value}', key_value)
+
+    def add(self, doc):
+        values = self.values(doc)
+        for n, entries in enumerate(self.entries):
+            entries.setdefault(values[:n + 1], dict())[doc['_id']] = None
+
+    def remove(self, doc):
+        values = self.values(doc)
+        for n, entries in enumerate(self.entries):
+            bucket = entries.get(values[:n + 1], dict())
+            bucket.pop(doc['_id'], None)
+            if len(bucket) == 0:
+                entries.pop(values[:n + 1], None)
+
+    def lookup(self, equal):
+        prefix = list()
+        for k in self.keys:
+            if k not in equal:
+                break
+            prefix.append(equal[k])
+        if len(prefix) == 0:
+            return None
+        self.ops += 1
+        result = dict()
+        for values in product(*prefix):
+            result.update(self.entries[len(prefix) - 1].get(values, dict()))
+        return result
+
+
+class Collection(object):
+    def __init__(self):
+        self.docs = dict()
+        self.order = dict()
+        self.indexes = dict()
+        self._sequence = 0
+
+    def equal(self, what):
+        result = dict()
+        for field, cond in what.items():
+            if field.startswith('$'):
+                continue
+            if is_operator(cond):
+                if list(cond.keys()) == ['$in']:
+                    result[field] = list(cond['$in'])
+            else:
+                result[field] = [cond]
+        try:
+            for values in result.values():
+                [hash(v) for v in values]
+        except TypeError:
+            return dict()
+        return result
+
+    def candidates(self, what):
+        equal = self.equal(what)
+        if '_id' in equal:
+            return [i for i in dict.fromkeys(equal['_id']) if i in self.docs], len(what) == 1
+        best = None
+        for index in self.indexes.values():
+            depth = 0
+            while depth < len(index.keys) and index.keys[depth] in equal:
+                depth += 1
+            if depth > 0 and (best is None or depth > best[0]):
+                best = (depth, index)
+        if best is None:
+            return self.docs.keys(), len(what) == 0
+        return best[1].lookup(equal), len(what) == best[0]
+
+    def find(self, what):
+        ids, covered = self.candidates(what)
+        if not covered:
+            ids = [i for i in ids if match(self.docs[i], what)]
+        if not isinstance(ids, type(self.docs.keys())):
+            ids = sorted(ids, key=self.order.get)
+        return [self.docs[i] for i in ids]
+
+    def count(self, what):
+        ids, covered = self.candidates(what)
+        return len(ids) if covered else len([i for i in ids if match(self.docs[i], what)])
+
+    def put(self, doc):
+        stored = self.docs.get(doc['_id'], None)
+        for index in self.indexes.values():
+            index.check(doc)
+        if stored is not None:
+            for index in self.indexes.values():
+                index.remove(stored)
+        else:
+            self._sequence += 1
+            self.order[doc['_id']] = self._sequence
+        self.docs[doc['_id']] = doc
+        for index in self.indexes.values():
+            index.add(doc)
+
+    def remove(self, doc):
+        for index in self.indexes.values():
+            index.remove(doc)
+        del self.docs[doc['_id']]
+        del self.order[doc['_id']]
+
+
+class memoryDB(StorageBackend):
+    _collections = dict()
+    _versions = dict()
+    _origin = int(time.time() * 1000)
+    _lock = threading.RLock()
+
+    def _coll(self, where, operation, what=None):
+        self._record(where, operation, what)
+        return memoryDB._collections.setdefault(where, Collection())
+
+    def ping(self):
+        return 0.0
+
+    def health(self):
+        return {**super().health(), 'engine': 'memory', 'collections': dict((k, len(c.docs)) for k, c in memoryDB._collections.items())}
+
+    def clear(self):
+        with memoryDB._lock:
+            memoryDB._collections.clear()
+            for where in memoryDB._versions:
+                memoryDB._versions[where] += 1
+        self._invalidate()
+
+    def _bump(self, where):
+        with memoryDB._lock:
+            memoryDB._versions[where] = memoryDB._versions.get(where, memoryDB._origin) + 1
+
+    def versions(self, wheres):
+        self._record('_versions', 'find', ('_id',))
+        with memoryDB._lock:
+            return dict((where, memoryDB._versions.get(where, memoryDB._origin)) for where in wheres)
+
+    def _load(self, where, key, what):
+        with memoryDB._lock:
+            for doc in self._coll(where, 'find_one', what).find(what):
+                return copy.deepcopy(doc)
+        return None
+
+    def _find(self, where, what):
+        with memoryDB._lock:
+            return [copy.deepcopy(doc) for doc in self._coll(where, 'find', what).find(what)]
+
+    @metrics.observed
+    def search_many(self, where, what, fields=None, sort=None, limit=None):
+        with memoryDB._lock:
+            result = list(self._coll(where, 'find', what).find(what))
+        for field, direction in reversed(sort or list()):
+            result.sort(key=lambda d: (d.get(field, None) is not None, d.get(field, None)), reverse=direction < 0)
+        if limit:
+            result = result[:limit]
+        return [project(doc, fields) for doc in result]
+
+    @metrics.observed
+    def count(self, where, what):
+        with memoryDB._lock:
+            return self._coll(where, 'count', what).count(what)
+
+    @metrics.observed
+    def sum(self, where, what_field, what_filter=None):
+        return self._sum_grouped(where, what_field, None, what_filter).get(None, 0)
+
+    @metrics.observed
+    def sum_grouped(self, where, what_field, group_field, what_filter=None):
+        return self._sum_grouped(where, what_field, group_field, what_filter)
+
+    def _sum_grouped(self, where, what_field, group_field, what_filter=None):
+        result = dict()
+        with memoryDB._lock:
+            for doc in self._coll(where, 'aggregate', what_filter).find(what_filter or dict()):
+                value = doc.get(what_field, None)
+                group = None if group_field is None else doc.get(group_field, None)
+                result[group] = result.get(group, 0) + (value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0)
+        return result
+
+    @metrics.observed
+    def create(self, where, what_data):
+        if what_data.get('_id', None) is not None:
+            return False
+        what_data['_id'] = str(ObjectId())
+        try:
+            with memoryDB._lock:
+                self._coll(where, 'insert_one').put(copy.deepcopy(what_data))
+        finally:
+            self._changed(where, what_data['_id'])
+        return True
+
+    def _update(self, coll, docs, with_data):
+        modified = 0
+        for doc in docs:
+            updated = apply_update(copy.deepcopy(doc), with_data)
+            if not updated == doc:
+                coll.put(updated)
+                modified += 1
+        return modified
+
+    @metrics.observed
+    def update(self, where, what_id, with_data):
+        if not self.exists(where, what_id):
+            return False
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'update_one', ('_id',))
+                self._update(coll, coll.find({'_id': what_id}), with_data)
+        finally:
+            self._changed(where, what_id)
+        return True
+
+    @metrics.observed
+    def update_one(self, where, what_data, with_data):
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'update_one', what_data)
+                modified = self._update(coll, coll.find(what_data)[:1], with_data)
+        finally:
+            self._changed(where)
+        return modified > 0
+
+    @metrics.observed
+    def update_many(self, where, what_data, with_data):
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'update_many', what_data)
+                self._update(coll, coll.find(what_data), with_data)
+        finally:
+            self._changed(where)
+        return True
+
+    @metrics.observed
+    def replace(self, where, what_data):
+        if what_data.get('_id', None) is None:
+            return False
+        try:
+            with memoryDB._lock:
+                self._coll(where, 'replace_one', ('_id',)).put(copy.deepcopy(what_data))
+        finally:
+            self._changed(where, what_data['_id'])
+        return True
+
+    @metrics.observed
+    def write_many(self, where, what_datas):
+        failed = dict()
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'bulk_write')
+                for i, what_data in enumerate(what_datas):
+                    created = what_data.get('_id', None) is None
+                    if created:
+                        what_data['_id'] = str(ObjectId())
+                    try:
+                        coll.put(copy.deepcopy(what_data))
+                    except DuplicateKeyError as e:
+                        failed[i] = e.key_value
+                        if created:
+                            what_data['_id'] = None
+        finally:
+            self._changed(where)
+        return failed
+
+    @metrics.observed
+    def delete(self, where, what_id):
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'delete_one', ('_id',))
+                for doc in coll.find({'_id': what_id}):
+                    coll.remove(doc)
+        finally:
+            self._changed(where, what_id)
+
+    @metrics.observed
+    def delete_many(self, where, what_data):
+        try:
+            with memoryDB._lock:
+                coll = self._coll(where, 'delete_many', what_data)
+                for doc in coll.find(what_data):
+                    coll.remove(doc)
+        finally:
+            self._changed(where)
+        return True
+
+    def ensure_index(self, where, keys, unique=False):
+        name = '_'.join(f'{k}_1' for k in keys)
+        with memoryDB._lock:
+            coll = memoryDB._collections.setdefault(where, Collection())
+            if name not in coll.indexes:
+                index = HashIndex(keys, unique)
+                for doc in coll.docs.values():
+                    index.check(doc)
+                    index.add(doc)
+                coll.indexes[name] = index
+        return name
+
+    def indexes(self, where):
+        coll = memoryDB._collections.get(where, Collection())
+        return {'_id_': {'keys': ('_id',), 'unique': False}, **dict((name, {'keys': i.keys, 'unique': i.unique}) for name, i in coll.indexes.items())}
+
+    def index_usage(self, where):
+        coll = memoryDB._collections.get(where, Collection())
+        return dict((name, i.ops) for name, i in coll.indexes.items())
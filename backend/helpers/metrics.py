@@ -0,0 +1,171 @@
+import cherrypy
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+registry = list()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=tuple()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self):
+        return list()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _labels(self.labels, k), v) for k, v in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=tuple(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = dict((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        result = list()
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                result.append((f'{self.name}_bucket', _labels(self.labels, labels, ('le', bound)), cumulative))
+            result.append((f'{self.name}_sum', _labels(self.labels, labels), total))
+            result.append((f'{self.name}_count', _labels(self.labels, labels), cumulative))
+        return result
+
+
+class Callback(Metric):
+    def __init__(self, name, help, kind, labels, callback):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self._callback = callback
+
+    def samples(self):
+        return [(self.name, _labels(self.labels, k), v) for k, v in sorted(self._callback().items())]
+
+
+def render():
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+http_latency = Histogram('i4p_http_request_duration_seconds', 'HTTP request latency by endpoint and method', ['endpoint', 'method'])
+http_requests = Counter('i4p_http_requests_total', 'HTTP requests by endpoint, method and status', ['endpoint', 'method', 'status'])
+http_size = Histogram('i4p_http_response_size_bytes', 'HTTP response body size by endpoint and method', ['endpoint', 'method'], SIZE_BUCKETS)
+db_latency = Histogram('i4p_db_operation_duration_seconds', 'docDB operation latency by collection and operation', ['collection', 'operation'], DB_BUCKETS)
+
+
+def observe_request(endpoint, method, status, duration, size):
+    http_latency.observe(duration, endpoint, method)
+    http_requests.inc(endpoint, method, status)
+    if size is not None:
+        http_size.observe(size, endpoint, method)
+
+
+def observed(func):
+    operation = func.__name__
+
+    @wraps(func)
+    def wrapper(self, where, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(self, where, *args, **kwargs)
+        finally:
+            db_latency.observe(time.perf_counter() - started, where, operation)
+    return wrapper
+
+
+def observed_iter(iterable, where, operation, elapsed=0.0):
+    iterator = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        db_latency.observe(elapsed, where, operation)
+
+
+def _tool_start():
+    cherrypy.serving.request._metrics = {'started': time.perf_counter(), 'endpoint': 'unknown'}
+
+
+def _tool_handler():
+    request = cherrypy.serving.request
+    endpoint = getattr(getattr(request.handler, 'callable', None), '__self__', None)
+    if endpoint is not None:
+        request._metrics['endpoint'] = endpoint.__class__.__name__
+
+
+def _tool_end():
+    request = cherrypy.serving.request
+    response = cherrypy.serving.response
+    size = None if response.stream else len(response.collapse_body())
+    status = str(response.status or 200).split(' ')[0]
+    observe_request(request._metrics['endpoint'], request.method, status, time.perf_counter() - request._metrics['started'], size)
+
+
+class MetricsTool(cherrypy.Tool):
+    def __init__(self):
+        super().__init__('on_start_resource', _tool_start, priority=10)
+
+    def _setup(self):
+        super()._setup()
+        cherrypy.serving.request.hooks.attach('before_handler', _tool_handler, priority=10)
+        cherrypy.serving.request.hooks.attach('before_finalize', _tool_end, priority=90)
+
+
+cherrypy.tools.metrics = MetricsTool()
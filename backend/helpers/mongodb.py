@@ -1,26 +1,203 @@
-from pymongo import MongoClient, errors as mongo_errors
+from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne, errors as mongo_errors, monitoring
 from bson.objectid import ObjectId
 from helpers.config import get_config
+from helpers import metrics
+from helpers.storage import StorageBackend
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
 import multiprocessing
+import threading
+import time
 import sys
 
 _mongoDB = dict()
 config = get_config('mongodb')
 
 
-class mongoDB(object):
-    _conn = dict()
+class LRUCache(object):
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._epoch = 0
+        self._generation = dict()
+        self._lock = threading.Lock()
+
+    def generation(self, where):
+        return (self._epoch, self._generation.get(where, 0))
+
+    def get(self, where, what_id):
+        with self._lock:
+            entry = self._data.get((where, what_id))
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop((where, what_id), None)
+                self.misses += 1
+                return None
+            self._data.move_to_end((where, what_id))
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, where, what_id, what_data, generation):
+        with self._lock:
+            if not generation == self.generation(where):
+                return
+            self._data[(where, what_id)] = (time.monotonic() + self.ttl, copy.deepcopy(what_data))
+            self._data.move_to_end((where, what_id))
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, where=None, what_id=None):
+        with self._lock:
+            if where is None:
+                self._epoch += 1
+                self._data.clear()
+                return
+            self._generation[where] = self._generation.get(where, 0) + 1
+            if what_id is not None:
+                self._data.pop((where, what_id), None)
+            else:
+                for key in [k for k in self._data.keys() if k[0] == where]:
+                    del self._data[key]
 
+
+class PoolStats(monitoring.ConnectionPoolListener):
     def __init__(self):
-        mongoClient = MongoClient(host=config['host'], port=int(config['port']), serverSelectionTimeoutMS=500)
-        mongoDB._conn[multiprocessing.current_process().name] = mongoClient.get_database(config['database'])
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_time = 0.0
+            self.wait_time_max = 0.0
+            self.cleared = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': self.created - self.closed,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_time_avg_ms': round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts > 0 else 0.0,
+                'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+                'cleared': self.cleared
+            }
+
+    def _waited(self):
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return 0.0 if started is None else time.monotonic() - started
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+
+cache_config = config.get('cache', dict())
+_cache = LRUCache(cache_config.get('size', 4096), cache_config.get('ttl', 60))
+pool_config = config.get('pool', dict())
+pool_stats = PoolStats()
+metrics.Callback('i4p_cache_requests_total', 'Reference cache lookups by result', 'counter', ['result'],
+                 lambda: {('hit',): _cache.hits, ('miss',): _cache.misses})
+metrics.Callback('i4p_db_pool_connections', 'MongoDB pool connections by state', 'gauge', ['state'],
+                 lambda: dict(((k,), v) for k, v in pool_stats.stats().items() if k in ['open', 'checked_out']))
+metrics.Callback('i4p_db_pool_checkout_wait_seconds_max', 'Longest MongoDB pool checkout wait', 'gauge', [], lambda: {(): pool_stats.wait_time_max})
+
+
+class mongoDB(StorageBackend):
+    _client = dict()
+    _conn = dict()
+    _lock = threading.Lock()
+
+    def client(self):
+        p = multiprocessing.current_process().name
+        if p not in mongoDB._client:
+            with mongoDB._lock:
+                if p not in mongoDB._client:
+                    options = dict(
+                        maxPoolSize=pool_config.get('max_pool_size', 100),
+                        minPoolSize=pool_config.get('min_pool_size', 0),
+                        waitQueueTimeoutMS=pool_config.get('wait_queue_timeout_ms', None),
+                        serverSelectionTimeoutMS=pool_config.get('server_selection_timeout_ms', 2000),
+                        connectTimeoutMS=pool_config.get('connect_timeout_ms', None),
+                        socketTimeoutMS=pool_config.get('socket_timeout_ms', None),
+                        event_listeners=[pool_stats]
+                    )
+                    if len(pool_config.get('compressors', list())) > 0:
+                        options['compressors'] = pool_config['compressors']
+                    mongoDB._client[p] = MongoClient(host=config['host'], port=int(config['port']), **options)
+                    mongoDB._conn[p] = mongoDB._client[p].get_database(config['database'])
+        return mongoDB._client[p]
+
+    def attach(self, client, database=None):
+        p = multiprocessing.current_process().name
+        with mongoDB._lock:
+            mongoDB._client[p] = client
+            mongoDB._conn[p] = client.get_database(config['database'] if database is None else database)
+        self._invalidate()
+
+    def ping(self):
+        started = time.monotonic()
+        self.client().admin.command('ping')
+        return time.monotonic() - started
+
+    def health(self):
+        return {**super().health(), 'pool': pool_stats.stats()}
 
     def wait_for_connection(self):
         first = True
-        mongoClient = MongoClient(host=config['host'], port=config['port'], serverSelectionTimeoutMS=2000)
         while(True):
             try:
-                mongoClient.server_info()
+                self.ping()
                 print('MongoDB started ... continue', flush=True)
                 return
             except mongo_errors.ServerSelectionTimeoutError:
@@ -31,72 +208,242 @@ class mongoDB(object):
                 print('MongoDB unknown error ... aborting', flush=True)
                 sys.exit(1)
 
-    def is_connected(self):
-        try:
-            mongoClient = MongoClient(host=config['host'], port=config['port'], serverSelectionTimeoutMS=1000)
-            mongoClient.server_info()
-            return True
-        except Exception:
-            return False
-
     def clear(self):
         for c in self.conn().list_collections():
-            self.conn().get_collection(c['name']).drop()
+            if not c['name'] == '_versions':
+                self.conn().get_collection(c['name']).drop()
+        self.coll('_versions').update_many(dict(), {'$inc': {'version': 1}})
+        self._invalidate()
+
+    @contextmanager
+    def transaction(self):
+        if self._pending() is not None:
+            yield
+            return
+        mongoDB._local.pending = set()
+        try:
+            if self._transactions_supported():
+                with self.conn().client.start_session() as session:
+                    with session.start_transaction():
+                        mongoDB._local.session = session
+                        try:
+                            yield
+                        finally:
+                            mongoDB._local.session = None
+            else:
+                yield
+        finally:
+            pending, mongoDB._local.pending = mongoDB._local.pending, None
+            for where in pending:
+                self._invalidate(where)
+            self._bump_many(pending)
+
+    def _session(self):
+        return getattr(mongoDB._local, 'session', None)
+
+    def _pending(self):
+        return getattr(mongoDB._local, 'pending', None)
+
+    def _transactions_supported(self):
+        topology = getattr(self.conn().client, 'topology_description', None)
+        return getattr(topology, 'topology_type_name', None) in ['ReplicaSetWithPrimary', 'Sharded']
+
+    def _invalidate(self, where=None, what_id=None):
+        super()._invalidate(where, what_id)
+        if where is None or where in cache_config.get('collections', list()):
+            _cache.invalidate(where, what_id)
+
+    def _bump(self, where):
+        if self._pending() is not None:
+            self._pending().add(where)
+        else:
+            self._bump_many([where])
+
+    def _bump_many(self, wheres):
+        if len(wheres) > 0:
+            requests = [UpdateOne({'_id': where}, {'$inc': {'version': 1}}, upsert=True) for where in sorted(wheres)]
+            self._coll('_versions', 'bulk_write').bulk_write(requests, ordered=False)
+
+    def versions(self, wheres):
+        found = self._coll('_versions', 'find', ('_id',)).find({'_id': {'$in': list(wheres)}})
+        return {**dict((where, 0) for where in wheres), **dict((d['_id'], d['version']) for d in found)}
+
+    def _load(self, where, key, what):
+        if not key[0] == '_id' or where not in cache_config.get('collections', list()) or self._session() is not None:
+            return self._coll(where, 'find_one', what).find_one(what, session=self._session())
+        result = _cache.get(where, key[1])
+        if result is None:
+            generation = _cache.generation(where)
+            result = self._coll(where, 'find_one', what).find_one(what)
+            if result is not None:
+                _cache.set(where, key[1], result, generation)
+        return result
+
+    def cache_watch(self):
+        watcher = threading.Thread(target=self._cache_watch, name='cache_watch', daemon=True)
+        watcher.start()
+        return watcher
+
+    def _cache_watch(self):
+        pipeline = [{'$match': {'ns.coll': {'$in': cache_config.get('collections', list())}}}]
+        while True:
+            try:
+                with self.conn().watch(pipeline) as stream:
+                    for change in stream:
+                        if 'documentKey' in change:
+                            _cache.invalidate(change['ns']['coll'], change['documentKey']['_id'])
+                        else:
+                            _cache.invalidate(change['ns']['coll'])
+            except mongo_errors.OperationFailure:
+                print('MongoDB change streams not supported ... cache relies on ttl', flush=True)
+                return
+            except mongo_errors.PyMongoError:
+                _cache.invalidate()
+                time.sleep(1)
 
     def conn(self):
         p = multiprocessing.current_process().name
         if p not in mongoDB._conn:
-            mongoDB()
+            self.client()
         return mongoDB._conn[p]
 
     def coll(self, which):
         return self.conn().get_collection(which)
 
-    def exists(self, where, what_id):
-        return self.get(where, what_id) is not None
-
-    def get(self, where, what_id):
-        return self.coll(where).find_one({'_id': what_id})
+    def _coll(self, where, operation, what=None):
+        self._record(where, operation, what)
+        return self.coll(where)
 
-    def search_one(self, where, what):
-        return self.coll(where).find_one(what)
+    def _find(self, where, what):
+        return self._coll(where, 'find', what).find(what, session=self._session())
 
-    def search_many(self, where, what):
-        return self.coll(where).find(what)
+    def search_many(self, where, what, fields=None, sort=None, limit=None):
+        started = time.perf_counter()
+        cursor = self._coll(where, 'find', what).find(what, fields, session=self._session())
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return metrics.observed_iter(cursor, where, 'search_many', time.perf_counter() - started)
 
+    @metrics.observed
     def create(self, where, what_data):
         if what_data.get('_id', None) is not None:
             return False
         what_data['_id'] = str(ObjectId())
-        self.coll(where).insert_one(what_data)
+        try:
+            self._coll(where, 'insert_one').insert_one(what_data, session=self._session())
+        finally:
+            self._changed(where, what_data['_id'])
         return True
 
+    @metrics.observed
     def update(self, where, what_id, with_data):
         if not self.exists(where, what_id):
             return False
-        self.coll(where).update_one({'_id': what_id}, with_data)
+        try:
+            self._coll(where, 'update_one', ('_id',)).update_one({'_id': what_id}, with_data, session=self._session())
+        finally:
+            self._changed(where, what_id)
         return True
 
+    @metrics.observed
+    def update_one(self, where, what_data, with_data):
+        try:
+            result = self._coll(where, 'update_one', what_data).update_one(what_data, with_data, session=self._session())
+        finally:
+            self._changed(where)
+        return result.modified_count > 0
+
+    @metrics.observed
     def update_many(self, where, what_data, with_data):
-        self.coll(where).update_many(what_data, with_data)
+        try:
+            self._coll(where, 'update_many', what_data).update_many(what_data, with_data, session=self._session())
+        finally:
+            self._changed(where)
         return True
 
+    @metrics.observed
     def replace(self, where, what_data):
         if what_data.get('_id', None) is None:
             return False
-        self.coll(where).replace_one({'_id': what_data['_id']}, what_data, True)
+        try:
+            self._coll(where, 'replace_one', ('_id',)).replace_one({'_id': what_data['_id']}, what_data, True, session=self._session())
+        finally:
+            self._changed(where, what_data['_id'])
         return True
 
+    @metrics.observed
+    def write_many(self, where, what_datas):
+        requests = list()
+        for what_data in what_datas:
+            if what_data.get('_id', None) is None:
+                what_data['_id'] = str(ObjectId())
+                requests.append(InsertOne(what_data))
+            else:
+                requests.append(ReplaceOne({'_id': what_data['_id']}, what_data, True))
+        failed = dict()
+        try:
+            if len(requests) > 0:
+                self._coll(where, 'bulk_write').bulk_write(requests, ordered=False, session=self._session())
+        except mongo_errors.BulkWriteError as e:
+            for error in e.details.get('writeErrors', list()):
+                failed[error['index']] = error.get('keyValue', dict())
+                if isinstance(requests[error['index']], InsertOne):
+                    what_datas[error['index']]['_id'] = None
+        finally:
+            self._changed(where)
+        return failed
+
+    @metrics.observed
     def delete(self, where, what_id):
-        self.coll(where).delete_one({'_id': what_id})
+        try:
+            self._coll(where, 'delete_one', ('_id',)).delete_one({'_id': what_id}, session=self._session())
+        finally:
+            self._changed(where, what_id)
+
+    @metrics.observed
+    def delete_many(self, where, what_data):
+        try:
+            self._coll(where, 'delete_many', what_data).delete_many(what_data, session=self._session())
+        finally:
+            self._changed(where)
+        return True
+
+    @metrics.observed
+    def count(self, where, what):
+        return self._coll(where, 'count', what).count_documents(what, session=self._session())
+
+    @metrics.observed
+    def estimated_count(self, where):
+        return self._coll(where, 'count').estimated_document_count()
 
+    @metrics.observed
     def sum(self, where, what_field, what_filter=None):
         pipeline = list()
         if what_filter is not None:
             pipeline.append({'$match': what_filter})
         pipeline.append({'$group': {'_id': 'sum', what_field: {'$sum': f'${what_field}'}}})
-        result = self.coll(where).aggregate(pipeline)
-        if result.alive:
-            return result.next()[what_field]
-        else:
-            return 0
+        result = next(self._coll(where, 'aggregate', what_filter).aggregate(pipeline, session=self._session()), None)
+        return 0 if result is None else result[what_field]
+
+    @metrics.observed
+    def sum_grouped(self, where, what_field, group_field, what_filter=None):
+        pipeline = list()
+        if what_filter is not None:
+            pipeline.append({'$match': what_filter})
+        pipeline.append({'$group': {'_id': f'${group_field}', what_field: {'$sum': f'${what_field}'}}})
+        return dict((r['_id'], r[what_field]) for r in self._coll(where, 'aggregate', what_filter).aggregate(pipeline, session=self._session()))
+
+    def ensure_index(self, where, keys, unique=False):
+        return self.coll(where).create_index([(k, 1) for k in keys], unique=unique)
+
+    def indexes(self, where):
+        return dict((name, {'keys': tuple(k for k, d in info['key']), 'unique': info.get('unique', False)})
+                    for name, info in self.coll(where).index_information().items())
+
+    def index_usage(self, where):
+        try:
+            return dict((s['name'], s['accesses']['ops']) for s in self.coll(where).aggregate([{'$indexStats': {}}]))
+        except (mongo_errors.PyMongoError, NotImplementedError):
+            return None
@@ -0,0 +1,33 @@
+import re
+
+PREFIX_MIN = 2
+PREFIX_MAX = 16
+
+
+def tokens(text):
+    return [t for t in re.split(r'[^0-9a-z]+', str(text or '').lower()) if len(t) >= PREFIX_MIN]
+
+
+def query_terms(text):
+    return list(dict.fromkeys(t[:PREFIX_MAX] for t in tokens(text)))
+
+
+def prefix_terms(token):
+    result = {token: 1.0}
+    starts = [0] + [i for i in range(1, len(token)) if not token[i - 1].isdigit() == token[i].isdigit()]
+    for start in starts:
+        factor = 0.5 if start == 0 else 0.25
+        for end in range(start + PREFIX_MIN, min(len(token), start + PREFIX_MAX) + 1):
+            term = token[start:end]
+            result[term] = max(result.get(term, 0.0), factor)
+    return result
+
+
+def index_terms(values, weights, prefixes=tuple()):
+    result = dict()
+    for field, weight in weights.items():
+        for token in tokens(values.get(field, None)):
+            terms = prefix_terms(token) if field in prefixes else {token: 1.0}
+            for term, factor in terms.items():
+                result[term] = max(result.get(term, 0.0), weight * factor)
+    return result
@@ -0,0 +1,305 @@
+from helpers.config import get_config
+from helpers import metrics
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import copy
+import os
+import threading
+import traceback
+
+call_config = get_config('mongodb').get('calls', dict())
+
+
+COMPARISONS = {
+    '$ne': lambda value, arg: not value == arg,
+    '$in': lambda value, arg: value in arg,
+    '$nin': lambda value, arg: value not in arg,
+    '$lt': lambda value, arg: value is not None and arg is not None and value < arg,
+    '$lte': lambda value, arg: value is not None and arg is not None and value <= arg,
+    '$gt': lambda value, arg: value is not None and arg is not None and value > arg,
+    '$gte': lambda value, arg: value is not None and arg is not None and value >= arg,
+    '$all': lambda value, arg: isinstance(value, list) and all(a in value for a in arg)
+}
+
+
+def is_operator(cond):
+    return isinstance(cond, dict) and len(cond) > 0 and all(k.startswith('$') for k in cond)
+
+
+def lookup(doc, field):
+    value = doc
+    for key in field.split('.'):
+        if isinstance(value, list):
+            value = [v.get(key, None) for v in value if isinstance(v, dict)]
+        elif isinstance(value, dict):
+            value = value.get(key, None)
+        else:
+            return None
+    return value
+
+
+def match(doc, what):
+    for field, cond in what.items():
+        if field == '$and':
+            if not all(match(doc, w) for w in cond):
+                return False
+            continue
+        value = lookup(doc, field)
+        if is_operator(cond):
+            for op, arg in cond.items():
+                if op not in COMPARISONS:
+                    raise ValueError(f'unsupported query operator {op}')
+                try:
+                    if not COMPARISONS[op](value, arg):
+                        return False
+                except TypeError:
+                    return False
+        elif not value == cond:
+            return False
+    return True
+
+
+class CallBudgetExceeded(Exception):
+    pass
+
+
+class CallLog(object):
+    def __init__(self, threshold=10, budget=None):
+        self.threshold = threshold
+        self.budget = budget
+        self.calls = 0
+        self.shapes = dict()
+        self.sites = dict()
+        self._lock = threading.Lock()
+
+    def record(self, where, operation, what=None):
+        shape = (where, operation, tuple(sorted(what)) if what is not None else tuple())
+        with self._lock:
+            self.calls += 1
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+            repeated = self.shapes[shape] == self.threshold + 1
+            exceeded = self.budget is not None and self.calls > self.budget
+        if repeated:
+            self.sites[shape] = self.call_site()
+        if exceeded:
+            raise CallBudgetExceeded(f'{self.calls} database calls exceed the budget of {self.budget}, last {shape} at {self.call_site()}')
+
+    def repeated(self):
+        return dict((shape, n) for shape, n in self.shapes.items() if n > self.threshold)
+
+    def report(self):
+        return [f'{n}x {shape[1]} on {shape[0]} by {list(shape[2])} from {self.sites.get(shape, "unknown")}' for shape, n in self.repeated().items()]
+
+    def call_site(self):
+        for frame in reversed(traceback.extract_stack()[:-2]):
+            if f'{os.sep}elements{os.sep}' in frame.filename:
+                return f'{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}'
+        return 'unknown'
+
+
+class StorageBackend(ABC):
+    _local = threading.local()
+
+    @abstractmethod
+    def ping(self):
+        raise NotImplementedError
+
+    def health(self):
+        result = {'connected': True, 'ping_ms': None}
+        try:
+            result['ping_ms'] = round(self.ping() * 1000, 3)
+        except Exception:
+            result['connected'] = False
+        return result
+
+    def wait_for_connection(self):
+        pass
+
+    def is_connected(self):
+        try:
+            self.ping()
+            return True
+        except Exception:
+            return False
+
+    def cache_watch(self):
+        return None
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def identity_map(self, identity=None):
+        if self._identity() is not None:
+            yield
+            return
+        StorageBackend._local.identity = dict() if identity is None else identity
+        try:
+            yield
+        finally:
+            StorageBackend._local.identity = None
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def _session(self):
+        return None
+
+    def _identity(self):
+        return getattr(StorageBackend._local, 'identity', None)
+
+    def _invalidate(self, where=None, what_id=None):
+        identity = self._identity()
+        if identity is not None:
+            if where is None:
+                identity.clear()
+            else:
+                identity.pop(where, None)
+
+    def _changed(self, where, what_id=None):
+        self._invalidate(where, what_id)
+        self._bump(where)
+
+    @abstractmethod
+    def _bump(self, where):
+        raise NotImplementedError
+
+    @abstractmethod
+    def versions(self, wheres):
+        raise NotImplementedError
+
+    def _find_one(self, where, key, what):
+        identity = self._identity()
+        if identity is None or self._session() is not None:
+            return self._load(where, key, what)
+        cached = identity.setdefault(where, dict())
+        if key not in cached:
+            cached[key] = self._load(where, key, what)
+        return copy.deepcopy(cached[key])
+
+    @abstractmethod
+    def _load(self, where, key, what):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _find(self, where, what):
+        raise NotImplementedError
+
+    def _record(self, where, operation, what=None):
+        for log in getattr(StorageBackend._local, 'calls', list()):
+            log.record(where, operation, what)
+
+    @contextmanager
+    def call_log(self, threshold=None, budget=None, log=None):
+        if log is None:
+            threshold = call_config.get('repeat_threshold', 10) if threshold is None else threshold
+            log = CallLog(threshold, call_config.get('budget', None) if budget is None else budget)
+        logs = getattr(StorageBackend._local, 'calls', list())
+        StorageBackend._local.calls = logs + [log]
+        try:
+            yield log
+        finally:
+            StorageBackend._local.calls = logs
+
+    def exists(self, where, what_id):
+        return self.get(where, what_id) is not None
+
+    @metrics.observed
+    def get(self, where, what_id):
+        return self._find_one(where, ('_id', what_id), {'_id': what_id})
+
+    @metrics.observed
+    def search_one(self, where, what):
+        return self._find_one(where, ('search', repr(what)), what)
+
+    @metrics.observed
+    def prefetch(self, where, what_ids):
+        identity = self._identity()
+        if identity is None or self._session() is not None:
+            return
+        cached = identity.setdefault(where, dict())
+        missing = [i for i in what_ids if ('_id', i) not in cached]
+        if len(missing) == 0:
+            return
+        for i in missing:
+            cached[('_id', i)] = None
+        for fromdb in self._find(where, {'_id': {'$in': missing}}):
+            cached[('_id', fromdb['_id'])] = fromdb
+
+    @metrics.observed
+    def prefetch_by(self, where, what_field, values):
+        identity = self._identity()
+        if identity is None or self._session() is not None:
+            return
+        cached = identity.setdefault(where, dict())
+        missing = [v for v in values if ('search', repr({what_field: v})) not in cached]
+        if len(missing) == 0:
+            return
+        for fromdb in self._find(where, {what_field: {'$in': missing}}):
+            cached.setdefault(('search', repr({what_field: fromdb[what_field]})), fromdb)
+        for v in missing:
+            cached.setdefault(('search', repr({what_field: v})), None)
+
+    @abstractmethod
+    def search_many(self, where, what, fields=None, sort=None, limit=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, where, what):
+        raise NotImplementedError
+
+    def estimated_count(self, where):
+        return self.count(where, dict())
+
+    @abstractmethod
+    def sum(self, where, what_field, what_filter=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def sum_grouped(self, where, what_field, group_field, what_filter=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def create(self, where, what_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, where, what_id, with_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_one(self, where, what_data, with_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_many(self, where, what_data, with_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace(self, where, what_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_many(self, where, what_datas):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, where, what_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_many(self, where, what_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def ensure_index(self, where, keys, unique=False):
+        raise NotImplementedError
+
+    @abstractmethod
+    def indexes(self, where):
+        raise NotImplementedError
+
+    def index_usage(self, where):
+        return None
@@ -2,12 +2,16 @@ import cherrypy
 import cherrypy_cors
 from helpers.docdb import docDB
 from helpers.config import get_config
+from helpers import metrics
 from helpers.elementendpoint import ElementEndpointBase
 from elements import MountingStyle, Footprint, Category, Unit, Part, Distributor, PartDistributor, StorageGroup, StorageLocation
 from elements import Order, PartLocation, StockChange
+from elements._elementBase import ElementBase
 
 
 class Inventory4Parts():
+    _cp_config = {'tools.metrics.on': True}
+
     def __init__(self):
         self.mountingstyle = MountingStyleEndpoint()
         self.footprint = FootprintEndpoint()
@@ -22,6 +26,19 @@ class Inventory4Parts():
         self.partlocation = PartLocationEndpoint()
         self.stockchange = StockChangeEndpoint()
 
+    @cherrypy.expose()
+    def metrics(self):
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return metrics.render()
+
+    @cherrypy.expose()
+    @cherrypy.tools.json_out()
+    def health(self):
+        result = docDB.health()
+        if not result['connected']:
+            cherrypy.response.status = 503
+        return result
+
 
 class MountingStyleEndpoint(ElementEndpointBase):
     _element = MountingStyle
@@ -41,6 +58,38 @@ class UnitEndpoint(ElementEndpointBase):
 
 class PartEndpoint(ElementEndpointBase):
     _element = Part
+    _cached = True
+    _actions = {'_search': '_search_action'}
+
+    def _search_action(self, params):
+        for name in ['q', 'facets', 'offset']:
+            if name in params and not isinstance(params[name], str):
+                return 400, {'error': f'{name} given more than once'}
+        q = params.pop('q', None)
+        facets = params.pop('facets', None)
+        offset = params.pop('offset', '0')
+        limit, fields, error = self._listing_args(params.pop('limit', '20'), params.pop('fields', None))
+        if error is not None:
+            return 400, error
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            offset = -1
+        if offset < 0:
+            return 400, {'error': 'offset needs to be a non-negative integer'}
+        if q is None:
+            return 400, {'error': 'q is required'}
+        what, derived, errors = self._element.parse_filters(params)
+        if len(derived) > 0:
+            errors.update(dict((attr, 'derived attributes can not be used to narrow a search') for attr in derived))
+        if len(errors) > 0:
+            return 400, {'error': 'invalid filters', 'errors': errors}
+        found = self._element.search(q, what, limit=limit, offset=offset, facets=facets is not None and facets.lower() not in ['0', 'false'])
+        if found is None:
+            return 400, {'error': 'q needs to contain at least one term of two or more characters'}
+        elements = [el for el, score in found['results']]
+        found['results'] = [{**r, 'score': score} for r, (el, score) in zip(self._element.json_many(elements, fields), found['results'])]
+        return 200, found
 
 
 class DistributorEndpoint(ElementEndpointBase):
@@ -53,22 +102,42 @@ class PartDistributorEndpoint(ElementEndpointBase):
 
 class StorageGroupEndpoint(ElementEndpointBase):
     _element = StorageGroup
+    _cached = True
+    _resources = {'stock': 'stock'}
 
 
 class StorageLocationEndpoint(ElementEndpointBase):
     _element = StorageLocation
+    _cached = True
+    _resources = {'stock': 'stock'}
 
 
 class OrderEndpoint(ElementEndpointBase):
     _element = Order
+    _cached = True
 
 
 class PartLocationEndpoint(ElementEndpointBase):
     _element = PartLocation
+    _cached = True
 
 
 class StockChangeEndpoint(ElementEndpointBase):
     _element = StockChange
+    _stream = True
+
+
+def prepare_database():
+    docDB.wait_for_connection()
+    for (name, keys), error in ElementBase.ensure_indexes().items():
+        print(f"Index {keys} on {name} could not be created: {error}", flush=True)
+    if docDB.estimated_count('PartSearch') == 0 and docDB.estimated_count('Part') > 0:
+        Part.search_rebuild()
+    for name, element in ElementBase._registry.items():
+        if element.tree_parent() is not None and docDB.estimated_count(element.tree_name()) == 0 and docDB.estimated_count(name) > 0:
+            element.tree_rebuild()
+    if get_config('mongodb')['cache'].get('change_stream', False):
+        docDB.cache_watch()
 
 
 if __name__ == '__main__':
@@ -78,5 +147,5 @@ if __name__ == '__main__':
     cherrypy_cors.install()
     cherrypy.config.update({'server.socket_host': '0.0.0.0', 'server.socket_port': config['port'], 'cors.expose.on': True})
 
-    docDB.wait_for_connection()
+    prepare_database()
     cherrypy.quickstart(Inventory4Parts(), '/', conf)
@@ -0,0 +1,272 @@
+import json
+import logging
+import time
+from functools import partial
+from aiohttp import web
+from cherrypy._json import encode
+from helpers.docdb import docDB, asyncDB
+from helpers.config import get_config
+from helpers import metrics
+from helpers.elementendpoint import etag_matches, versions_etag, response_cache
+from i4p import Inventory4Parts, prepare_database
+
+
+def json_response(status, result, headers=None):
+    body = result if result is None or isinstance(result, bytes) else b''.join(encode(result))
+    return web.Response(status=status, body=body, headers=headers, content_type='application/json')
+
+
+@web.middleware
+async def cors(request, handler):
+    response = await handler(request)
+    if 'Origin' in request.headers:
+        response.headers['Access-Control-Allow-Origin'] = request.headers['Origin']
+    return response
+
+
+@web.middleware
+async def observe(request, handler):
+    started = time.perf_counter()
+    status = 500
+    size = None
+    try:
+        response = await handler(request)
+        status = response.status
+        if isinstance(response, web.Response) and isinstance(response.body, bytes):
+            size = len(response.body)
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        owner = getattr(request.match_info.handler, '__self__', None)
+        if isinstance(owner, AsyncElementEndpoint):
+            endpoint = owner._endpoint.__class__.__name__
+        else:
+            endpoint = getattr(request.match_info.handler, '__name__', 'unknown')
+        metrics.observe_request(endpoint, request.method, str(status), time.perf_counter() - started, size)
+
+
+LISTING_ARGS = {'limit', 'after', 'fields', 'dry_run', 'sort', 'count'}
+
+
+def query_params(request, names):
+    return dict((k, v[0] if len(v) == 1 else v) for k, v in ((k, request.query.getall(k)) for k in names if k in request.query))
+
+
+class AsyncElementEndpoint():
+    def __init__(self, endpoint):
+        self._endpoint = endpoint
+        self._element = endpoint._element
+
+    async def index(self, request):
+        element_id = request.match_info.get('element_id', None)
+        with asyncDB.identity_map(), asyncDB.call_log() as calls:
+            versions = await self._versions() if request.method == 'GET' and not element_id == '_bulk' else None
+            etag = request['etag'] = None if versions is None else versions_etag(versions)
+            key = None
+            if self._endpoint._cached and versions is not None:
+                key = (request.path, tuple(sorted((k, repr(v)) for k, v in request.query.items())), versions)
+            not_modified = etag is not None and etag_matches(etag, request.headers.get('If-None-Match', None))
+            if not_modified:
+                not_modified = await self._exists(element_id, request.match_info.get('resource', None))
+            cached = None if key is None or not_modified else response_cache.get(key)
+            if not_modified:
+                response = web.Response(status=304)
+            elif cached is not None:
+                response = web.Response(status=200, body=cached, headers={'X-Cache': 'HIT'}, content_type='application/json')
+            else:
+                if 'resource' in request.match_info:
+                    response = await self._index_resource(request, request.match_info['element_id'], request.match_info['resource'])
+                else:
+                    response = await self._index(request, element_id)
+                if key is not None and not response.prepared and response.status == 200 and isinstance(response.body, bytes):
+                    response.headers['X-Cache'] = 'MISS'
+                    response_cache.set(key, response.body)
+        if not response.prepared:
+            if etag is not None and response.status in [200, 304]:
+                response.headers['ETag'] = etag
+            response.headers['X-DB-Calls'] = str(calls.calls)
+        for line in calls.report():
+            logging.getLogger('aiohttp.server').warning(f'{self._endpoint.__class__.__name__} {request.method}: {line}')
+        return response
+
+    async def _json(self, request):
+        try:
+            return await request.json()
+        except json.JSONDecodeError:
+            return None
+
+    async def _versions(self):
+        return tuple(sorted((await asyncDB.versions(self._element.dependencies())).items()))
+
+    async def _exists(self, element_id, resource=None):
+        if element_id is None or element_id in self._endpoint._actions:
+            return True
+        if resource is not None and resource not in self._endpoint._resources:
+            return False
+        return await asyncDB.exists(self._element.__name__, element_id)
+
+    async def _get(self, element_id):
+        fromdb = await asyncDB.get(self._element.__name__, element_id)
+        return None if fromdb is None else self._element(fromdb)
+
+    async def _count(self, what, derived):
+        if derived:
+            return await asyncDB.run(self._element.count, what, derived)
+        if not what:
+            return await asyncDB.estimated_count(self._element.__name__)
+        return await asyncDB.count(self._element.__name__, what)
+
+    async def _save(self, el):
+        await asyncDB.gather(self._element.prefetch_queries([el]))
+        result = await asyncDB.run(el.save)
+        return json_response(400 if 'errors' in result else 201, result)
+
+    async def _index_bulk(self, request):
+        allow = {'Allow': 'OPTIONS, POST'}
+        if request.method == 'OPTIONS':
+            return json_response(200, None, {**allow, 'Access-Control-Allow-Methods': 'POST'})
+        elif not request.method == 'POST':
+            return json_response(405, {'error': 'method not allowed'}, allow)
+        operations = await self._json(request)
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            return json_response(400, {'error': 'Submitted data need to be of type list of dict'})
+        return json_response(200, await asyncDB.run(self._endpoint._bulk_operations, operations))
+
+    async def _index_action(self, request, action):
+        allow = {'Allow': 'OPTIONS, GET'}
+        if request.method == 'OPTIONS':
+            return json_response(200, None, {**allow, 'Access-Control-Allow-Methods': 'GET'})
+        elif not request.method == 'GET':
+            return json_response(405, {'error': 'method not allowed'}, allow)
+        params = query_params(request, set(request.query) - (LISTING_ARGS - {'limit', 'fields'}))
+        status, result = await asyncDB.run(getattr(self._endpoint, self._endpoint._actions[action]), params)
+        return json_response(status, result)
+
+    async def _index_resource(self, request, element_id, resource):
+        allow = {'Allow': 'OPTIONS, GET'}
+        if resource not in self._endpoint._resources:
+            return json_response(404, {'error': f'resource {resource} not found'})
+        if request.method == 'OPTIONS':
+            return json_response(200, None, {**allow, 'Access-Control-Allow-Methods': 'GET'})
+        elif not request.method == 'GET':
+            return json_response(405, {'error': 'method not allowed'}, allow)
+        el = await self._get(element_id)
+        if el is None:
+            return json_response(404, {'error': f'id {element_id} not found'})
+        return json_response(200, await asyncDB.run(getattr(el, self._endpoint._resources[resource])))
+
+    async def _index_stream(self, request, elements, fields, derived=True):
+        response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+        if request.get('etag', None) is not None:
+            response.headers['ETag'] = request['etag']
+        await response.prepare(request)
+        chunks = self._endpoint._stream_json(elements, fields, derived)
+        while True:
+            chunk = await asyncDB.run(next, chunks, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def _index(self, request, element_id):
+        if element_id == '_bulk':
+            return await self._index_bulk(request)
+        if element_id in self._endpoint._actions:
+            return await self._index_action(request, element_id)
+        allow = {'Allow': 'OPTIONS, GET, POST' if element_id is None else 'OPTIONS, GET, PATCH, DELETE'}
+        if request.method == 'OPTIONS':
+            if element_id is not None and await self._get(element_id) is None:
+                return json_response(404, {'error': f'id {element_id} not found'})
+            return json_response(200, None, {**allow, 'Access-Control-Allow-Methods': allow['Allow'].replace('OPTIONS, ', '')})
+        elif request.method == 'GET':
+            if element_id is not None:
+                el = await self._get(element_id)
+                if el is None:
+                    return json_response(404, {'error': f'id {element_id} not found'})
+                await asyncDB.gather(self._element.derived_queries([el]))
+                return json_response(200, (await asyncDB.run(self._element.json_encoded, [el], derived=False))[1:-1])
+            args = query_params(request, LISTING_ARGS)
+            after = args.get('after', None)
+            limit, fields, error = self._endpoint._listing_args(args.get('limit', None), args.get('fields', None))
+            if error is None:
+                filters = query_params(request, set(request.query) - LISTING_ARGS)
+                query, error = self._endpoint._query_args(after, args.get('sort', None), args.get('count', None), filters)
+            if error is not None:
+                return json_response(400, error)
+            if query['count']:
+                return json_response(200, {'count': await self._count(query['what'], query['derived'])})
+            projection = None if query['derived'] else self._element.projection(fields)
+            select = partial(self._element.select, query['what'], query['derived'], limit=limit, after=after, fields=projection, sort=query['sort'])
+            if self._endpoint._stream:
+                return await self._index_stream(request, await asyncDB.run(select), fields, derived=not query['derived'])
+            if query['derived']:
+                elements = await asyncDB.run(lambda: list(select()))
+            else:
+                what, sort = self._element.iterate_query(query['what'], limit, after, query['sort'])
+                found = await asyncDB.search_many(self._element.__name__, what, fields=projection, sort=sort, limit=limit)
+                elements = [self._element(fromdb) for fromdb in found]
+            if self._element.wants_derived(fields) and not query['derived']:
+                await asyncDB.gather(self._element.derived_queries(elements))
+            return json_response(200, await asyncDB.run(self._element.json_encoded, elements, fields, derived=False))
+        elif request.method == 'POST':
+            if element_id is not None:
+                return json_response(405, {'error': 'POST not allowed on existing objects'}, allow)
+            attr = await self._json(request)
+            if not isinstance(attr, dict):
+                return json_response(400, {'error': 'Submitted data need to be of type dict'})
+            attr.pop('_id', None)
+            return await self._save(self._element(attr))
+        elif request.method == 'PATCH':
+            if element_id is None:
+                return json_response(405, {'error': 'PATCH not allowed on indexes'}, allow)
+            el = await self._get(element_id)
+            if el is None:
+                return json_response(404, {'error': f'id {element_id} not found'})
+            attr = await self._json(request)
+            if not isinstance(attr, dict):
+                return json_response(400, {'error': 'Submitted data need to be of type dict'})
+            attr.pop('_id', None)
+            for k, v in attr.items():
+                el[k] = v
+            return await self._save(el)
+        elif request.method == 'DELETE':
+            if element_id is None:
+                return json_response(405, {'error': 'DELETE not allowed on indexes'}, allow)
+            el = await self._get(element_id)
+            if el is None:
+                return json_response(404, {'error': f'id {element_id} not found'})
+            dry_run, error = self._endpoint._delete_args(query_params(request, ['dry_run']).get('dry_run', None))
+            if error is not None:
+                return json_response(400, error)
+            result = await asyncDB.run(el.delete, dry_run=dry_run)
+            return json_response(400 if 'error' in result else 200, result)
+        return json_response(405, {'error': 'method not allowed'}, allow)
+
+
+async def health(request):
+    result = await asyncDB.run(docDB.health)
+    return json_response(200 if result['connected'] else 503, result)
+
+
+async def metrics_text(request):
+    return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+def make_app():
+    app = web.Application(middlewares=[observe, cors])
+    app.router.add_route('GET', '/health', health)
+    app.router.add_route('GET', '/metrics', metrics_text)
+    for name, endpoint in vars(Inventory4Parts()).items():
+        handler = AsyncElementEndpoint(endpoint).index
+        for path in [f'/{name}', f'/{name}/{{element_id}}', f'/{name}/{{element_id}}/{{resource}}']:
+            app.router.add_route('*', path, handler)
+            app.router.add_route('*', f'{path}/', handler)
+    return app
+
+
+if __name__ == '__main__':
+    prepare_database()
+    web.run_app(make_app(), host='0.0.0.0', port=get_config('server')['port'])
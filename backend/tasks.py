@@ -4,3 +4,37 @@ from invoke import task
 @task(name='coverage')
 def coverage(c):
     c.run('coverage erase && coverage run --concurrency=multiprocessing -m unittest discover; coverage combine && coverage html && coverage report')
+
+
+@task(name='stock-check')
+def stock_check(c, rebuild=False):
+    from elements import PartLocation
+    mismatches = PartLocation.stock_check(rebuild=rebuild)
+    for pl_id in mismatches:
+        print(f"PartLocation {pl_id} stock counter {'rebuild' if rebuild else 'inconsistent'}")
+    print(f'{len(mismatches)} inconsistent stock counters found')
+
+
+@task(name='index-report')
+def index_report(c, ensure=False):
+    from elements._elementBase import ElementBase
+    if ensure:
+        for (name, keys), error in ElementBase.ensure_indexes().items():
+            print(f"Index {keys} on {name} could not be created: {error}")
+    for name, report in ElementBase.index_report().items():
+        for keys in report['missing']:
+            print(f"{name}: missing index on {', '.join(keys)}")
+        for idx in report['unused']:
+            print(f"{name}: index {idx} is unused")
+        for idx in report['undeclared']:
+            print(f"{name}: index {idx} is not declared by the element")
+
+
+@task(name='benchmark')
+def benchmark(c, engine='mongomock', scale=1.0, seed=0, repeat=5, output=None, compare=None):
+    options = f'--engine {engine} --scale {scale} --seed {seed} --repeat {repeat}'
+    if output is not None:
+        options += f' --output {output}'
+    if compare is not None:
+        options += f' --compare {compare}'
+    c.run(f'python -m benchmarks {options}')
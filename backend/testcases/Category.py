@@ -66,6 +66,38 @@ class TestCategory(unittest.TestCase):
         self.assertEqual(len(Category.all()), 1)
         self.assertIsNone(child['parent_category_id'])
 
+    def test_tree_deep_cycle_and_reparenting(self):
+        docDB.clear()
+        root = Category({'name': 'root'})
+        root.save()
+        child = Category({'name': 'child', 'parent_category_id': root['_id']})
+        child.save()
+        leaf = Category({'name': 'leaf', 'parent_category_id': child['_id']})
+        leaf.save()
+        self.assertEqual(Category.ancestors(leaf['_id']), [root['_id'], child['_id']])
+        self.assertEqual(Category.subtree(root['_id']), [root['_id'], child['_id'], leaf['_id']])
+        # deeper cycles are rejected by a single lookup
+        root['parent_category_id'] = leaf['_id']
+        with docDB.call_log() as log:
+            result = root.save()
+        self.assertIn('parent_category_id', result['errors'])
+        self.assertEqual(log.shapes.get(('CategoryTree', 'count', ('ancestor', 'descendant')), 0), 1)
+        # reparenting moves the whole subtree
+        other = Category({'name': 'other'})
+        other.save()
+        child['parent_category_id'] = other['_id']
+        self.assertNotIn('errors', child.save())
+        self.assertEqual(Category.subtree(root['_id']), [root['_id']])
+        self.assertEqual(Category.ancestors(leaf['_id']), [other['_id'], child['_id']])
+        # deleting a category detaches its subtree
+        other.delete()
+        self.assertEqual(Category.ancestors(leaf['_id']), [child['_id']])
+        self.assertEqual(Category.subtree(child['_id']), [child['_id'], leaf['_id']])
+        # rebuild gives the same closure
+        Category.tree_rebuild()
+        self.assertEqual(Category.ancestors(leaf['_id']), [child['_id']])
+        self.assertEqual(docDB.count('CategoryTree', dict()), 4)
+
     def test_deletion_with_associated_part(self):
         # if Part referes to a Category the Category shouldn't be deletable
         docDB.clear()
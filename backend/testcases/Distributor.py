@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from helpers.docdb import docDB
 from elements import Distributor, PartDistributor, Part, Unit, Category, Order
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
@@ -28,6 +29,42 @@ class TestDistributor(unittest.TestCase):
         self.assertNotIn('errors', result)
         self.assertEqual(len(Distributor.all()), 2)
 
+    def test_save_many_uniqueness(self):
+        docDB.clear()
+        Distributor({'name': 'Name1'}).save()
+        elements = [Distributor({'name': 'Name1'}), Distributor({'name': 'Name2'}), Distributor({'name': 'Name2'}), Distributor({'name': 'Name3'})]
+        result = Distributor.save_many(elements)
+        self.assertIn('name', result[0]['errors'])
+        self.assertEqual(result[1], {'created': elements[1]['_id']})
+        self.assertIn('name', result[2]['errors'])
+        self.assertEqual(result[3], {'created': elements[3]['_id']})
+        self.assertEqual(len(Distributor.all()), 3)
+        # updates are written in the same batch
+        elements[1]['desc'] = 'Text'
+        result = Distributor.save_many([elements[1], Distributor({'name': 'Name4'})])
+        self.assertEqual(result[0], {'updated': elements[1]['_id']})
+        self.assertIn('created', result[1])
+        self.assertEqual(Distributor.get(elements[1]['_id'])['desc'], 'Text')
+        self.assertEqual(len(Distributor.all()), 4)
+
+    def test_save_many_write_errors(self):
+        docDB.clear()
+        Distributor.ensure_indexes()
+        elements = [Distributor({'name': 'Name1'}), Distributor({'name': 'Name2'})]
+
+        def concurrent(el):
+            if el['name'] == 'Name1':
+                docDB.create('Distributor', {'name': 'Name1', 'desc': ''})
+        version = docDB.versions(['Distributor'])['Distributor']
+        with mock.patch.object(Distributor, 'save_pre', concurrent):
+            result = Distributor.save_many(elements)
+        # a duplicate rejected by the unique index fails only its own item
+        self.assertIn('errors', result[0])
+        self.assertIsNone(elements[0]['_id'])
+        self.assertEqual(result[1], {'created': elements[1]['_id']})
+        self.assertEqual(len(Distributor.all()), 2)
+        self.assertEqual(docDB.versions(['Distributor'])['Distributor'], version + 2)
+
     def test_desc_notnone(self):
         docDB.clear()
         self.assertEqual(len(Distributor.all()), 0)
@@ -0,0 +1,21 @@
+import unittest
+from cherrypy._json import encode
+from helpers.docdb import docDB
+from helpers import fastjson
+from elements import Unit, Category, Part
+
+
+class TestFastJson(unittest.TestCase):
+    def test_fast_json_is_byte_compatible(self):
+        docDB.clear()
+        unit = Unit({'name': 'Ω "quoted"\n', 'desc': 'µ'})
+        unit.save()
+        Unit({'name': 'pcs'}).save()
+        category = Category({'name': 'cat'})
+        category.save()
+        Part({'name': 'pärt', 'unit_id': unit['_id'], 'category_id': category['_id'], 'stock_min': 3}).save()
+        for element, fields in [(Unit, None), (Unit, ['name', 'id']), (Part, None), (Part, ['name', 'stock_low']), (Part, ['stock_min'])]:
+            elements = element.all()
+            self.assertEqual(element.json_encoded(elements, fields), b''.join(encode(element.json_many(elements, fields))))
+        self.assertEqual(Unit.json_encoded([]), b'[]')
+        self.assertIsNone(fastjson.documents([{'name': 'no id'}]))
@@ -0,0 +1,41 @@
+import unittest
+from helpers.docdb import docDB
+from helpers.mongodb import mongoDB, PoolStats
+from testcases._wrapper import ApiBase, mongodb_only, setUpModule, tearDownModule
+
+
+class TestHealth(unittest.TestCase):
+    @mongodb_only
+    def test_pool_stats(self):
+        stats = PoolStats()
+        for i in range(2):
+            stats.connection_created(None)
+            stats.connection_check_out_started(None)
+            stats.connection_checked_out(None)
+        stats.connection_checked_in(None)
+        stats.connection_check_out_started(None)
+        stats.connection_check_out_failed(None)
+        result = stats.stats()
+        self.assertEqual(result['open'], 2)
+        self.assertEqual(result['checked_out'], 1)
+        self.assertEqual(result['checkouts'], 2)
+        self.assertEqual(result['checkout_failures'], 1)
+        self.assertGreaterEqual(result['wait_time_max_ms'], result['wait_time_avg_ms'])
+        # health checks reuse the one shared client
+        client = docDB.client()
+        self.assertTrue(docDB.is_connected())
+        self.assertTrue(docDB.health()['connected'])
+        self.assertIs(docDB.client(), client)
+
+
+setup_module = setUpModule
+teardown_module = tearDownModule
+
+
+class TestHealthApi(ApiBase):
+    def test_health(self):
+        result = self.webapp_request(path='/health', method='GET')
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertTrue(result.json['connected'])
+        if isinstance(docDB, mongoDB):
+            self.assertIn('checked_out', result.json['pool'])
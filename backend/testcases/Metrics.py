@@ -0,0 +1,39 @@
+import unittest
+from helpers.docdb import docDB
+from helpers import metrics
+from elements import Unit
+from testcases._wrapper import ApiBase, mongodb_only, setUpModule, tearDownModule
+
+
+class TestMetrics(unittest.TestCase):
+    @mongodb_only
+    def test_search_many_latency(self):
+        docDB.clear()
+        Unit({'name': 'mm'}).save()
+
+        def observed():
+            return sum(metrics.db_latency._values.get(('Unit', 'search_many'), [[0]])[0])
+        before = observed()
+        found = docDB.search_many('Unit', {})
+        # the round trip is observed once the cursor is exhausted, not when it is built
+        self.assertEqual(observed(), before)
+        self.assertEqual(len(list(found)), 1)
+        self.assertEqual(observed(), before + 1)
+
+
+setup_module = setUpModule
+teardown_module = tearDownModule
+
+
+class TestMetricsApi(ApiBase):
+    def test_metrics(self):
+        self.webapp_request(path='/unit/', method='GET')
+        result = self.webapp_request(path='/metrics', method='GET')
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        text = result.body[0].decode()
+        self.assertIn('# TYPE i4p_http_request_duration_seconds histogram', text)
+        self.assertIn('i4p_http_request_duration_seconds_count{endpoint="UnitEndpoint",method="GET"}', text)
+        self.assertIn('i4p_http_response_size_bytes_bucket{endpoint="UnitEndpoint",method="GET",le="+Inf"}', text)
+        self.assertIn('i4p_db_operation_duration_seconds_count{collection="Unit",operation="search_many"}', text)
+        self.assertIn('i4p_cache_requests_total{result="hit"}', text)
+        self.assertIn('i4p_response_cache_requests_total{result="miss"}', text)
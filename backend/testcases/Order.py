@@ -154,6 +154,22 @@ class TestOrder(unittest.TestCase):
         self.assertTrue(o1.completed())
         self.assertTrue(o2.completed())
 
+    def test_json_many_matches_json(self):
+        o1 = Order({'part_id': self.pid, 'distributor_id': self.did, 'amount': 10})
+        o1.save()
+        o2 = Order({'part_id': self.pid, 'distributor_id': self.did, 'amount': 5})
+        o2.save()
+        sl = StorageLocation({'name': 'sl1'})
+        sl.save()
+        pl = PartLocation({'part_id': self.pid, 'storage_location_id': sl['_id']})
+        pl.save()
+        StockChange({'part_location_id': pl['_id'], 'order_id': o1['_id'], 'amount': 10}).save()
+        StockChange({'part_location_id': pl['_id'], 'order_id': o2['_id'], 'amount': 2}).save()
+        expected = [o.json() for o in Order.all()]
+        self.assertEqual(Order.json_many(Order.all()), expected)
+        self.assertTrue(expected[0]['completed'])
+        self.assertFalse(expected[1]['completed'])
+
     def test_deletion(self):
         el1 = Order({'part_id': self.pid, 'distributor_id': self.did})
         el1.save()
@@ -1,7 +1,14 @@
+import asyncio
+import json
 import unittest
-from helpers.docdb import docDB
+from unittest import mock
+from aiohttp.test_utils import AioHTTPTestCase
+from helpers.docdb import docDB, asyncDB
+from helpers.storage import CallBudgetExceeded
+from helpers.elementendpoint import ResponseCache
 from elements import Part, Unit, Category, Footprint, MountingStyle, Distributor, PartDistributor, Order, StorageLocation, PartLocation, StockChange
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
+from i4p_async import make_app
 
 
 class TestPart(unittest.TestCase):
@@ -389,6 +396,130 @@ class TestPart(unittest.TestCase):
         self.assertEqual(p.stock_level(), 0)
         self.assertTrue(p.stock_low())
 
+    def test_identity_map(self):
+        p = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename1', 'footprint_id': self.fp1})
+        with docDB.identity_map():
+            self.assertNotIn('errors', p.save())
+            identity = docDB._identity()
+            self.assertEqual(list(identity['Footprint'].keys()), [('_id', self.fp1)])
+            # cached documents are handed out as copies
+            fp = docDB.get('Footprint', self.fp1)
+            fp['name'] = 'changed'
+            self.assertEqual(docDB.get('Footprint', self.fp1)['name'], 'fp1')
+            # writes invalidate the cached documents of the collection
+            docDB.update_many('Footprint', {'_id': self.fp1}, {'$set': {'name': 'fp2'}})
+            self.assertNotIn('Footprint', identity)
+            self.assertEqual(docDB.get('Footprint', self.fp1)['name'], 'fp2')
+        self.assertIsNone(docDB._identity())
+
+    def test_prefetch(self):
+        p1 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename1', 'footprint_id': self.fp1})
+        p2 = Part({'unit_id': self.u1, 'category_id': 'somerandomstring', 'name': 'somename2'})
+        with docDB.identity_map():
+            Part.prefetch([p1, p2])
+            identity = docDB._identity()
+            self.assertEqual(list(identity['Footprint'].keys()), [('_id', self.fp1)])
+            self.assertIsNotNone(identity['Category'][('_id', self.c1)])
+            self.assertIsNone(identity['Category'][('_id', 'somerandomstring')])
+        result = Part.save_many([p1, p2])
+        self.assertIn('created', result[0])
+        self.assertIn('category_id', result[1]['errors'])
+        self.assertEqual(len(Part.all()), 1)
+
+    def test_json_many_matches_json(self):
+        p1 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename1', 'stock_min': 10})
+        p1.save()
+        p2 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename2'})
+        p2.save()
+        p3 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename3'})
+        p3.save()
+        sl = StorageLocation({'name': 'sl1'})
+        sl.save()
+        pl1 = PartLocation({'part_id': p1['_id'], 'storage_location_id': sl['_id']})
+        pl1.save()
+        pl2 = PartLocation({'part_id': p1['_id'], 'storage_location_id': sl['_id']})
+        pl2.save()
+        pl3 = PartLocation({'part_id': p2['_id'], 'storage_location_id': sl['_id']})
+        pl3.save()
+        o1 = Order({'part_id': p1['_id'], 'amount': 10, 'price': 2.5})
+        o1.save()
+        o2 = Order({'part_id': p2['_id'], 'amount': 3, 'price': 0.9})
+        o2.save()
+        StockChange({'part_location_id': pl1['_id'], 'amount': 5, 'price': 0.5}).save()
+        StockChange({'part_location_id': pl1['_id'], 'order_id': o1['_id'], 'amount': 10}).save()
+        StockChange({'part_location_id': pl1['_id'], 'amount': -7}).save()
+        StockChange({'part_location_id': pl2['_id'], 'amount': 3, 'price': 1.1}).save()
+        StockChange({'part_location_id': pl3['_id'], 'order_id': o2['_id'], 'amount': 1}).save()
+        expected = [p.json() for p in Part.all()]
+        self.assertEqual(Part.json_many(Part.all()), expected)
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(expected[0]['stock_level'], 11)
+        self.assertFalse(expected[0]['open_orders'])
+        self.assertTrue(expected[1]['open_orders'])
+        self.assertEqual(expected[2]['stock_level'], 0)
+
+    def test_json_call_budget(self):
+        sl = StorageLocation({'name': 'sl1'})
+        sl.save()
+        calls = list()
+        for n in [1, 10]:
+            p = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': f'part{n}'})
+            p.save()
+            for i in range(n):
+                pl = PartLocation({'part_id': p['_id'], 'storage_location_id': sl['_id']})
+                pl.save()
+                StockChange({'part_location_id': pl['_id'], 'amount': 2, 'price': 1.0}).save()
+                Order({'part_id': p['_id'], 'amount': 1}).save()
+            with docDB.call_log(threshold=3) as log:
+                Part.get(p['_id']).json()
+            self.assertEqual(log.repeated(), dict())
+            calls.append(log.calls)
+        # the amount of queries does not grow with the amount of PartLocations and Orders
+        self.assertEqual(calls[0], calls[1])
+        with self.assertRaises(CallBudgetExceeded):
+            with docDB.call_log(budget=calls[0] - 1):
+                Part.get(p['_id']).json()
+
+    def test_search(self):
+        c2 = Category({'name': 'cat2'})
+        c2.save()
+        p1 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'LM317T', 'desc': 'adjustable voltage regulator', 'footprint_id': self.fp1})
+        p1.save()
+        p2 = Part({'unit_id': self.u1, 'category_id': c2['_id'], 'name': 'LM7805', 'desc': 'fixed voltage regulator', 'external_number': '511-LM317'})
+        p3 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'NE555', 'desc': 'timer'})
+        Part.save_many([p2, p3])
+        found = Part.search('LM31')
+        self.assertEqual(found['total'], 2)
+        # name matches rank above matches on the external_number
+        self.assertEqual([el['_id'] for el, score in found['results']], [p1['_id'], p2['_id']])
+        self.assertEqual([el['_id'] for el, score in Part.search('317')['results']], [p1['_id'], p2['_id']])
+        self.assertEqual([el['_id'] for el, score in Part.search('voltage regulator lm')['results']], [p1['_id'], p2['_id']])
+        self.assertEqual([el['_id'] for el, score in Part.search('regulator', {'category_id': c2['_id']})['results']], [p2['_id']])
+        # filters on the id narrow the hits instead of being replaced by them
+        self.assertEqual(Part.search('317', {'_id': 'zzz'})['total'], 0)
+        self.assertEqual([el['_id'] for el, score in Part.search('317', {'_id': {'$ne': p1['_id']}})['results']], [p2['_id']])
+        self.assertEqual([el['_id'] for el, score in Part.search('LM31', offset=1)['results']], [p2['_id']])
+        # only a bounded amount of candidates is loaded, filters still reach past the first chunk
+        with mock.patch.object(Part, '_search_candidates', 1):
+            found = Part.search('LM31')
+            self.assertEqual((found['total'], found['capped']), (1, True))
+            self.assertEqual([el['_id'] for el, score in Part.search('regulator', {'category_id': c2['_id']})['results']], [p2['_id']])
+        self.assertEqual(Part.search('regul')['total'], 0)
+        self.assertIsNone(Part.search('a'))
+        found = Part.search('voltage', limit=1, facets=True)
+        self.assertEqual(len(found['results']), 1)
+        self.assertEqual(found['facets']['category_id'], {self.c1: 1, c2['_id']: 1})
+        self.assertEqual(found['facets']['footprint_id'], {self.fp1: 1, None: 1})
+        # renamed and deleted parts are reflected
+        p1['name'] = 'LT1086'
+        p1.save()
+        self.assertEqual([el['_id'] for el, score in Part.search('LM31')['results']], [p2['_id']])
+        p2.delete()
+        self.assertEqual(Part.search('LM31')['total'], 0)
+        Part.search_rebuild()
+        self.assertEqual([el['_id'] for el, score in Part.search('lt10')['results']], [p1['_id']])
+        self.assertEqual([el['_id'] for el, score in Part.search('555')['results']], [p3['_id']])
+
     def test_deletion(self):
         p1 = Part({'unit_id': self.u1, 'category_id': self.c1, 'name': 'somename1'})
         p1.save()
@@ -488,6 +619,110 @@ class TestPartApi(ApiTestBase):
         el = self._element(self._setup_el2)
         self.id2 = el.save().get('created')
 
+    def test_get_all_fields_calculated(self):
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'name,stock_low'})
+        self.assertEqual(len(result.json), 2)
+        for el in result.json:
+            self.assertEqual(set(el.keys()), {'id', 'name', 'stock_low'})
+            self.assertFalse(el['stock_low'])
+
+    def test_get_all_filtered_by_derived(self):
+        p = Part.get(self.id1)
+        p['stock_min'] = 5
+        p.save()
+        with docDB.call_log() as log:
+            result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'stock_low': 'true', 'fields': 'name,stock_level'})
+        self.assertEqual(result.json, [{'id': self.id1, 'name': 'part1', 'stock_level': 0}])
+        self.assertEqual(log.repeated(), dict())
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'stock_low': 'false', 'count': '1'})
+        self.assertEqual(result.json, {'count': 1})
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'stock_level[gte]': '0', 'name[ne]': 'part1', 'fields': 'name'})
+        self.assertEqual(result.json, [{'id': self.id2, 'name': 'part2'}])
+
+    def test_get_all_filtered_by_category_subtree(self):
+        p = Part.get(self.id1)
+        parent = Category.get(p['category_id'])
+        sub = Category({'name': 'sub', 'parent_category_id': parent['_id']})
+        sub.save()
+        other = Category({'name': 'other'})
+        other.save()
+        p['category_id'] = sub['_id']
+        p.save()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'category_subtree': parent['_id'], 'fields': 'name'})
+        self.assertEqual(sorted(r['id'] for r in result.json), sorted([self.id1, self.id2]))
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'category_subtree': sub['_id'], 'fields': 'name'})
+        self.assertEqual([r['id'] for r in result.json], [self.id1])
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'category_subtree': other['_id'], 'count': '1'})
+        self.assertEqual(result.json, {'count': 0})
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'category_subtree': parent['_id'], 'category_id': sub['_id']})
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+
+    def test_etag_follows_dependencies(self):
+        result = self.webapp_request(path=f'/{self._path}/', method='GET')
+        etag = result.headers['ETag']
+        pl = PartLocation({'part_id': self.id1, 'storage_location_id': StorageLocation({'name': 'sl'}).save()['created']})
+        pl.save()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': etag})
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        etag = result.headers['ETag']
+        StockChange({'part_location_id': pl['_id'], 'amount': 2, 'price': 1.0}).save()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': etag})
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(result.json[0]['stock_level'], 2)
+        etag = result.headers['ETag']
+        Unit({'name': 'unrelated'}).save()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': etag})
+        self.assertTrue(result.status.startswith('304'), msg=f'should start with 304 but is {result.status}')
+
+    def test_response_cache(self):
+        first = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'name,stock_level'})
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'name,stock_level'})
+        self.assertEqual(result.headers['X-Cache'], 'HIT')
+        self.assertEqual(result.body, first.body)
+        self.assertEqual(result.headers['X-DB-Calls'], '1')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'name'})
+        self.assertEqual(result.headers['X-Cache'], 'MISS')
+        pl = PartLocation({'part_id': self.id1, 'storage_location_id': StorageLocation({'name': 'sl'}).save()['created']})
+        pl.save()
+        StockChange({'part_location_id': pl['_id'], 'amount': 2, 'price': 1.0}).save()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'name,stock_level'})
+        self.assertEqual(result.headers['X-Cache'], 'MISS')
+        self.assertIn({'id': self.id1, 'name': 'part1', 'stock_level': 2}, result.json)
+
+    def test_response_cache_bounds(self):
+        cache = ResponseCache(10)
+        cache.set('a', b'1234')
+        cache.set('b', b'5678')
+        self.assertEqual(cache.get('a'), b'1234')
+        # least recently used entries are evicted to stay within the byte budget
+        cache.set('c', b'9012')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.bytes, cache.evictions), (8, 1))
+        # bodies larger than the budget are not cached
+        cache.set('d', b'12345678901')
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_search(self):
+        result = self.webapp_request(path=f'/{self._path}/_search/', method='GET', query={'q': 'part', 'fields': 'name,stock_low', 'facets': '1'})
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(result.json['total'], 2)
+        self.assertEqual(set(result.json['results'][0].keys()), {'id', 'name', 'stock_low', 'score'})
+        self.assertEqual(sum(result.json['facets']['category_id'].values()), 2)
+        result = self.webapp_request(path=f'/{self._path}/_search/', method='GET', query={'q': 'part2', 'limit': 5})
+        self.assertEqual([r['id'] for r in result.json['results']], [self.id2])
+        result = self.webapp_request(path=f'/{self._path}/_search/', method='GET', query={'q': 'part2', 'id': 'zzz'})
+        self.assertEqual((result.json['total'], result.json['results']), (0, []))
+        result = self.webapp_request(path=f'/{self._path}/_search/', method='GET', query={'q': 'part', 'limit': 1, 'offset': 1})
+        self.assertEqual(len(result.json['results']), 1)
+        for query in [{}, {'q': 'p'}, {'q': 'part', 'stock_low': 'true'}, {'q': 'part', 'weight': '1'}, {'q': 'part', 'offset': '-1'},
+                      [('q', 'part'), ('q', 'part1')], [('q', 'part'), ('facets', '1'), ('facets', '1')], [('q', 'part'), ('offset', '1'), ('offset', '1')]]:
+            result = self.webapp_request(path=f'/{self._path}/_search/', method='GET', query=query)
+            self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/_search/', method='POST', data={'q': 'part'})
+        self.assertTrue(result.status.startswith('405'), msg=f'should start with 405 but is {result.status}')
+
     def test_calculated_attr_are_exposed(self):
         p = Part().get(self.id1)
         self.assertIsNotNone(p['_id'])
@@ -500,3 +735,137 @@ class TestPartApi(ApiTestBase):
         self.assertIn('stock_price', result.json)
         self.assertIn('stock_low', result.json)
         self.assertIn('open_orders', result.json)
+
+
+class TestPartAsyncApi(AioHTTPTestCase):
+    async def get_application(self):
+        return make_app()
+
+    def setUp(self):
+        docDB.clear()
+        c1 = Category({'name': 'cat1'})
+        c1.save()
+        self.c1 = c1['_id']
+        u1 = Unit({'name': 'unit1'})
+        u1.save()
+        self.u1 = u1['_id']
+        p1 = Part({'name': 'part1', 'unit_id': self.u1, 'category_id': self.c1, 'stock_min': 5})
+        self.id1 = p1.save().get('created')
+        sl = StorageLocation({'name': 'sl1'})
+        sl.save()
+        self.sl = sl['_id']
+        pl = PartLocation({'part_id': self.id1, 'storage_location_id': sl['_id']})
+        pl.save()
+        StockChange({'part_location_id': pl['_id'], 'amount': 3, 'price': 1.5}).save()
+        Order({'part_id': self.id1, 'amount': 2}).save()
+        super().setUp()
+
+    async def test_get(self):
+        resp = await self.client.request('GET', '/part/')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(await resp.json(), Part.json_many(Part.all()))
+        resp = await self.client.request('GET', f'/part/{self.id1}/')
+        self.assertEqual(await resp.json(), Part.get(self.id1).json())
+        resp = await self.client.request('GET', '/part/somerandomstring/')
+        self.assertEqual(resp.status, 404)
+        resp = await self.client.request('GET', '/part/', params={'fields': 'name,stock_low', 'limit': '1'})
+        self.assertEqual(await resp.json(), [{'id': self.id1, 'name': 'part1', 'stock_low': True}])
+        resp = await self.client.request('GET', '/stockchange/')
+        self.assertEqual(await resp.json(), StockChange.json_many(StockChange.all()))
+
+    async def test_async_document_layer(self):
+        with mock.patch.object(asyncDB, 'get', side_effect=asyncDB.get) as get, \
+                mock.patch.object(asyncDB, 'search_many', side_effect=asyncDB.search_many) as search_many, \
+                mock.patch.object(asyncDB, 'count', side_effect=asyncDB.count) as count:
+            resp = await self.client.request('GET', f'/part/{self.id1}/')
+            self.assertEqual(await resp.json(), Part.get(self.id1).json())
+            resp = await self.client.request('GET', '/part/', params={'fields': 'name', 'sort': '-name'})
+            self.assertEqual(await resp.json(), [{'id': self.id1, 'name': 'part1'}])
+            resp = await self.client.request('GET', '/part/', params={'count': '1', 'name': 'part1'})
+            self.assertEqual(await resp.json(), {'count': 1})
+        get.assert_awaited_with('Part', self.id1)
+        search_many.assert_awaited_with('Part', {}, fields=['_id', 'name'], sort=[('name', -1), ('_id', 1)], limit=None)
+        count.assert_awaited_with('Part', {'name': 'part1'})
+
+    async def test_get_filtered(self):
+        resp = await self.client.request('GET', '/part/', params={'stock_low': 'true', 'fields': 'name'})
+        self.assertEqual(await resp.json(), [{'id': self.id1, 'name': 'part1'}])
+        resp = await self.client.request('GET', '/part/', params={'count': '1', 'name': 'part1'})
+        self.assertEqual(await resp.json(), {'count': 1})
+        resp = await self.client.request('GET', '/part/', params={'name[in]': 'part1,other', 'sort': '-name'})
+        self.assertEqual([p['name'] for p in await resp.json()], ['part1'])
+        resp = await self.client.request('GET', '/part/', params={'weight': '1'})
+        self.assertEqual(resp.status, 400)
+
+    async def test_repeated_params(self):
+        for params in [[('limit', '1'), ('limit', '2')], [('fields', 'name'), ('fields', 'desc')], [('count', '1'), ('count', '0')],
+                       [('sort', 'name'), ('sort', '-name')], [('after', self.id1), ('after', self.id1)], [('name', 'part1'), ('name', 'part2')]]:
+            resp = await self.client.request('GET', '/part/', params=params)
+            self.assertEqual(resp.status, 400, msg=params)
+            self.assertIn('given more than once', json.dumps(await resp.json()))
+        resp = await self.client.request('DELETE', f'/part/{self.id1}/', params=[('dry_run', '1'), ('dry_run', '0')])
+        self.assertEqual(resp.status, 400)
+        self.assertIsNotNone(Part.get(self.id1)['_id'])
+
+    async def test_search(self):
+        resp = await self.client.request('GET', '/part/_search', params={'q': 'part1', 'fields': 'name'})
+        self.assertEqual(resp.status, 200)
+        result = await resp.json()
+        self.assertEqual([(r['id'], r['name']) for r in result['results']], [(self.id1, 'part1')])
+        resp = await self.client.request('GET', '/part/_search', params=[('q', 'part1'), ('q', 'part2')])
+        self.assertEqual(resp.status, 400)
+        resp = await self.client.request('POST', '/part/_search', json={})
+        self.assertEqual(resp.status, 405)
+
+    async def test_get_resource(self):
+        resp = await self.client.request('GET', f'/storagelocation/{self.sl}/stock/')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(await resp.json(), StorageLocation.get(self.sl).stock())
+        self.assertEqual((await resp.json())['stock_level'], 3)
+        resp = await self.client.request('GET', f'/storagelocation/{self.sl}/unknown')
+        self.assertEqual(resp.status, 404)
+        resp = await self.client.request('DELETE', f'/storagelocation/{self.sl}/stock')
+        self.assertEqual(resp.status, 405)
+
+    async def test_etag(self):
+        resp = await self.client.request('GET', '/part/')
+        etag = resp.headers['ETag']
+        resp = await self.client.request('GET', '/part/', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 304)
+        self.assertEqual(await resp.read(), b'')
+        resp = await self.client.request('GET', '/part/somerandomstring/', headers={'If-None-Match': '*'})
+        self.assertEqual(resp.status, 404)
+        resp = await self.client.request('GET', '/part/')
+        self.assertEqual(resp.headers['X-Cache'], 'HIT')
+        self.assertEqual(await resp.json(), Part.json_many(Part.all()))
+        resp = await self.client.request('GET', '/stockchange/', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 200)
+        self.assertIn('ETag', resp.headers)
+        Order({'part_id': self.id1, 'amount': 1}).save()
+        resp = await self.client.request('GET', '/part/', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 200)
+
+    async def test_concurrent_requests(self):
+        responses = await asyncio.gather(*(self.client.request('GET', f'/part/{self.id1}/') for i in range(20)))
+        for resp in responses:
+            self.assertEqual((await resp.json())['stock_level'], 3)
+
+    async def test_post_patch_delete(self):
+        resp = await self.client.request('POST', '/part/', json={'name': 'part2', 'unit_id': self.u1, 'category_id': 'somerandomstring'})
+        self.assertEqual(resp.status, 400)
+        self.assertIn('category_id', (await resp.json())['errors'])
+        resp = await self.client.request('POST', '/part/', json={'name': 'part2', 'unit_id': self.u1, 'category_id': self.c1})
+        self.assertEqual(resp.status, 201)
+        id2 = (await resp.json())['created']
+        resp = await self.client.request('PATCH', f'/part/{id2}/', json={'desc': 'Text'})
+        self.assertEqual(resp.status, 201)
+        self.assertEqual(Part.get(id2)['desc'], 'Text')
+        resp = await self.client.request('DELETE', f'/part/{self.id1}/', params={'dry_run': '1'})
+        self.assertEqual((await resp.json())['dry_run']['delete'], {'Part': 1, 'Order': 1, 'PartLocation': 1, 'StockChange': 1})
+        resp = await self.client.request('DELETE', f'/part/{self.id1}/')
+        self.assertEqual(await resp.json(), {'deleted': self.id1})
+        self.assertEqual(len(Part.all()), 1)
+        resp = await self.client.request('DELETE', '/part/')
+        self.assertEqual(resp.status, 405)
+        resp = await self.client.request('POST', '/part/_bulk', json=[{'op': 'delete', 'id': id2}])
+        self.assertEqual(await resp.json(), [{'deleted': id2}])
@@ -1,6 +1,8 @@
 import unittest
+from unittest import mock
 from helpers.docdb import docDB
 from elements import Unit, Category, Part, Distributor, PartDistributor
+from elements._elementBase import ElementBase
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
 
 
@@ -219,6 +221,40 @@ class TestPartDistributor(unittest.TestCase):
         result = el1.delete()
         self.assertNotIn('error', result)
 
+    def test_preferred_without_collection_scan(self):
+        with mock.patch.object(PartDistributor, 'all', side_effect=AssertionError('collection scanned')):
+            el1 = PartDistributor({'part_id': self.pid, 'distributor_id': self.did})
+            el1.save()
+            el2 = PartDistributor({'part_id': self.pid, 'distributor_id': self.did, 'preferred': True})
+            el2.save()
+            el2.delete()
+            el1.reload()
+            self.assertTrue(el1['preferred'])
+
+    def test_preferred_scoped(self):
+        p2 = Part({'name': 'p2', 'unit_id': docDB.search_one('Unit', {})['_id'], 'category_id': docDB.search_one('Category', {})['_id']})
+        p2.save()
+        scoped = ElementBase.addAttr(type=bool, default=False, notnone=True, singleton='part_id')
+        with mock.patch.dict(PartDistributor._attrdef, preferred=scoped):
+            self.assertIn({'keys': ('part_id', 'preferred'), 'unique': False}, PartDistributor.indexes())
+            el1 = PartDistributor({'part_id': self.pid, 'distributor_id': self.did})
+            el1.save()
+            el2 = PartDistributor({'part_id': p2['_id'], 'distributor_id': self.did})
+            el2.save()
+            el3 = PartDistributor({'part_id': p2['_id'], 'distributor_id': self.did, 'preferred': True})
+            el3.save()
+            el1.reload()
+            el2.reload()
+            # each part has its own preferred
+            self.assertTrue(el1['preferred'])
+            self.assertFalse(el2['preferred'])
+            self.assertTrue(el3['preferred'])
+            el3.delete()
+            el1.reload()
+            el2.reload()
+            self.assertTrue(el1['preferred'])
+            self.assertTrue(el2['preferred'])
+
 
 setup_module = setUpModule
 teardown_module = tearDownModule
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from helpers.docdb import docDB
 from elements import PartLocation, Unit, Category, Part, StorageLocation, StockChange
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
@@ -161,6 +162,53 @@ class TestPartLocation(unittest.TestCase):
         pl.drop_cache()
         self.assertEqual(pl.stock_level(), 0)
 
+    def test_stock_counter(self):
+        pl1 = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl1.save()
+        pl2 = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl2.save()
+        sc1 = StockChange({'part_location_id': pl1['_id'], 'amount': 5})
+        sc1.save()
+        sc2 = StockChange({'part_location_id': pl1['_id'], 'amount': 3})
+        sc2.save()
+        self.assertEqual(PartLocation.stock_counter(pl1['_id'])['stock_level'], 8)
+        # changing the amount of a StockChange
+        sc1['amount'] = 2
+        sc1.save()
+        self.assertEqual(PartLocation.stock_counter(pl1['_id'])['stock_level'], 5)
+        # moving a StockChange to an other PartLocation
+        sc2['part_location_id'] = pl2['_id']
+        sc2.save()
+        self.assertEqual(PartLocation.stock_counter(pl1['_id'])['stock_level'], 2)
+        self.assertEqual(PartLocation.stock_counter(pl2['_id'])['stock_level'], 3)
+        # removing more than the counter holds is prevented
+        sc3 = StockChange({'part_location_id': pl1['_id'], 'amount': -3})
+        self.assertIn('amount', sc3.save()['errors'])
+        # deleting a StockChange
+        sc1.delete()
+        self.assertEqual(PartLocation.stock_counter(pl1['_id'])['stock_level'], 0)
+        self.assertEqual(PartLocation.stock_check(), [])
+
+    def test_stock_check(self):
+        pl = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl.save()
+        StockChange({'part_location_id': pl['_id'], 'amount': 5}).save()
+        self.assertEqual(PartLocation.stock_check(), [])
+        # corrupted counter is reported and can be rebuild
+        docDB.update('PartLocationStock', pl['_id'], {'$set': {'stock_level': 99}})
+        self.assertEqual(PartLocation.stock_check(), [pl['_id']])
+        self.assertEqual(PartLocation.stock_check(rebuild=True), [pl['_id']])
+        self.assertEqual(PartLocation.stock_check(), [])
+        self.assertEqual(pl.stock_level(), 5)
+        # missing counter is rebuild on access
+        docDB.delete('PartLocationStock', pl['_id'])
+        pl.drop_cache()
+        self.assertEqual(pl.stock_level(), 5)
+        self.assertEqual(PartLocation.stock_check(), [])
+        # counter of deleted PartLocation is removed
+        pl.delete()
+        self.assertIsNone(docDB.get('PartLocationStock', pl['_id']))
+
     def test_stock_price(self):
         pl = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
         pl.save()
@@ -227,6 +275,93 @@ class TestPartLocation(unittest.TestCase):
         self.assertEqual(pl.stock_level(), 5)
         self.assertEqual(pl.stock_price(), 1.5)
 
+    def test_stock_price_matches_history(self):
+        import random
+        rnd = random.Random(4)
+        pl = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl.save()
+        level = 0
+        changes = list()
+        for i in range(150):
+            if level > 0 and rnd.random() < 0.45:
+                sc = StockChange({'part_location_id': pl['_id'], 'amount': rnd.randint(1, level) * -1})
+            else:
+                sc = StockChange({'part_location_id': pl['_id'], 'amount': rnd.randint(1, 40), 'price': round(rnd.uniform(0.01, 30), 2)})
+            self.assertNotIn('errors', sc.save())
+            changes.append(sc)
+            level += sc['amount']
+            if i % 25 == 24:
+                # edits and deletions of older StockChange
+                sc = changes[rnd.randrange(len(changes))]
+                if sc['amount'] > 0:
+                    sc['price'] = round(rnd.uniform(0.01, 30), 2)
+                    sc.save()
+                sc = changes.pop()
+                level -= sc['amount']
+                sc.delete()
+            removed = docDB.sum('StockChange', 'amount', {'part_location_id': pl['_id'], 'amount': {'$lt': 0}}) * -1
+            positives = docDB.search_many('StockChange', {'part_location_id': pl['_id'], 'amount': {'$gt': 0}})
+            pl.drop_cache()
+            self.assertEqual(pl.stock_level(), level)
+            self.assertEqual(pl.stock_price(), PartLocation.fifo_price(removed, positives))
+        self.assertEqual(PartLocation.stock_check(), [])
+
+    def test_stock_book_interleaved(self):
+        pl = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl.save()
+        StockChange({'part_location_id': pl['_id'], 'amount': 10, 'price': 10.0}).save()
+        StockChange({'part_location_id': pl['_id'], 'amount': 10, 'price': 20.0}).save()
+        stock_consumed = PartLocation.stock_consumed
+        second = StockChange({'part_location_id': pl['_id'], 'amount': -5})
+
+        def interleaved(stock):
+            result = stock_consumed(stock)
+            if second['_id'] is None:
+                # an other consumption compacts the same layer before this one does
+                self.assertNotIn('errors', second.save())
+            return result
+        with mock.patch.object(PartLocation, 'stock_consumed', interleaved):
+            self.assertNotIn('errors', StockChange({'part_location_id': pl['_id'], 'amount': -10}).save())
+        stock = docDB.get('PartLocationStock', pl['_id'])
+        self.assertEqual((stock['stock_level'], stock['removed'], len(stock['layers'])), (5, 5, 1))
+        self.assertEqual(pl.stock_price(), 10.0)
+        self.assertEqual(PartLocation.stock_check(), [])
+
+    def test_stock_unbook(self):
+        pl = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
+        pl.save()
+        scs = [StockChange({'part_location_id': pl['_id'], 'amount': amount, 'price': 1.0}) for amount in [10, 10, 10, -4, -2]]
+        for sc in scs:
+            sc.save()
+        stock_rebuild = PartLocation.stock_rebuild
+        with mock.patch.object(PartLocation, 'stock_rebuild', side_effect=stock_rebuild) as rebuild:
+            # unconsumed layers and consumptions are undone incrementally
+            self.assertIn('deleted', StockChange.delete_many([scs[2]['_id'], scs[4]['_id']]))
+            self.assertEqual(rebuild.call_count, 0)
+            stock = docDB.get('PartLocationStock', pl['_id'])
+            self.assertEqual((stock['stock_level'], stock['removed'], len(stock['layers'])), (16, 4, 2))
+            self.assertEqual(PartLocation.stock_check(), [])
+            # a partly consumed layer needs the rebuild
+            scs[0].delete()
+            self.assertEqual(rebuild.call_args_list, [mock.call(pl['_id'])])
+            self.assertEqual(PartLocation.stock_check(), [])
+            self.assertEqual(pl.stock_level(), 6)
+            # as does undoing a consumption of an allready compacted layer
+            sc = StockChange({'part_location_id': pl['_id'], 'amount': -6})
+            sc.save()
+            self.assertEqual(len(docDB.get('PartLocationStock', pl['_id'])['layers']), 0)
+            rebuild.reset_mock()
+            sc.delete()
+            self.assertEqual(rebuild.call_count, 1)
+            self.assertEqual(PartLocation.stock_check(), [])
+            pl.drop_cache()
+            self.assertEqual(pl.stock_level(), 6)
+            # cascades do not rebuild counters of deleted PartLocation
+            rebuild.reset_mock()
+            pl.delete()
+            self.assertEqual(rebuild.call_count, 0)
+        self.assertEqual(PartLocation.stock_check(), [])
+
     def test_deletion(self):
         el1 = PartLocation({'part_id': self.pid, 'storage_location_id': self.slid})
         el1.save()
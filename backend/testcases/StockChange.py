@@ -1,6 +1,9 @@
 import unittest
+from cherrypy._json import encode
 from helpers.docdb import docDB
 from elements import Order, Unit, Category, Part, PartLocation, StorageLocation, StockChange
+from elements._elementBase import ElementBase
+from helpers.elementendpoint import ElementEndpointBase
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
 
 
@@ -235,6 +238,39 @@ class TestStockChange(unittest.TestCase):
         self.assertNotIn('errors', result)
         self.assertEqual(element['price'], 0.6)
 
+    def test_save_many_batched(self):
+        calls = list()
+        pl1 = PartLocation.get(self.pl1id)
+        for n, order_id in [(2, self.o1id), (20, self.o2id)]:
+            pls = [PartLocation({'part_id': pl1['part_id'], 'storage_location_id': pl1['storage_location_id']}) for i in range(2)]
+            pls = [pl.save()['created'] for pl in pls]
+            elements = [StockChange({'part_location_id': pl, 'amount': 2, 'price': 1.0}) for i in range(n) for pl in pls]
+            elements.append(StockChange({'part_location_id': pls[0], 'amount': -3}))
+            elements.append(StockChange({'part_location_id': pls[0], 'order_id': order_id, 'amount': 1}))
+            with docDB.call_log() as log:
+                results = StockChange.save_many(elements)
+            self.assertTrue(all('created' in r for r in results))
+            calls.append(log.calls)
+            self.assertEqual(PartLocation.get(pls[0]).stock_level(), n * 2 - 2)
+            self.assertEqual(PartLocation.get(pls[1]).stock_level(), n * 2)
+        self.assertEqual(calls[0], calls[1])
+        self.assertEqual(PartLocation.stock_check(), [])
+
+    def test_save_many_validates_within_batch(self):
+        elements = [
+            StockChange({'part_location_id': self.pl1id, 'amount': 5}),
+            StockChange({'part_location_id': self.pl1id, 'amount': -5}),
+            StockChange({'part_location_id': self.pl1id, 'amount': -1}),
+            StockChange({'part_location_id': self.pl1id, 'order_id': self.o1id, 'amount': 6}),
+            StockChange({'part_location_id': self.pl1id, 'order_id': self.o1id, 'amount': 6})
+        ]
+        results = StockChange.save_many(elements)
+        self.assertEqual(['created' in r for r in results], [True, True, False, True, False])
+        self.assertIn('negative PartLocation', results[2]['errors']['amount'])
+        self.assertIn('exceed', results[4]['errors']['amount'])
+        self.assertEqual(PartLocation.get(self.pl1id).stock_level(), 6)
+        self.assertEqual(PartLocation.stock_check(), [])
+
     def test_deletion(self):
         el1 = StockChange({'part_location_id': self.pl1id})
         el1.save()
@@ -246,6 +282,22 @@ class TestStockChange(unittest.TestCase):
         el2.delete()
         self.assertEqual(len(StockChange.all()), 0)
 
+    def test_indexes(self):
+        self.assertIn({'keys': ('part_location_id', 'amount'), 'unique': False}, StockChange.indexes())
+        self.assertIn({'keys': ('order_id',), 'unique': False}, StockChange.indexes())
+        self.assertNotIn({'keys': ('part_location_id',), 'unique': False}, StockChange.indexes())
+        self.assertIn({'keys': ('name',), 'unique': True}, Unit.indexes())
+        self.assertIn(('part_location_id', 'amount'), ElementBase.index_report()['StockChange']['missing'])
+        self.assertEqual(ElementBase.ensure_indexes(), dict())
+        self.assertEqual(ElementBase.ensure_indexes(), dict())
+        for report in ElementBase.index_report().values():
+            self.assertEqual(report['missing'], list())
+            self.assertEqual(report['undeclared'], list())
+        self.assertIn(('name',), [i['keys'] for i in docDB.indexes('Unit').values() if i['unique']])
+        # indexes no element asks for are reported
+        docDB.ensure_index('Unit', ('desc',))
+        self.assertEqual(ElementBase.index_report()['Unit']['undeclared'], ['desc_1'])
+
 
 setup_module = setUpModule
 teardown_module = tearDownModule
@@ -278,3 +330,31 @@ class TestStockChangeApi(ApiTestBase):
         self.id1 = el.save().get('created')
         el = self._element(self._setup_el2)
         self.id2 = el.save().get('created')
+
+    def test_get_all_filtered_by_range(self):
+        for created_at in [100, 200, 300]:
+            StockChange({'part_location_id': self._setup_el1['part_location_id'], 'amount': 1, 'created_at': created_at}).save()
+        query = {'part_location_id': self._setup_el1['part_location_id'], 'created_at[gte]': '150', 'created_at[lt]': '400', 'sort': '-created_at'}
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query=query)
+        self.assertEqual([el['created_at'] for el in result.json], [300, 200])
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={**query, 'fields': 'amount', 'limit': 1})
+        self.assertEqual(len(result.json), 1)
+        self.assertEqual(set(result.json[0].keys()), {'id', 'amount'})
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'created_at[gte]': 'yesterday'})
+        self.assertIn('type', result.json['errors']['created_at[gte]'])
+
+    def test_get_all_streamed(self):
+        from i4p import StockChangeEndpoint
+        self.assertTrue(StockChangeEndpoint._stream)
+        expected = b''.join(encode(StockChange.json_many(StockChange.all())))
+        result = self.webapp_request(path=f'/{self._path}/', method='GET')
+        self.assertEqual(result.body[0], expected)
+        StockChangeEndpoint._stream_chunk = 1
+        try:
+            result = self.webapp_request(path=f'/{self._path}/', method='GET')
+            self.assertEqual(result.body[0], expected)
+        finally:
+            StockChangeEndpoint._stream_chunk = ElementEndpointBase._stream_chunk
+        docDB.clear()
+        result = self.webapp_request(path=f'/{self._path}/', method='GET')
+        self.assertEqual(result.body[0], b'[]')
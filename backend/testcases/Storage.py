@@ -0,0 +1,140 @@
+import unittest
+from unittest import mock
+from helpers.docdb import docDB
+from helpers.mongodb import LRUCache, _cache
+from helpers.memorydb import memoryDB, DuplicateKeyError
+from helpers.storage import StorageBackend
+from elements import Unit
+from testcases._wrapper import mongodb_only
+
+
+class SessionRecorder(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.client = self
+        self.calls = list()
+
+    def start_session(self):
+        return self
+
+    def start_transaction(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def get_collection(self, name):
+        collection = self.conn.get_collection(name)
+        recorder = self
+
+        class Recorded(object):
+            def __getattr__(self, operation):
+                def call(*args, **kwargs):
+                    recorder.calls.append((name, operation, kwargs.pop('session', None) is recorder))
+                    return getattr(collection, operation)(*args, **kwargs)
+                return call
+        return Recorded()
+
+
+class TestStorage(unittest.TestCase):
+    @mongodb_only
+    def test_transaction_deletion_of_default(self):
+        docDB.clear()
+        el1 = Unit({'name': 'mm'})
+        el1.save()
+        el2 = Unit({'name': 'pcs', 'default': True})
+        el2.save()
+        recorder = SessionRecorder(docDB.conn())
+        with docDB.identity_map():
+            self.assertTrue(docDB.get('Unit', el2['_id'])['default'])
+            with mock.patch.object(docDB, 'conn', return_value=recorder), mock.patch.object(docDB, '_transactions_supported', return_value=True):
+                self.assertEqual(Unit.delete_many([el2['_id']]), {'deleted': [el2['_id']]})
+            self.assertIsNone(docDB.get('Unit', el2['_id']))
+        # every read and write inside the transaction ran in its session, the version bump follows the commit
+        self.assertIn(('Unit', 'find_one', True), recorder.calls)
+        self.assertIn(('Unit', 'update_one', True), recorder.calls)
+        self.assertEqual([c for c in recorder.calls if not c[2]], [('_versions', 'bulk_write', False)])
+        el1.reload()
+        self.assertTrue(el1['default'])
+
+    def test_storage_backend_is_abstract(self):
+        with self.assertRaises(TypeError):
+            StorageBackend()
+        self.assertIn('_bump', StorageBackend.__abstractmethods__)
+        self.assertIn('versions', StorageBackend.__abstractmethods__)
+
+    def test_memory_engine(self):
+        db = memoryDB()
+        db.clear()
+        for i in range(6):
+            db.create('Unit', {'name': f'u{i}', 'group': i % 3, 'amount': i, 'layers': list()})
+        self.assertEqual(db.ensure_index('Unit', ('group', 'amount')), 'group_1_amount_1')
+        db.ensure_index('Unit', ('name',), unique=True)
+        self.assertEqual([u['name'] for u in db.search_many('Unit', {'group': 1})], ['u1', 'u4'])
+        self.assertEqual([u['name'] for u in db.search_many('Unit', {'group': {'$in': [0, 2]}, 'amount': {'$gt': 2}})], ['u3', 'u5'])
+        self.assertEqual([u['name'] for u in db.search_many('Unit', {'amount': {'$lt': 2}, 'name': {'$ne': 'u0'}})], ['u1'])
+        self.assertEqual(db.index_usage('Unit')['group_1_amount_1'], 2)
+        result = db.search_many('Unit', {}, fields=['name'], sort=[('amount', -1)], limit=2)
+        self.assertEqual(result, [{'_id': result[0]['_id'], 'name': 'u5'}, {'_id': result[1]['_id'], 'name': 'u4'}])
+        self.assertEqual(db.sum('Unit', 'amount', {'group': 0}), 3)
+        self.assertEqual(db.sum_grouped('Unit', 'amount', 'group'), {0: 3, 1: 5, 2: 7})
+        self.assertEqual(db.count('Unit', {'group': {'$nin': [0]}}), 4)
+        u = db.search_one('Unit', {'name': 'u1'})
+        db.update('Unit', u['_id'], {'$inc': {'amount': 10}, '$push': {'layers': {'_id': 'a'}}})
+        db.update('Unit', u['_id'], {'$push': {'layers': {'_id': 'b'}}})
+        db.update('Unit', u['_id'], {'$pull': {'layers': {'_id': {'$in': ['a']}}}})
+        u = db.get('Unit', u['_id'])
+        self.assertEqual((u['amount'], u['layers']), (11, [{'_id': 'b'}]))
+        self.assertEqual([u['name'] for u in db.search_many('Unit', {'group': 1, 'amount': 11})], ['u1'])
+        self.assertTrue(db.update_one('Unit', {'group': 2}, {'$set': {'group': 1}}))
+        self.assertFalse(db.update_one('Unit', {'group': 1, 'amount': 11}, {'$set': {'group': 1}}))
+        self.assertEqual(db.count('Unit', {'group': 1}), 3)
+        version = db.versions(['Unit'])['Unit']
+        with self.assertRaises(DuplicateKeyError):
+            db.replace('Unit', {**u, '_id': 'other'})
+        self.assertEqual(db.versions(['Unit'])['Unit'], version + 1)
+        duplicate = {**u, '_id': None}
+        self.assertEqual(list(db.write_many('Unit', [duplicate, {'name': 'u9', 'group': 3}])), [0])
+        self.assertIsNone(duplicate['_id'])
+        db.delete_many('Unit', {'group': 1})
+        self.assertEqual(db.count('Unit', {}), 4)
+        self.assertEqual(db.search_many('Unit', {'group': 1}), list())
+        db.clear()
+
+    @mongodb_only
+    def test_reference_cache(self):
+        docDB.clear()
+        element = Unit({'name': 'Name1'})
+        element.save()
+        self.assertTrue(docDB.exists('Unit', element['_id']))
+        hits = _cache.hits
+        self.assertTrue(docDB.exists('Unit', element['_id']))
+        self.assertEqual(_cache.hits, hits + 1)
+        # cached documents are handed out as copies
+        docDB.get('Unit', element['_id'])['name'] = 'changed'
+        self.assertEqual(docDB.get('Unit', element['_id'])['name'], 'Name1')
+        # writes invalidate the cached document
+        element['name'] = 'Name2'
+        element.save()
+        self.assertEqual(docDB.get('Unit', element['_id'])['name'], 'Name2')
+        element.delete()
+        self.assertFalse(docDB.exists('Unit', element['_id']))
+
+    def test_reference_cache_bounds(self):
+        cache = LRUCache(2, 60)
+        for i in range(3):
+            cache.set('Unit', i, {'_id': i}, cache.generation('Unit'))
+        self.assertIsNone(cache.get('Unit', 0))
+        self.assertEqual(cache.get('Unit', 2), {'_id': 2})
+        # outdated reads are not cached
+        generation = cache.generation('Unit')
+        cache.invalidate('Unit', 1)
+        cache.set('Unit', 1, {'_id': 1}, generation)
+        self.assertIsNone(cache.get('Unit', 1))
+        # expired entries are dropped
+        cache = LRUCache(2, -1)
+        cache.set('Unit', 0, {'_id': 0}, cache.generation('Unit'))
+        self.assertIsNone(cache.get('Unit', 0))
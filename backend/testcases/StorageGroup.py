@@ -91,3 +91,11 @@ class TestStorageGroupApi(ApiTestBase):
     _post_valid = {'name': 'Name3'}
     _patch_valid = {'desc': 'Text'}
     _patch_invalid = {'desc': None}
+
+    def test_get_stock(self):
+        StorageLocation({'name': 'sl', 'storage_group_id': self.id1}).save()
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/stock/', method='GET')
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(result.json['storage_locations'], 1)
+        result = self.webapp_request(path=f'/{self._path}/{self.id2}/stock/', method='GET')
+        self.assertEqual(result.json['storage_locations'], 0)
@@ -1,6 +1,6 @@
 import unittest
 from helpers.docdb import docDB
-from elements import StorageGroup, StorageLocation, Unit, Category, Part, PartLocation
+from elements import StorageGroup, StorageLocation, Unit, Category, Part, PartLocation, StockChange
 from testcases._wrapper import ApiTestBase, setUpModule, tearDownModule
 
 
@@ -139,6 +139,122 @@ class TestStorageLocation(unittest.TestCase):
         self.assertEqual(len(PartLocation.all()), 0)
         self.assertEqual(len(PartLocation.all()), 0)
 
+    def test_deletion_cascade_plan(self):
+        docDB.clear()
+        u = Unit({'name': 'Name1'})
+        u.save()
+        c = Category({'name': 'Name1'})
+        c.save()
+        p = Part({'unit_id': u['_id'], 'category_id': c['_id'], 'name': 'somename1'})
+        p.save()
+        sl1 = StorageLocation({'name': 'Name1'})
+        sl1.save()
+        sl2 = StorageLocation({'name': 'Name2', 'parent_storage_location_id': sl1['_id']})
+        sl2.save()
+        sl3 = StorageLocation({'name': 'Name3'})
+        sl3.save()
+        pls = list()
+        for sl in [sl1, sl1, sl3]:
+            pl = PartLocation({'storage_location_id': sl['_id'], 'part_id': p['_id']})
+            pl.save()
+            pls.append(pl)
+            StockChange({'part_location_id': pl['_id'], 'amount': 5}).save()
+            StockChange({'part_location_id': pl['_id'], 'amount': -2}).save()
+        self.assertTrue(pls[0]['default'])
+        # dry run only reports what would be affected
+        result = sl1.delete(dry_run=True)
+        self.assertEqual(result['dry_run']['delete'], {'StorageLocation': 1, 'PartLocation': 2, 'StockChange': 4})
+        self.assertEqual(result['dry_run']['setnull']['StorageLocation.parent_storage_location_id'], 1)
+        self.assertEqual(len(PartLocation.all()), 3)
+        self.assertEqual(len(StockChange.all()), 6)
+        # the real deletion removes the whole subtree including the stock counters
+        self.assertNotIn('error', sl1.delete())
+        self.assertEqual(len(PartLocation.all()), 1)
+        self.assertEqual(len(StockChange.all()), 2)
+        self.assertEqual(len(list(docDB.search_many('PartLocationStock', {}))), 1)
+        sl2.reload()
+        self.assertIsNone(sl2['parent_storage_location_id'])
+        pls[2].reload()
+        self.assertTrue(pls[2]['default'])
+        self.assertEqual(pls[2].stock_level(), 3)
+
+    def test_deletion_call_budget(self):
+        docDB.clear()
+        u = Unit({'name': 'Name1'})
+        u.save()
+        c = Category({'name': 'Name1'})
+        c.save()
+        p = Part({'unit_id': u['_id'], 'category_id': c['_id'], 'name': 'somename1'})
+        p.save()
+        calls = list()
+        for n in [1, 10]:
+            sl = StorageLocation({'name': f'Name{n}'})
+            sl.save()
+            for i in range(n):
+                pl = PartLocation({'storage_location_id': sl['_id'], 'part_id': p['_id']})
+                pl.save()
+                StockChange({'part_location_id': pl['_id'], 'amount': 5}).save()
+            with docDB.call_log(threshold=3) as log:
+                self.assertNotIn('error', sl.delete())
+            self.assertEqual(log.repeated(), dict())
+            calls.append(log.calls)
+        # the cascade is set based, the amount of queries does not grow with the amount of children
+        self.assertEqual(calls[0], calls[1])
+
+    def test_stock_rollup(self):
+        docDB.clear()
+        u = Unit({'name': 'pcs'})
+        u.save()
+        c = Category({'name': 'cat'})
+        c.save()
+        p1 = Part({'name': 'p1', 'unit_id': u['_id'], 'category_id': c['_id']})
+        p1.save()
+        p2 = Part({'name': 'p2', 'unit_id': u['_id'], 'category_id': c['_id']})
+        p2.save()
+        group = StorageGroup({'name': 'group'})
+        group.save()
+        cabinet = StorageLocation({'name': 'cabinet', 'storage_group_id': group['_id']})
+        cabinet.save()
+        shelf = StorageLocation({'name': 'shelf', 'parent_storage_location_id': cabinet['_id']})
+        shelf.save()
+        box = StorageLocation({'name': 'box', 'parent_storage_location_id': shelf['_id']})
+        box.save()
+        other = StorageLocation({'name': 'other'})
+        other.save()
+        for sl, part, changes in [(cabinet, p1, [(10, 5.0), (-4, 0.0)]), (box, p1, [(2, 3.0)]), (box, p2, [(5, 1.0)]), (other, p2, [(7, 7.0)])]:
+            pl = PartLocation({'part_id': part['_id'], 'storage_location_id': sl['_id']})
+            pl.save()
+            for amount, price in changes:
+                StockChange({'part_location_id': pl['_id'], 'amount': amount, 'price': price}).save()
+        result = cabinet.stock()
+        self.assertEqual((result['storage_locations'], result['part_locations']), (3, 3))
+        self.assertEqual((result['stock_level'], result['stock_price']), (13, 7.0))
+        parts = dict((p['part_id'], p) for p in result['parts'])
+        self.assertEqual((parts[p1['_id']]['stock_level'], parts[p1['_id']]['stock_price']), (8, 6.0))
+        self.assertEqual((parts[p2['_id']]['stock_level'], parts[p2['_id']]['stock_price']), (5, 1.0))
+        self.assertEqual(shelf.stock()['stock_level'], 7)
+        self.assertEqual(group.stock(), result)
+        # moving the shelf moves its stock along
+        shelf['parent_storage_location_id'] = other['_id']
+        shelf.save()
+        self.assertEqual(cabinet.stock()['stock_level'], 6)
+        self.assertEqual(other.stock()['stock_level'], 14)
+        # the amount of queries does not depend on the depth of the tree
+        with docDB.call_log() as log:
+            other.stock()
+        self.assertEqual(log.calls, 3)
+        self.assertEqual(StorageGroup({'name': 'empty'}).stock()['parts'], [])
+
+    def test_parent_storage_location_id_deep_cycle(self):
+        docDB.clear()
+        parent = StorageLocation({'name': 'parent'})
+        parent.save()
+        child = StorageLocation({'name': 'child', 'parent_storage_location_id': parent['_id']})
+        child.save()
+        parent['parent_storage_location_id'] = child['_id']
+        result = parent.save()
+        self.assertIn('parent_storage_location_id', result['errors'])
+
 
 setup_module = setUpModule
 teardown_module = tearDownModule
@@ -152,3 +268,16 @@ class TestStorageLocationApi(ApiTestBase):
     _post_valid = {'name': 'Name3'}
     _patch_valid = {'desc': 'Text'}
     _patch_invalid = {'desc': None}
+
+    def test_get_stock(self):
+        child = StorageLocation({'name': 'child', 'parent_storage_location_id': self.id1})
+        child.save()
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/stock/', method='GET')
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(result.json, {'storage_locations': 2, 'part_locations': 0, 'stock_level': 0, 'stock_price': 0.0, 'parts': []})
+        result = self.webapp_request(path=f'/{self._path}/somerandomstring/stock/', method='GET')
+        self.assertTrue(result.status.startswith('404'), msg=f'should start with 404 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/unknown/', method='GET')
+        self.assertTrue(result.status.startswith('404'), msg=f'should start with 404 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/stock/', method='POST', data={})
+        self.assertTrue(result.status.startswith('405'), msg=f'should start with 405 but is {result.status}')
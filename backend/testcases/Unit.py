@@ -130,3 +130,21 @@ class TestUnitApi(ApiTestBase):
     _post_valid = {'name': 'cm'}
     _patch_valid = {'desc': 'Milli Meters'}
     _patch_invalid = {'default': 'typestring'}
+
+    def test_post_bulk_delete(self):
+        ids = [Unit({'name': f'unit{i}'}).save()['created'] for i in range(10)]
+        with docDB.call_log() as log:
+            result = self.webapp_request(path=f'/{self._path}/_bulk/', method='POST', data=[{'op': 'delete', 'id': i} for i in ids[:2]])
+        calls = log.calls
+        with docDB.call_log() as log:
+            result = self.webapp_request(path=f'/{self._path}/_bulk/', method='POST', data=[{'op': 'delete', 'id': i} for i in ids[2:]])
+        self.assertEqual(log.calls, calls)
+        self.assertEqual(result.json, [{'deleted': i} for i in ids[2:]])
+        # a restricted delete only fails its own operation
+        c = Category({'name': 'somecat'})
+        c.save()
+        Part({'name': 'somepart', 'unit_id': self.id1, 'category_id': c['_id']}).save()
+        result = self.webapp_request(path=f'/{self._path}/_bulk/', method='POST', data=[{'op': 'delete', 'id': self.id1}, {'op': 'delete', 'id': self.id2}])
+        self.assertIn('error', result.json[0])
+        self.assertEqual(result.json[1], {'deleted': self.id2})
+        self.assertEqual([u['_id'] for u in Unit.all()], [self.id1])
@@ -2,7 +2,7 @@ from .MountingStyle import TestMountingStyle, TestMountingStyleApi
 from .Footprint import TestFootprint, TestFootprintApi
 from .Category import TestCategory, TestCategoryApi
 from .Unit import TestUnit, TestUnitApi
-from .Part import TestPart, TestPartApi
+from .Part import TestPart, TestPartApi, TestPartAsyncApi
 from .Distributor import TestDistributor, TestDistributorApi
 from .PartDistributor import TestPartDistributor, TestPartDistributorApi
 from .StorageGroup import TestStorageGroup, TestStorageGroupApi
@@ -10,3 +10,7 @@ from .StorageLocation import TestStorageLocation, TestStorageLocationApi
 from .Order import TestOrder, TestOrderApi
 from .PartLocation import TestPartLocation, TestPartLocationApi
 from .StockChange import TestStockChange, TestStockChangeApi
+from .Storage import TestStorage
+from .Health import TestHealth, TestHealthApi
+from .Metrics import TestMetrics, TestMetricsApi
+from .FastJson import TestFastJson
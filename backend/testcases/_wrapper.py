@@ -2,8 +2,12 @@ import io
 import unittest
 import json
 import cherrypy
+from urllib.parse import urlencode
 from cherrypy.lib import httputil
 from i4p import Inventory4Parts, docDB
+from helpers.mongodb import mongoDB
+
+mongodb_only = unittest.skipUnless(isinstance(docDB, mongoDB), 'needs the mongodb storage engine')
 
 
 def setUpModule():
@@ -21,8 +25,8 @@ def tearDownModule():
 
 
 class ApiBase(unittest.TestCase):
-    def webapp_request(self, path='/', method='POST', data=None, **kwargs):
-        headers = [('Host', '127.0.0.1')]
+    def webapp_request(self, path='/', method='POST', data=None, query=None, headers=None, **kwargs):
+        headers = [('Host', '127.0.0.1')] + list((headers or dict()).items())
         local = httputil.Host('127.0.0.1', 50000, '')
         remote = httputil.Host('127.0.0.1', 50001, '')
 
@@ -41,7 +45,7 @@ class ApiBase(unittest.TestCase):
         headers.append(('content-type', 'application/json'))
         headers.append(('content-length', f'{len(qs)}'))
         fd = io.BytesIO(qs.encode())
-        qs = None
+        qs = None if query is None else urlencode(query)
 
         try:
             response = request.run(method.upper(), path, qs, 'HTTP/1.1', headers, fd)
@@ -96,6 +100,47 @@ class ApiTestBase(ApiBase):
         result = self.webapp_request(path=f'/{self._path}/', method='GET')
         self.assertEqual(len(result.json), 2)
 
+    def test_get_all_paginated(self):
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'limit': 1})
+        self.assertEqual(len(result.json), 1)
+        first = result.json[0]['id']
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'limit': 1, 'after': first})
+        self.assertEqual(len(result.json), 1)
+        self.assertNotEqual(result.json[0]['id'], first)
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'limit': 1, 'after': result.json[0]['id']})
+        self.assertEqual(len(result.json), 0)
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'limit': 0})
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'limit': 'some'})
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query=[('limit', 1), ('limit', 1)])
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+
+    def test_get_all_fields(self):
+        k = list(self._setup_el1.keys())[0]
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': k})
+        self.assertEqual(len(result.json), 2)
+        for el in result.json:
+            self.assertEqual(set(el.keys()), {'id', k})
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'fields': 'somefield'})
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query=[('fields', k), ('fields', k)])
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+
+    def test_get_all_filtered(self):
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'id': self.id1})
+        self.assertEqual([el['id'] for el in result.json], [self.id1])
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'id[in]': f'{self.id1},{self.id2}', 'sort': '-id'})
+        self.assertEqual([el['id'] for el in result.json], sorted([self.id1, self.id2], reverse=True))
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'count': 1})
+        self.assertEqual(result.json, {'count': 2})
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', query={'count': 1, 'id[ne]': self.id1})
+        self.assertEqual(result.json, {'count': 1})
+        for query in [{'somefield': 1}, {'id[like]': 1}, {'sort': 'somefield'}, {'sort': '-id', 'after': self.id1},
+                      [('count', 1), ('count', 1)], [('sort', 'id'), ('sort', '-id')], [('after', self.id1), ('after', self.id2)]]:
+            result = self.webapp_request(path=f'/{self._path}/', method='GET', query=query)
+            self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+
     def test_get_single(self):
         result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='GET')
         k = list(self._setup_el1.keys())[0]
@@ -103,6 +148,35 @@ class ApiTestBase(ApiBase):
         result = self.webapp_request(path=f'/{self._path}/something/', method='GET')
         self.assertTrue(result.status.startswith('404'), msg=f'should start with 404 but is {result.status}')
 
+    def test_db_calls_header(self):
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='GET')
+        self.assertGreater(int(result.headers['X-DB-Calls']), 0)
+
+    def test_etag(self):
+        result = self.webapp_request(path=f'/{self._path}/', method='GET')
+        etag = result.headers['ETag']
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': etag})
+        self.assertTrue(result.status.startswith('304'), msg=f'should start with 304 but is {result.status}')
+        self.assertEqual(b''.join(result.body), b'')
+        self.assertEqual(result.headers['X-DB-Calls'], '1')
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='GET', headers={'If-None-Match': f'"other", {etag}'})
+        self.assertTrue(result.status.startswith('304'), msg=f'should start with 304 but is {result.status}')
+        self.webapp_request(path=f'/{self._path}/{self.id1}/', method='PATCH', data=self._patch_valid)
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': etag})
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertNotEqual(result.headers['ETag'], etag)
+        result = self.webapp_request(path=f'/{self._path}/somerandomstring/', method='GET')
+        self.assertNotIn('ETag', result.headers)
+        # a matching or wildcard If-None-Match does not hide a missing element
+        etag = self.webapp_request(path=f'/{self._path}/', method='GET').headers['ETag']
+        for match in [etag, '*']:
+            result = self.webapp_request(path=f'/{self._path}/somerandomstring/', method='GET', headers={'If-None-Match': match})
+            self.assertTrue(result.status.startswith('404'), msg=f'should start with 404 but is {result.status}')
+            result = self.webapp_request(path=f'/{self._path}/{self.id1}/somerandomstring/', method='GET', headers={'If-None-Match': match})
+            self.assertTrue(result.status.startswith('404'), msg=f'should start with 404 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/', method='GET', headers={'If-None-Match': '*'})
+        self.assertTrue(result.status.startswith('304'), msg=f'should start with 304 but is {result.status}')
+
     def test_post_all(self):
         self.assertEqual(len(self._element.all()), 2)
         result = self.webapp_request(path=f'/{self._path}/', method='POST')
@@ -115,6 +189,33 @@ class ApiTestBase(ApiBase):
         self.assertTrue(result.status.startswith('201'), msg=f'should start with 201 but is {result.status}')
         self.assertEqual(len(self._element.all()), 3)
 
+    def test_post_bulk(self):
+        result = self.webapp_request(path=f'/{self._path}/_bulk/', method='POST', data=[
+            {'op': 'create', 'data': self._post_valid},
+            {'op': 'create', 'data': {**self._post_valid, **self._patch_invalid}},
+            {'op': 'patch', 'id': self.id1, 'data': self._patch_valid},
+            {'op': 'delete', 'id': self.id2},
+            {'op': 'patch', 'id': 'something', 'data': self._patch_valid},
+            {'op': 'patch', 'id': self.id2, 'data': self._patch_valid},
+            {'op': 'something'}])
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(len(result.json), 7)
+        self.assertIn('created', result.json[0])
+        self.assertIn('errors', result.json[1])
+        self.assertEqual(result.json[2], {'updated': self.id1})
+        self.assertEqual(result.json[3], {'deleted': self.id2})
+        for r in result.json[4:]:
+            self.assertIn('error', r)
+        self.assertEqual(len(self._element.all()), 2)
+        el = self._element.get(self.id1)
+        k = list(self._patch_valid.keys())[0]
+        self.assertEqual(el[k], self._patch_valid[k])
+        result = self.webapp_request(path=f'/{self._path}/_bulk/', method='POST', data={'op': 'create'})
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        result = self.webapp_request(path=f'/{self._path}/_bulk/', method='GET')
+        self.assertTrue(result.status.startswith('405'), msg=f'should start with 405 but is {result.status}')
+        self.assertIn('POST', result.headers['Allow'])
+
     def test_post_single(self):
         result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='POST')
         self.assertTrue(result.status.startswith('405'), msg=f'should start with 405 but is {result.status}')
@@ -133,6 +234,15 @@ class ApiTestBase(ApiBase):
         result = self.webapp_request(path=f'/{self._path}/{self.id2}/', method='DELETE')
         self.assertEqual(len(self._element.all()), 0)
 
+    def test_delete_dry_run(self):
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='DELETE', query={'dry_run': '1'})
+        self.assertTrue(result.status.startswith('200'), msg=f'should start with 200 but is {result.status}')
+        self.assertEqual(result.json['dry_run']['delete'][self._element.__name__], 1)
+        self.assertEqual(len(self._element.all()), 2)
+        result = self.webapp_request(path=f'/{self._path}/{self.id1}/', method='DELETE', query=[('dry_run', '1'), ('dry_run', '1')])
+        self.assertTrue(result.status.startswith('400'), msg=f'should start with 400 but is {result.status}')
+        self.assertEqual(len(self._element.all()), 2)
+
     def test_patch_all(self):
         result = self.webapp_request(path=f'/{self._path}/', method='PATCH')
         self.assertTrue(result.status.startswith('405'), msg=f'should start with 405 but is {result.status}')